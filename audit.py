@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Audit log of whitelist lifecycle events, kept in a capped Redis Stream.
+
+Entries use short field names:
+    e   event (validated, moved, session, removed, revoked, flushed,
+        expiry_warned, gc_removed, attack_mode, fw_add, fw_add_many,
+        fw_remove, fw_flush, fw_reload, imported)
+    s   source process (bot, web, agent)
+    ip  IP address          d   Discord id        n  Discord name
+    by  admin who acted     x   free-form detail
+The entry ID carries the timestamp. The stream is capped at AUDIT_MAXLEN
+entries on write and trimmed to AUDIT_RETENTION_DAYS by the bot.
+
+Query usage:
+    python3 audit.py [--ip IP] [--discord-id ID] [--event EVENT]
+                     [--since 24h|7d|2026-10-01] [--until ...] [--limit 50]
+"""
+
+import argparse
+import logging
+import time
+from datetime import datetime
+
+import config
+
+log = logging.getLogger(__name__)
+
+_redis = None
+_source = "bot"
+
+STREAM_KEY = "whitelist:audit"
+FIELDS = ("e", "s", "ip", "d", "n", "by", "x")
+
+
+def init(redis_client, source: str = "bot"):
+    global _redis, _source
+    _redis = redis_client
+    _source = source
+
+
+def entry(event: str, ip: str | None = None, discord_id: str | None = None,
+          name: str | None = None, by: str | None = None, detail: str | None = None) -> dict:
+    """A stream entry for record_many()."""
+    fields = {"e": event, "s": _source}
+    for field, value in (("ip", ip), ("d", discord_id), ("n", name), ("by", by), ("x", detail)):
+        if value:
+            fields[field] = str(value)
+    return fields
+
+
+def record_many(entries: list[dict]) -> None:
+    """Append entries in one round trip; failures are logged and never raised to the caller."""
+    if not entries:
+        return
+    try:
+        pipe = _redis.pipeline(transaction=False)
+        for fields in entries:
+            pipe.xadd(STREAM_KEY, fields, maxlen=config.AUDIT_MAXLEN, approximate=True)
+        pipe.execute()
+    except Exception as e:
+        log.error("Failed to record %d audit events (%s): %s", len(entries), entries[0]["e"], e)
+
+
+def record(event: str, ip: str | None = None, discord_id: str | None = None,
+           name: str | None = None, by: str | None = None, detail: str | None = None) -> None:
+    """Append an event; failures are logged and never raised to the caller."""
+    record_many([entry(event, ip, discord_id, name, by, detail)])
+
+
+def trim() -> int:
+    """Drop entries older than AUDIT_RETENTION_DAYS; returns entries removed."""
+    if config.AUDIT_RETENTION_DAYS <= 0:
+        return 0
+    cutoff_ms = int((time.time() - config.AUDIT_RETENTION_DAYS * 86400) * 1000)
+    return _redis.xtrim(STREAM_KEY, minid=cutoff_ms, approximate=True)
+
+
+def query(ip: str | None = None, discord_id: str | None = None, event: str | None = None,
+          since: float | None = None, until: float | None = None,
+          limit: int = 50, max_scan: int = 100_000) -> list[dict]:
+    """Newest-first entries matching all given filters.
+
+    The time range is applied by the stream ID range; other filters are
+    applied while reading backwards in batches, stopping after max_scan entries.
+    """
+    high = str(int(until * 1000)) if until else "+"
+    low = str(int(since * 1000)) if since else "-"
+    results = []
+    scanned = 0
+    while len(results) < limit and scanned < max_scan:
+        batch = _redis.xrevrange(STREAM_KEY, max=high, min=low, count=1000)
+        if not batch:
+            break
+        for entry_id, fields in batch:
+            if ip and fields.get("ip") != ip:
+                continue
+            if discord_id and fields.get("d") != discord_id:
+                continue
+            if event and fields.get("e") != event:
+                continue
+            results.append({"ts": int(entry_id.split("-")[0]) / 1000, **fields})
+            if len(results) == limit:
+                break
+        scanned += len(batch)
+        if len(batch) < 1000:
+            break
+        high = f"({batch[-1][0]}"
+    return results
+
+
+def parse_time(value: str) -> float:
+    """Unix time from a relative age ("90m", "24h", "7d") or an ISO date/time."""
+    units = {"m": 60, "h": 3600, "d": 86400}
+    if value[-1:] in units and value[:-1].isdigit():
+        return time.time() - int(value[:-1]) * units[value[-1]]
+    return datetime.fromisoformat(value).timestamp()
+
+
+def format_entry(entry: dict) -> str:
+    when = datetime.fromtimestamp(entry["ts"]).strftime("%Y-%m-%d %H:%M:%S")
+    parts = [when, f"{entry.get('e', '?'):<13}", f"[{entry.get('s', '?')}]"]
+    if entry.get("ip"):
+        parts.append(entry["ip"])
+    if entry.get("d") or entry.get("n"):
+        parts.append(f"{entry.get('n', '')} ({entry.get('d', '?')})")
+    if entry.get("by"):
+        parts.append(f"by {entry['by']}")
+    if entry.get("x"):
+        parts.append(f"- {entry['x']}")
+    return " ".join(parts)
+
+
+def main():
+    import redis_conn
+
+    parser = argparse.ArgumentParser(description="Query the whitelist audit log")
+    parser.add_argument("--ip")
+    parser.add_argument("--discord-id")
+    parser.add_argument("--event")
+    parser.add_argument("--since", help='e.g. "24h", "7d" or "2026-10-01T12:00"')
+    parser.add_argument("--until")
+    parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args()
+
+    init(redis_conn.connect(), source="cli")
+    entries = query(
+        ip=args.ip, discord_id=args.discord_id, event=args.event,
+        since=parse_time(args.since) if args.since else None,
+        until=parse_time(args.until) if args.until else None,
+        limit=args.limit,
+    )
+    for entry in entries:
+        print(format_entry(entry))
+    if not entries:
+        print("no entries")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Export and import whitelist state (active IPs and sessions) as JSONL.
+
+One JSON object per line, "type" being "active" or "session", tagged
+with its server profile; sessions carry their absolute expiry so the
+remaining TTL is preserved. Both directions stream in batches, so memory
+stays flat for any whitelist size. Importing rebuilds the indexes and
+sends the imported IPs of each profile to the firewall agent in a single
+batched enqueue.
+
+Exports are not atomic snapshots: records created, renewed or removed
+while an export runs may or may not be included. Stop the bot and the
+portal first for an exact copy.
+
+Usage:
+    python3 backup.py export [-o whitelist.jsonl]
+    python3 backup.py import [-i whitelist.jsonl] [--no-firewall]
+"""
+
+import argparse
+import json
+import logging
+import sys
+import time
+
+import audit
+import firewall
+import prefixset
+import redis_conn
+import store
+
+log = logging.getLogger(__name__)
+
+
+def export(out, batch_size: int) -> dict[str, int]:
+    counts = {"active": 0, "session": 0}
+    for record in store.export_records(batch_size):
+        out.write(json.dumps(record, separators=(",", ":")) + "\n")
+        counts[record["type"]] += 1
+    return counts
+
+
+def read_records(lines):
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            log.warning("Skipping invalid JSON on line %d", number)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Export/import whitelist state as JSONL")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export_help = "write active IPs and sessions (not atomic: changes made meanwhile may be missed)"
+    export_parser = sub.add_parser("export", help=export_help, description=export_help)
+    export_parser.add_argument("-o", "--output", default="-", help="file to write (default: stdout)")
+    import_parser = sub.add_parser("import", help="load an export back into Redis")
+    import_parser.add_argument("-i", "--input", default="-", help="file to read (default: stdin)")
+    import_parser.add_argument("--no-firewall", action="store_true", help="do not enqueue ipset adds")
+    for p in (export_parser, import_parser):
+        p.add_argument("--batch", type=int, default=1000, help="records per pipeline")
+    args = parser.parse_args()
+
+    r = redis_conn.connect()
+    store.init(r)
+    firewall.init(r)
+    audit.init(r, source="cli")
+    started = time.monotonic()
+
+    if args.command == "export":
+        if args.output == "-":
+            counts = export(sys.stdout, args.batch)
+        else:
+            with open(args.output, "w", encoding="utf-8") as f:
+                counts = export(f, args.batch)
+        log.info("Exported %d active IPs and %d sessions in %.1fs",
+                 counts["active"], counts["session"], time.monotonic() - started)
+        return
+
+    if args.input == "-":
+        counts, ips = store.import_records(read_records(sys.stdin), args.batch)
+    else:
+        with open(args.input, encoding="utf-8") as f:
+            counts, ips = store.import_records(read_records(f), args.batch)
+    enqueued = 0
+    if not args.no_firewall:
+        prefixset.load()
+        for profile, profile_ips in ips.items():
+            enqueued += firewall.add_many(profile_ips, profile)
+    log.info(
+        "Imported %d active IPs and %d sessions (%d expired, %d invalid skipped) in %.1fs; %d IPs sent to the firewall",
+        counts["active"], counts["session"], counts["expired"], counts["invalid"],
+        time.monotonic() - started, enqueued,
+    )
+    audit.record("imported", detail=f"{counts['active']} active, {counts['session']} sessions")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,24 @@
+import asyncio
 import json
 import logging
 import re
-import secrets
 import time
 
 import discord
 from discord import app_commands
 from discord.ext import tasks
 
+import audit
+import challenge
 import config
+import events
 import firewall
+import metrics
+import notifier
+import prefixset
+import profiles
+import session_tokens
+import store
 
 log = logging.getLogger(__name__)
 
@@ -21,21 +30,52 @@ _redis = None
 def init(redis_client):
     global _redis
     _redis = redis_client
+    config.on_reload(_reschedule_tasks)
 
 
-intents = discord.Intents.default()
-intents.message_content = True
+def _reschedule_tasks() -> None:
+    """Apply reloaded task intervals (config reload callback, runs off the event loop)."""
+    def apply():
+        check_expiring_sessions.change_interval(seconds=config.SESSION_CHECK_INTERVAL)
+        sweep_expired_actives.change_interval(seconds=config.ACTIVE_GC_INTERVAL)
 
+    if client.is_ready():
+        client.loop.call_soon_threadsafe(apply)
+    else:
+        apply()
+
+
+def _intents() -> discord.Intents:
+    """Gateway intents for the current config.
+
+    Codes arrive through /codigo and the button modal; guild messages and
+    their content are only needed for the optional typed-code fallback.
+    """
+    intents = discord.Intents.default()
+    intents.message_content = config.DISCORD_MESSAGE_FALLBACK
+    intents.guild_messages = config.DISCORD_MESSAGE_FALLBACK
+    return intents
+
+
+intents = _intents()
 client = discord.Client(intents=intents)
 tree = app_commands.CommandTree(client)
 
 
+_background_tasks: set[asyncio.Task] = set()
+
+
+def _spawn(coro) -> None:
+    """Run a coroutine in the background, keeping a reference until it ends."""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
 def _log_webhook(title: str, description: str, color: int = 0x00FF00):
-    """Send a log embed to the configured webhook, if any."""
+    """Send a log embed to the configured webhook, if any, without blocking the event loop."""
     if not config.LOG_WEBHOOK:
         return
-    import urllib.request
-
     payload = json.dumps({
         "embeds": [{
             "title": title,
@@ -44,6 +84,12 @@ def _log_webhook(title: str, description: str, color: int = 0x00FF00):
             "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
         }]
     })
+    _spawn(asyncio.to_thread(_post_webhook, payload))
+
+
+def _post_webhook(payload: str) -> None:
+    import urllib.request
+
     req = urllib.request.Request(
         config.LOG_WEBHOOK,
         data=payload.encode(),
@@ -62,6 +108,8 @@ def _log_webhook(title: str, description: str, color: int = 0x00FF00):
 @client.event
 async def on_ready():
     log.info("Discord bot logged in as %s", client.user)
+    # Re-attach the persistent "Inserir codigo" button after restarts
+    client.add_view(CodeEntryView())
     if config.DISCORD_GUILD_ID:
         guild = discord.Object(id=config.DISCORD_GUILD_ID)
         tree.copy_global_to(guild=guild)
@@ -70,81 +118,111 @@ async def on_ready():
         await tree.sync()
     log.info("Slash commands synced")
 
+    # Active IPs whitelisted before the active index existed (no-op after first run)
+    try:
+        await asyncio.to_thread(store.backfill_active_index)
+    except Exception as e:
+        log.error("Failed to backfill active index: %s", e)
+
     # Start the session expiry checker
     if not check_expiring_sessions.is_running():
         check_expiring_sessions.start()
         log.info("Session expiry checker started (interval: %ds)", config.SESSION_CHECK_INTERVAL)
 
+    if not sweep_expired_actives.is_running():
+        sweep_expired_actives.start()
+        log.info("Active IP collector started (interval: %ds, grace: %ds)",
+                 config.ACTIVE_GC_INTERVAL, config.ACTIVE_GC_GRACE)
+
+
+dm_dispatcher = notifier.DMDispatcher(
+    client,
+    concurrency=config.DM_CONCURRENCY,
+    max_retries=config.DM_MAX_RETRIES,
+)
+
+
+def _with_profile(ip: str, profile: str) -> str:
+    """IP label for admin messages; IPs outside the default profile name it."""
+    return ip if profile == profiles.DEFAULT else f"{ip} ({profile})"
+
+
+def _expiry_embed(ttl: int, profile: str | None = None) -> discord.Embed:
+    days_remaining = ttl // 86400
+    hours_remaining = (ttl % 86400) // 3600
+    embed = discord.Embed(
+        title="⚠️ Acesso prestes a expirar!",
+        description=(
+            f"Seu acesso ao servidor **Elysius RP** vai expirar em "
+            f"**{days_remaining} dia(s) e {hours_remaining} hora(s)**.\n\n"
+            f"Para renovar, basta acessar o portal:\n{profiles.portal_url(profile)}\n\n"
+            f"Se você estiver jogando quando expirar, será desconectado."
+        ),
+        color=0xFFA500,
+    )
+    embed.set_footer(text="Elysius RP | Sistema de Whitelist")
+    return embed
+
 
 @tasks.loop(seconds=config.SESSION_CHECK_INTERVAL)
 async def check_expiring_sessions():
     """Check for sessions about to expire and send DM warnings."""
     try:
-        warned_key = "whitelist:warned_sessions"
+        # Only the due range of the expiry index is read
+        due = await asyncio.to_thread(store.due_sessions, config.SESSION_WARNING_THRESHOLD)
+
+        # One warning per Discord user, for their soonest-expiring session
+        by_user: dict[int, list[tuple[str, dict, float]]] = {}
+        for token, session_data, expires_at in due:
+            discord_id = session_data.get("discord_id")
+            if not discord_id or expires_at <= time.time():
+                continue
+            by_user.setdefault(int(discord_id), []).append((token, session_data, expires_at))
+
+        if not by_user:
+            return
 
-        # Scan all session keys
-        for key in _redis.scan_iter("whitelist:session:*"):
-            ttl = _redis.ttl(key)
-            if ttl <= 0:
+        messages = {}
+        for user_id, entries in by_user.items():
+            _, session_data, expires_at = min(entries, key=lambda e: e[2])
+            ttl = int(expires_at - time.time())
+            messages[user_id] = {"embed": _expiry_embed(max(ttl, 0), session_data.get("profile"))}
+
+        outcomes = await dm_dispatcher.dispatch(messages)
+
+        warned, audit_entries = [], []
+        for user_id, outcome in outcomes.items():
+            entries = by_user[user_id]
+            token, session_data, expires_at = min(entries, key=lambda e: e[2])
+            discord_name = session_data.get("discord_name")
+            if outcome == "failed":
+                continue  # retried on the next run
+
+            # Mark as warned (expires with each session's current expiry).
+            # Users with DMs disabled are marked too, so they are not retried every run.
+            warned.extend((entry_token, entry_expires_at) for entry_token, _, entry_expires_at in entries)
+
+            if outcome == "forbidden":
+                log.warning("Cannot send DM to %s (DMs disabled)", discord_name)
                 continue
 
-            # Check if TTL is within warning threshold
-            if ttl <= config.SESSION_WARNING_THRESHOLD:
-                token = key.split(":")[-1]
-
-                # Check if we already warned this session
-                if _redis.sismember(warned_key, token):
-                    continue
-
-                raw = _redis.get(key)
-                if not raw:
-                    continue
-
-                session_data = json.loads(raw)
-                discord_id = session_data.get("discord_id")
-                discord_name = session_data.get("discord_name")
-                ip = session_data.get("ip")
-
-                if not discord_id:
-                    continue
-
-                # Calculate days remaining
-                days_remaining = ttl // 86400
-                hours_remaining = (ttl % 86400) // 3600
-
-                # Try to send DM
-                try:
-                    user = await client.fetch_user(int(discord_id))
-                    if user:
-                        embed = discord.Embed(
-                            title="⚠️ Acesso prestes a expirar!",
-                            description=(
-                                f"Seu acesso ao servidor **Elysius RP** vai expirar em "
-                                f"**{days_remaining} dia(s) e {hours_remaining} hora(s)**.\n\n"
-                                f"Para renovar, basta acessar o portal:\n{config.PORTAL_URL}\n\n"
-                                f"Se você estiver jogando quando expirar, será desconectado."
-                            ),
-                            color=0xFFA500,
-                        )
-                        embed.set_footer(text="Elysius RP | Sistema de Whitelist")
-                        await user.send(embed=embed)
-
-                        # Mark as warned (expires when session expires)
-                        _redis.sadd(warned_key, token)
-                        _redis.expire(warned_key, config.SESSION_TTL)
-
-                        log.info("Sent expiry warning to %s (TTL: %d days %d hours)",
-                                discord_name, days_remaining, hours_remaining)
-
-                        _log_webhook(
-                            "Aviso de Expiração Enviado",
-                            f"**Discord:** {discord_name}\n**IP:** `{ip}`\n**Tempo restante:** {days_remaining}d {hours_remaining}h",
-                            color=0xFFA500
-                        )
-                except discord.Forbidden:
-                    log.warning("Cannot send DM to %s (DMs disabled)", discord_name)
-                except Exception as e:
-                    log.error("Failed to send warning to %s: %s", discord_name, e)
+            ttl = int(expires_at - time.time())
+            days_remaining = ttl // 86400
+            hours_remaining = (ttl % 86400) // 3600
+            log.info("Sent expiry warning to %s (TTL: %d days %d hours)",
+                     discord_name, days_remaining, hours_remaining)
+            audit_entries.append(audit.entry("expiry_warned", ip=session_data.get("ip"), discord_id=str(user_id),
+                                             name=discord_name, detail=f"{days_remaining}d {hours_remaining}h"))
+
+            _log_webhook(
+                "Aviso de Expiração Enviado",
+                f"**Discord:** {discord_name}\n**IP:** `{session_data.get('ip')}`\n**Tempo restante:** {days_remaining}d {hours_remaining}h",
+                color=0xFFA500
+            )
+
+        await asyncio.to_thread(store.mark_warned_many, warned)
+        await asyncio.to_thread(audit.record_many, audit_entries)
+        log.info("Expiry warnings: %d users, totals %s", len(outcomes), dict(dm_dispatcher.counters))
 
     except Exception as e:
         log.error("Error in check_expiring_sessions: %s", e)
@@ -153,85 +231,168 @@ async def check_expiring_sessions():
 @check_expiring_sessions.before_loop
 async def before_check_expiring_sessions():
     await client.wait_until_ready()
+    # Sessions created before the expiry index existed (no-op after first run)
+    try:
+        await asyncio.to_thread(store.backfill_expiry_index)
+    except Exception as e:
+        log.error("Failed to backfill session expiry index: %s", e)
 
 
-@client.event
-async def on_message(message: discord.Message):
-    if message.author.bot:
+@tasks.loop(seconds=config.ACTIVE_GC_INTERVAL)
+async def sweep_expired_actives():
+    """Remove active records and ipset entries of IPs whose sessions expired."""
+    try:
+        removed = await asyncio.to_thread(store.sweep_expired_actives, config.ACTIVE_GC_GRACE)
+    except Exception as e:
+        log.error("Error in sweep_expired_actives: %s", e)
         return
 
-    if message.channel.id != config.DISCORD_CHANNEL_ID:
-        return
+    if removed:
+        metrics.incr("gc.reclaimed", len(removed))
+        log.info("Reclaimed %d expired active IPs", len(removed))
+        await asyncio.to_thread(audit.record_many,
+                                [audit.entry("gc_removed", ip=ip, detail=profile) for profile, ip in removed])
 
-    text = message.content.strip().upper()
+    try:
+        await asyncio.to_thread(audit.trim)
+    except Exception as e:
+        log.error("Failed to trim audit log: %s", e)
 
-    if not CODE_PATTERN.match(text):
-        return
 
-    code = text
-    key = f"whitelist:code:{code}"
-    raw = _redis.get(key)
+@sweep_expired_actives.before_loop
+async def before_sweep_expired_actives():
+    await client.wait_until_ready()
+    # IPs whitelisted before the active expiry index existed (no-op after first run)
+    try:
+        await asyncio.to_thread(store.backfill_active_expiry)
+    except Exception as e:
+        log.error("Failed to backfill active expiry index: %s", e)
 
-    if raw is None:
-        embed = discord.Embed(
-            title="Codigo invalido",
-            description="Codigo invalido ou expirado. Gere um novo no portal.",
-            color=0xFF0000,
-        )
-        await message.reply(embed=embed)
-        return
 
-    data = json.loads(raw)
-    ip = data["ip"]
+def _redeem_failed_embed() -> discord.Embed:
+    return discord.Embed(
+        title="Erro",
+        description="Falha ao liberar o IP. Contate um administrador.",
+        color=0xFF0000,
+    )
 
-    success = firewall.add_ip(ip)
 
-    if not success:
-        embed = discord.Embed(
-            title="Erro",
-            description="Falha ao liberar o IP. Contate um administrador.",
+async def _redeem(author: discord.abc.User, code: str) -> discord.Embed:
+    """Redeem a code for a Discord user and return the embed to reply with."""
+    # One read of the code serves the blocklist check and gives
+    # redeem_code the profile. The redeem script enqueues the firewall add
+    # itself, bypassing the blocklist check in firewall.add_ip, so blocked
+    # networks are refused first
+    try:
+        pending = await asyncio.to_thread(store.get_code, code)
+    except Exception as e:
+        log.error("Failed to read code %s: %s", code, e)
+        return _redeem_failed_embed()
+    if pending and prefixset.blocked(pending["ip"]):
+        log.warning("Refusing to redeem code %s for blocked IP %s (%s)", code, pending["ip"], author)
+        return discord.Embed(
+            title="Rede bloqueada",
+            description="A rede deste IP esta bloqueada (VPN/hospedagem). Contate um administrador.",
+            color=0xFF0000,
+        )
+
+    # Claims the code and writes active record, session, pending cookie,
+    # indexes and the firewall command in one atomic script
+    redeemed = None
+    if pending:
+        session_token = session_tokens.issue()
+        try:
+            redeemed = await asyncio.to_thread(
+                store.redeem_code, code, str(author.id), str(author), session_token, pending["profile"]
+            )
+        except Exception as e:
+            log.error("Failed to redeem code %s: %s", code, e)
+            return _redeem_failed_embed()
+
+    if redeemed is None:
+        return discord.Embed(
+            title="Codigo invalido",
+            description="Codigo invalido ou expirado. Gere um novo no portal.",
             color=0xFF0000,
         )
-        await message.reply(embed=embed)
-        return
 
-    _redis.delete(key)
+    ip, profile = redeemed
+    # Wake portal requests waiting on this IP (long-poll / SSE)
+    events.publish_validated(ip, profile)
+    await asyncio.to_thread(audit.record, "validated", ip=ip, discord_id=str(author.id), name=str(author),
+                            detail=profile)
 
-    active_data = json.dumps({
-        "discord_id": str(message.author.id),
-        "discord_name": str(message.author),
-        "timestamp": time.time(),
-    })
-    _redis.set(f"whitelist:active:{ip}", active_data)
-
-    # Create a session token for auto-renewal (cookie-based)
-    session_token = secrets.token_hex(32)
-    session_data = json.dumps({
-        "discord_id": str(message.author.id),
-        "discord_name": str(message.author),
-        "ip": ip,
-        "created_at": time.time(),
-    })
-    _redis.setex(f"whitelist:session:{session_token}", config.SESSION_TTL, session_data)
-    # Store pending cookie so the web server can set it on next page load
-    # Use SESSION_TTL so user can get the cookie anytime within session validity
-    _redis.setex(f"whitelist:pending_session:{ip}", config.SESSION_TTL, session_token)
+    _log_webhook(
+        "IP Liberado",
+        f"**IP:** `{_with_profile(ip, profile)}`\n**Discord:** {author} ({author.id})",
+    )
+
+    log.info("IP %s whitelisted on %s by %s (%s)", ip, profile, author, author.id)
 
+    server = "" if profile == profiles.DEFAULT else f" `{profile}`"
     embed = discord.Embed(
         title="IP Liberado!",
-        description=f"Seu IP foi liberado com sucesso.\nVoce ja pode conectar no servidor FiveM.\n\nCaso nao consiga acessar a cidade, entre no portal: {config.PORTAL_URL}",
+        description=f"Seu IP foi liberado com sucesso.\nVoce ja pode conectar no servidor FiveM{server}.\n\nCaso nao consiga acessar a cidade, entre no portal: {profiles.portal_url(profile)}",
         color=0x00FF00,
     )
-    embed.set_footer(text=f"Liberado por ElysiusRP")
-    embed.timestamp = message.created_at
-    await message.reply(embed=embed)
+    embed.set_footer(text="Liberado por ElysiusRP")
+    embed.timestamp = discord.utils.utcnow()
+    return embed
 
-    _log_webhook(
-        "IP Liberado",
-        f"**IP:** `{ip}`\n**Discord:** {message.author} ({message.author.id})",
-    )
 
-    log.info("IP %s whitelisted by %s (%s)", ip, message.author, message.author.id)
+class CodeModal(discord.ui.Modal, title="Liberar acesso"):
+    code = discord.ui.TextInput(label="Codigo do portal", min_length=4, max_length=4, placeholder="AB12")
+
+    async def on_submit(self, interaction: discord.Interaction):
+        text = self.code.value.strip().upper()
+        if not CODE_PATTERN.match(text):
+            await interaction.response.send_message("Codigo invalido. Use o codigo de 4 caracteres do portal.", ephemeral=True)
+            return
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        await interaction.followup.send(embed=await _redeem(interaction.user, text), ephemeral=True)
+
+
+class CodeEntryView(discord.ui.View):
+    """Persistent button on the pinned message in the code channel."""
+
+    def __init__(self):
+        super().__init__(timeout=None)
+
+    @discord.ui.button(label="Inserir codigo", style=discord.ButtonStyle.success, custom_id="whitelist:enter_code")
+    async def enter_code(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await interaction.response.send_modal(CodeModal())
+
+
+@tree.command(name="codigo", description="Liberar seu IP com o codigo do portal")
+@app_commands.describe(codigo="Codigo de 4 caracteres mostrado no portal")
+async def submit_code(interaction: discord.Interaction, codigo: str):
+    text = codigo.strip().upper()
+    if not CODE_PATTERN.match(text):
+        await interaction.response.send_message("Codigo invalido. Use o codigo de 4 caracteres do portal.", ephemeral=True)
+        return
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    await interaction.followup.send(embed=await _redeem(interaction.user, text), ephemeral=True)
+
+
+@client.event
+async def on_message(message: discord.Message):
+    # Legacy path: codes typed in the channel. Needs the privileged
+    # message_content intent, only requested when DISCORD_MESSAGE_FALLBACK is on.
+    if not config.DISCORD_MESSAGE_FALLBACK:
+        return
+
+    if message.author.bot:
+        return
+
+    if profiles.for_channel(message.channel.id) is None:
+        return
+
+    text = message.content.strip().upper()
+
+    if not CODE_PATTERN.match(text):
+        return
+
+    await message.reply(embed=await _redeem(message.author, text))
 
 
 def _is_admin(interaction: discord.Interaction) -> bool:
@@ -243,53 +404,267 @@ def _is_admin(interaction: discord.Interaction) -> bool:
 whitelist_group = app_commands.Group(name="whitelist", description="Gerenciar whitelist de IPs")
 
 
+LIST_PAGE_SIZE = 25
+
+
+class WhitelistPager(discord.ui.View):
+    """Button navigation over the active index (cursor based, one bulk read per page)."""
+
+    def __init__(self, owner_id: int, ip_prefix: str = "", name: str = "", profile: str = profiles.DEFAULT):
+        super().__init__(timeout=300)
+        self.owner_id = owner_id
+        self.ip_prefix = ip_prefix
+        self.name = name
+        self.profile = profile
+        self.total = 0
+        self.cursors: list[str | None] = [None]  # start cursor of each visited page
+        self.next_cursor: str | None = None
+
+    async def render(self) -> discord.Embed:
+        entries, self.next_cursor = await asyncio.to_thread(
+            store.page_active, self.cursors[-1], LIST_PAGE_SIZE, self.ip_prefix, self.name, profile=self.profile
+        )
+        self.previous_page.disabled = len(self.cursors) == 1
+        self.next_page.disabled = self.next_cursor is None
+
+        lines = [f"`{ip}` - {info.get('discord_name', '?')}" for ip, info in entries]
+        filters = []
+        if self.ip_prefix:
+            filters.append(f"IP `{self.ip_prefix}*`")
+        if self.name:
+            filters.append(f"nome ~ `{self.name}`")
+
+        server = "" if self.profile == profiles.DEFAULT else f" - {self.profile}"
+        embed = discord.Embed(
+            title=f"Whitelist{server} ({self.total} IPs)",
+            description="\n".join(lines) or "Nenhum IP nesta pagina.",
+            color=0x3498DB,
+        )
+        footer = f"Pagina {len(self.cursors)}"
+        if filters:
+            footer += " | Filtro: " + ", ".join(filters)
+        embed.set_footer(text=footer)
+        return embed
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        return interaction.user.id == self.owner_id
+
+    @discord.ui.button(label="Anterior", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if len(self.cursors) > 1:
+            self.cursors.pop()
+        await interaction.response.edit_message(embed=await self.render(), view=self)
+
+    @discord.ui.button(label="Proxima", style=discord.ButtonStyle.primary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if self.next_cursor is not None:
+            self.cursors.append(self.next_cursor)
+        await interaction.response.edit_message(embed=await self.render(), view=self)
+
+
+PROFILE_CHOICES = [app_commands.Choice(name=name, value=name) for name in profiles.names()]
+
+
 @whitelist_group.command(name="list", description="Listar IPs liberados")
-async def whitelist_list(interaction: discord.Interaction):
+@app_commands.describe(nome="Filtrar por nome do Discord", ip="Filtrar por prefixo de IP",
+                       servidor="Servidor (padrao: principal)")
+@app_commands.choices(servidor=PROFILE_CHOICES)
+async def whitelist_list(interaction: discord.Interaction, nome: str = "", ip: str = "",
+                         servidor: app_commands.Choice[str] | None = None):
+    if not _is_admin(interaction):
+        await interaction.response.send_message("Sem permissao.", ephemeral=True)
+        return
+
+    await interaction.response.defer(ephemeral=True, thinking=True)
+
+    profile = servidor.value if servidor else profiles.DEFAULT
+    view = WhitelistPager(interaction.user.id, ip_prefix=ip.strip(), name=nome.strip(), profile=profile)
+    view.total = await asyncio.to_thread(store.count_active, view.ip_prefix, profile)
+
+    if not view.total:
+        await interaction.followup.send("Nenhum IP na whitelist.", ephemeral=True)
+        return
+
+    await interaction.followup.send(embed=await view.render(), view=view, ephemeral=True)
+
+
+@whitelist_group.command(name="remove", description="Remover um IP da whitelist")
+@app_commands.describe(ip="IP para remover", servidor="Servidor (padrao: principal)")
+@app_commands.choices(servidor=PROFILE_CHOICES)
+async def whitelist_remove(interaction: discord.Interaction, ip: str,
+                           servidor: app_commands.Choice[str] | None = None):
     if not _is_admin(interaction):
         await interaction.response.send_message("Sem permissao.", ephemeral=True)
         return
 
-    ips = firewall.list_ips()
+    profile = servidor.value if servidor else profiles.DEFAULT
+    success = firewall.remove_ip(ip, profile)
+    if success:
+        store.remove_active(ip, profile)
+        await asyncio.to_thread(audit.record, "removed", ip=ip, by=str(interaction.user), detail=profile)
+        await interaction.response.send_message(f"IP `{_with_profile(ip, profile)}` removido.", ephemeral=True)
+        _log_webhook("IP Removido", f"**IP:** `{_with_profile(ip, profile)}`\n**Por:** {interaction.user}", color=0xFF9900)
+    else:
+        await interaction.response.send_message(f"Falha ao remover `{ip}`.", ephemeral=True)
+
 
-    if not ips:
-        await interaction.response.send_message("Nenhum IP na whitelist.", ephemeral=True)
+@whitelist_group.command(name="painel", description="Publicar e fixar a mensagem com o botao de codigo")
+async def whitelist_panel(interaction: discord.Interaction):
+    if not _is_admin(interaction):
+        await interaction.response.send_message("Sem permissao.", ephemeral=True)
         return
 
-    lines = []
-    for ip in ips:
-        raw = _redis.get(f"whitelist:active:{ip}")
-        if raw:
-            info = json.loads(raw)
-            lines.append(f"`{ip}` - {info.get('discord_name', '?')}")
-        else:
-            lines.append(f"`{ip}` - (sem info)")
+    # The panel links to the portal of the profile whose code channel this is
+    profile = profiles.for_channel(interaction.channel_id) or profiles.DEFAULT
+    embed = discord.Embed(
+        title="Liberar acesso ao servidor",
+        description=(
+            f"1. Acesse o portal: {profiles.portal_url(profile)}\n"
+            "2. Copie o codigo de 4 caracteres\n"
+            "3. Clique em **Inserir codigo** abaixo (ou use `/codigo`)"
+        ),
+        color=0xC9A84C,
+    )
+    await interaction.response.send_message("Painel publicado.", ephemeral=True)
+    message = await interaction.channel.send(embed=embed, view=CodeEntryView())
+    try:
+        await message.pin()
+    except discord.HTTPException as e:
+        log.warning("Could not pin code panel: %s", e)
+
+
+@whitelist_group.command(name="ataque", description="Modo de ataque: exigir desafio antes de gerar codigos")
+@app_commands.describe(modo="on = sempre, off = nunca, auto = ativar sob alto volume")
+@app_commands.choices(modo=[app_commands.Choice(name=m, value=m) for m in challenge.MODES])
+async def whitelist_attack(interaction: discord.Interaction, modo: app_commands.Choice[str]):
+    if not _is_admin(interaction):
+        await interaction.response.send_message("Sem permissao.", ephemeral=True)
+        return
+
+    challenge.set_mode(modo.value)
+    await asyncio.to_thread(audit.record, "attack_mode", by=str(interaction.user), detail=modo.value)
+    await interaction.response.send_message(
+        f"Modo de ataque: `{modo.value}` (aplicado ao portal em ate {challenge.MODE_POLL_INTERVAL}s).",
+        ephemeral=True,
+    )
+    _log_webhook("Modo de Ataque", f"**Modo:** `{modo.value}`\n**Por:** {interaction.user}", color=0xFF9900)
+
+
+@whitelist_group.command(name="user", description="Listar sessoes e IPs de um usuario")
+@app_commands.describe(membro="Usuario do Discord")
+async def whitelist_user(interaction: discord.Interaction, membro: discord.User):
+    if not _is_admin(interaction):
+        await interaction.response.send_message("Sem permissao.", ephemeral=True)
+        return
+
+    sessions, ips = await asyncio.to_thread(store.list_user, str(membro.id))
+
+    if not sessions and not ips:
+        await interaction.response.send_message(f"Nenhuma sessao ou IP para {membro}.", ephemeral=True)
+        return
+
+    lines = [f"**IPs ativos ({len(ips)}):**"]
+    lines += [f"`{_with_profile(ip, profile)}`" for profile, ip in ips] or ["(nenhum)"]
+    lines.append(f"\n**Sessoes ({len(sessions)}):**")
+    for token, data in sessions.items():
+        ip = _with_profile(data.get("ip", "?"), data.get("profile", profiles.DEFAULT))
+        lines.append(f"`{token[:8]}...` - IP `{ip}`")
 
     description = "\n".join(lines)
     if len(description) > 4000:
         description = description[:4000] + "\n..."
 
-    embed = discord.Embed(
-        title=f"Whitelist ({len(ips)} IPs)",
-        description=description,
-        color=0x3498DB,
-    )
+    embed = discord.Embed(title=f"Whitelist de {membro}", description=description, color=0x3498DB)
     await interaction.response.send_message(embed=embed, ephemeral=True)
 
 
-@whitelist_group.command(name="remove", description="Remover um IP da whitelist")
-@app_commands.describe(ip="IP para remover")
-async def whitelist_remove(interaction: discord.Interaction, ip: str):
+@whitelist_group.command(name="revoke", description="Revogar todas as sessoes e IPs de um usuario")
+@app_commands.describe(membro="Usuario do Discord")
+async def whitelist_revoke(interaction: discord.Interaction, membro: discord.User):
     if not _is_admin(interaction):
         await interaction.response.send_message("Sem permissao.", ephemeral=True)
         return
 
-    success = firewall.remove_ip(ip)
-    if success:
-        _redis.delete(f"whitelist:active:{ip}")
-        await interaction.response.send_message(f"IP `{ip}` removido.", ephemeral=True)
-        _log_webhook("IP Removido", f"**IP:** `{ip}`\n**Por:** {interaction.user}", color=0xFF9900)
-    else:
-        await interaction.response.send_message(f"Falha ao remover `{ip}`.", ephemeral=True)
+    revoked, ips = await asyncio.to_thread(store.revoke_user, str(membro.id))
+    for profile, ip in ips:
+        await asyncio.to_thread(firewall.remove_ip, ip, profile)
+    ip_list = ", ".join(_with_profile(ip, profile) for profile, ip in ips) or "-"
+    await asyncio.to_thread(audit.record, "revoked", discord_id=str(membro.id), name=str(membro),
+                            by=str(interaction.user), detail=f"{revoked} sessions, IPs: {ip_list}")
+
+    await interaction.response.send_message(
+        f"{membro}: {revoked} sessao(oes) e {len(ips)} IP(s) revogados.", ephemeral=True
+    )
+    _log_webhook(
+        "Usuario Revogado",
+        f"**Discord:** {membro} ({membro.id})\n**Sessoes:** {revoked}\n**IPs:** {ip_list}\n**Por:** {interaction.user}",
+        color=0xFF0000,
+    )
+
+
+@whitelist_group.command(name="auditoria", description="Consultar o historico da whitelist")
+@app_commands.describe(ip="Filtrar por IP", membro="Filtrar por usuario do Discord", horas="Periodo em horas (padrao 24)")
+async def whitelist_audit(interaction: discord.Interaction, ip: str = "", membro: discord.User | None = None,
+                          horas: app_commands.Range[int, 1, 24 * 365] = 24):
+    if not _is_admin(interaction):
+        await interaction.response.send_message("Sem permissao.", ephemeral=True)
+        return
+
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    entries = await asyncio.to_thread(
+        audit.query,
+        ip=ip.strip() or None,
+        discord_id=str(membro.id) if membro else None,
+        since=time.time() - horas * 3600,
+        limit=25,
+    )
+    if not entries:
+        await interaction.followup.send("Nenhum evento encontrado.", ephemeral=True)
+        return
+
+    description = "\n".join(f"`{audit.format_entry(entry)}`" for entry in entries)
+    if len(description) > 4000:
+        description = description[:4000] + "\n..."
+    embed = discord.Embed(title=f"Auditoria ({len(entries)} eventos, ultimas {horas}h)",
+                          description=description, color=0x3498DB)
+    await interaction.followup.send(embed=embed, ephemeral=True)
+
+
+async def _purge_whitelist(interaction: discord.Interaction):
+    """Delete all whitelist keys in the background, reporting progress to the admin."""
+    started = time.monotonic()
+    last_update = started
+    deleted = 0
+    purge = store.purge_all()
+    try:
+        while True:
+            count = await asyncio.to_thread(next, purge, None)
+            if count is None:
+                break
+            deleted = count
+            if time.monotonic() - last_update >= 2:
+                last_update = time.monotonic()
+                await interaction.edit_original_response(
+                    content=f"Limpando whitelist... {deleted} chaves removidas."
+                )
+    except Exception as e:
+        log.error("Whitelist purge failed after %d keys: %s", deleted, e)
+        await interaction.edit_original_response(
+            content=f"Falha ao limpar whitelist apos {deleted} chaves: {e}"
+        )
+        return
+
+    elapsed = time.monotonic() - started
+    log.info("Whitelist purged: %d keys in %.1fs", deleted, elapsed)
+    await asyncio.to_thread(audit.record, "flushed", by=str(interaction.user), detail=f"{deleted} keys")
+    await interaction.edit_original_response(
+        content=f"Whitelist limpa: {deleted} chaves removidas em {elapsed:.1f}s."
+    )
+    _log_webhook(
+        "Whitelist Limpa",
+        f"**Por:** {interaction.user}\n**Chaves removidas:** {deleted}",
+        color=0xFF0000,
+    )
 
 
 @whitelist_group.command(name="flush", description="Limpar todos os IPs da whitelist")
@@ -299,13 +674,14 @@ async def whitelist_flush(interaction: discord.Interaction):
         return
 
     success = firewall.flush()
-    if success:
-        for key in _redis.scan_iter("whitelist:active:*"):
-            _redis.delete(key)
-        await interaction.response.send_message("Whitelist limpa.", ephemeral=True)
-        _log_webhook("Whitelist Limpa", f"**Por:** {interaction.user}", color=0xFF0000)
-    else:
+    if not success:
         await interaction.response.send_message("Falha ao limpar whitelist.", ephemeral=True)
+        return
+
+    # Active records, sessions, pending cookies and indexes are removed in the
+    # background so flushed users cannot auto-renew
+    await interaction.response.send_message("Limpando whitelist...", ephemeral=True)
+    _spawn(_purge_whitelist(interaction))
 
 
 tree.add_command(whitelist_group)
@@ -0,0 +1,167 @@
+"""
+Attack mode and proof-of-work gating for code generation.
+
+While attack mode is active, "/" and /api/request-code only proceed for
+requests carrying a solved challenge. Challenges are stateless: they
+carry their expiry and difficulty and are HMAC-signed for the client IP,
+so issuing and checking them never touches Redis.
+
+A challenge is "<expires>.<salt>.<difficulty>.<signature>"; a solution is
+a number n such that sha256("<challenge>:<n>") starts with <difficulty>
+zero bits. Clients send back "<challenge>:<n>". The browser keeps its
+solution in a cookie and may reuse it until the challenge expires; API
+solutions are accepted once and remembered per process, so with N web
+processes one can be replayed at most N times before it expires. The
+challenge comes before any Redis access; only requests carrying a signed
+session token (verified in-process) skip it.
+
+Attack mode is "on"/"off" when set manually (ATTACK_MODE, or the Discord
+command, stored in Redis), or "auto": switched on for ATTACK_MODE_COOLDOWN
+seconds whenever this process sees more than ATTACK_MODE_THRESHOLD gated
+requests per second.
+"""
+
+import hashlib
+import hmac
+import logging
+import secrets
+import threading
+import time
+
+import config
+import metrics
+
+log = logging.getLogger(__name__)
+
+_redis = None
+
+MODE_KEY = "whitelist:attack_mode"
+SECRET_KEY = "whitelist:pow_secret"
+MODES = ("auto", "on", "off")
+# How often web processes re-read the manual mode from Redis
+MODE_POLL_INTERVAL = 5
+
+_secret = b""
+_lock = threading.Lock()
+_mode = config.ATTACK_MODE
+_mode_checked = 0.0
+_window_start = 0.0
+_window_hits = 0
+_auto_until = 0.0
+# Solutions already accepted by this process (challenge -> expiry)
+_used: dict[str, float] = {}
+_MAX_USED = 100_000
+
+
+def init(redis_client):
+    global _redis, _secret
+    _redis = redis_client
+    if config.POW_SECRET:
+        _secret = config.POW_SECRET.encode()
+    else:
+        # Shared by all web processes so a challenge can be solved against any of them
+        _redis.set(SECRET_KEY, secrets.token_hex(32), nx=True)
+        _secret = _redis.get(SECRET_KEY).encode()
+
+
+def get_mode() -> str:
+    """Manual mode: "on", "off" or "auto" (cached for MODE_POLL_INTERVAL seconds)."""
+    global _mode, _mode_checked
+    now = time.monotonic()
+    if now - _mode_checked >= MODE_POLL_INTERVAL:
+        _mode_checked = now
+        try:
+            _mode = _redis.get(MODE_KEY) or config.ATTACK_MODE
+        except Exception as e:
+            log.warning("Could not read attack mode, keeping %s: %s", _mode, e)
+    return _mode
+
+
+def set_mode(mode: str) -> None:
+    if mode not in MODES:
+        raise ValueError(f"Unknown attack mode {mode!r}")
+    _redis.set(MODE_KEY, mode)
+
+
+def record_hit() -> None:
+    """Count a gated request towards automatic attack detection."""
+    global _window_start, _window_hits, _auto_until
+    if get_mode() == "off":
+        return
+    now = time.monotonic()
+    with _lock:
+        if now - _window_start >= config.ATTACK_MODE_WINDOW:
+            _window_start = now
+            _window_hits = 0
+        _window_hits += 1
+        if _window_hits > config.ATTACK_MODE_THRESHOLD * config.ATTACK_MODE_WINDOW:
+            if now >= _auto_until:
+                log.warning("Attack detected: more than %d req/s on code generation", config.ATTACK_MODE_THRESHOLD)
+                metrics.incr("attack.detections")
+            _auto_until = now + config.ATTACK_MODE_COOLDOWN
+
+
+def active() -> bool:
+    mode = get_mode()
+    if mode == "auto":
+        return time.monotonic() < _auto_until
+    return mode == "on"
+
+
+def _sign(payload: str, ip: str) -> str:
+    return hmac.new(_secret, f"{payload}.{ip}".encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def issue(ip: str) -> dict:
+    """A new challenge for ip: {"challenge": str, "difficulty": int}."""
+    payload = f"{int(time.time()) + config.POW_TTL}.{secrets.token_hex(8)}.{config.POW_DIFFICULTY}"
+    metrics.incr("pow.challenges")
+    return {"challenge": f"{payload}.{_sign(payload, ip)}", "difficulty": config.POW_DIFFICULTY}
+
+
+def _leading_zero_bits(digest: bytes) -> int:
+    value = int.from_bytes(digest, "big")
+    return len(digest) * 8 - value.bit_length()
+
+
+def verify(ip: str, solved: str, once: bool = True) -> bool:
+    """Check a "<challenge>:<n>" solution for ip.
+
+    With once (the default) each solution is accepted a single time;
+    otherwise it stays valid until the challenge expires.
+    """
+    # Client input: anything but a short ASCII string cannot be a solution
+    # (and would break compare_digest below)
+    if not isinstance(solved, str) or not solved or len(solved) > 200 or not solved.isascii():
+        return False
+    challenge, _, _ = solved.rpartition(":")
+    try:
+        expires, salt, difficulty, signature = challenge.split(".")
+        expires, difficulty = int(expires), int(difficulty)
+    except ValueError:
+        return False
+
+    now = time.time()
+    if (
+        expires < now
+        or difficulty < config.POW_DIFFICULTY
+        or not hmac.compare_digest(signature, _sign(f"{expires}.{salt}.{difficulty}", ip))
+        or _leading_zero_bits(hashlib.sha256(solved.encode()).digest()) < difficulty
+    ):
+        metrics.incr("pow.rejected")
+        return False
+
+    if not once:
+        metrics.incr("pow.solved")
+        return True
+
+    with _lock:
+        if challenge in _used:
+            metrics.incr("pow.rejected")
+            return False
+        if len(_used) > _MAX_USED:
+            for k in [k for k, until in _used.items() if until < now]:
+                del _used[k]
+        _used[challenge] = expires
+    metrics.incr("pow.solved")
+    return True
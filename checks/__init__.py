@@ -0,0 +1,13 @@
+"""
+Standalone checks and benchmarks for the portal, bot and firewall agent.
+
+Each module is a script run from the repository root:
+
+    python3 -m checks.<name> [--backend memory|redis] [--verbose]
+
+By default they run against an in-memory Redis stand-in (fakeredis, a
+test-only dependency: pip install fakeredis); --backend redis uses
+REDIS_URL instead and writes test data there, so point it at a throwaway
+Redis. Checks print their measurements and exit with status 1 if an
+expectation fails.
+"""
@@ -0,0 +1,105 @@
+"""
+Simulated refresh traffic of desktop clients: fixed versus adaptive scheduling.
+
+Replays --clients clients for --hours of simulated time, all starting
+together (as after a mass reconnect), with the portal down between
+--outage-start and --outage-end seconds. "fixed" is the old loop (call
+/api/refresh-session every refresh_interval); "adaptive" follows
+windows-client/whitelist_client.py: a local IP check every
+refresh_interval, a server call only when the IP changed or
+max_refresh_interval (with jitter) has passed, and exponential backoff
+with jitter on failures. The client module needs pystray and Pillow, so
+its policy constants are mirrored below. Reports mean and peak requests
+per second, overall and right after the outage.
+"""
+
+import argparse
+import heapq
+import random
+from collections import Counter
+
+from checks import common
+
+# Mirrors DEFAULT_CONFIG, BACKOFF_BASE/BACKOFF_MAX and refresh_loop's startup jitter
+REFRESH_INTERVAL = 60
+MAX_REFRESH_INTERVAL = 900
+BACKOFF_BASE = 5
+BACKOFF_MAX = 600
+STARTUP_JITTER = 30
+
+
+def backoff_delay(rng: random.Random, failures: int) -> float:
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (failures - 1))
+    return rng.uniform(delay / 2, delay)
+
+
+def simulate(policy: str, clients: int, duration: int, outage: tuple[int, int], ip_changes_per_day: float,
+             seed: int = 1) -> Counter:
+    """Server requests per simulated second."""
+    rng = random.Random(seed)
+    per_second = Counter()
+    change_chance = ip_changes_per_day * REFRESH_INTERVAL / 86400
+    # (time, client, consecutive failures, next forced server refresh)
+    wakeups = []
+    for client in range(clients):
+        start = 2 + (rng.uniform(0, STARTUP_JITTER) if policy == "adaptive" else 0)
+        wakeups.append((start, client, 0, 0.0))
+    heapq.heapify(wakeups)
+
+    while wakeups:
+        now, client, failures, next_refresh = heapq.heappop(wakeups)
+        if now >= duration:
+            continue
+        if policy == "fixed":
+            per_second[int(now)] += 1
+            heapq.heappush(wakeups, (now + REFRESH_INTERVAL, client, 0, 0.0))
+            continue
+
+        interval = REFRESH_INTERVAL
+        if now >= next_refresh or rng.random() < change_chance:
+            per_second[int(now)] += 1
+            if outage[0] <= now < outage[1]:
+                failures += 1
+                interval = backoff_delay(rng, failures)
+            else:
+                failures = 0
+                next_refresh = now + rng.uniform(0.8, 1.0) * MAX_REFRESH_INTERVAL
+        heapq.heappush(wakeups, (now + interval, client, failures, next_refresh))
+    return per_second
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Desktop client refresh traffic simulation")
+    parser.add_argument("--clients", type=int, default=10_000)
+    parser.add_argument("--hours", type=float, default=2)
+    parser.add_argument("--outage-start", type=int, default=1800, help="portal down from (s)")
+    parser.add_argument("--outage-end", type=int, default=2400, help="portal back at (s)")
+    parser.add_argument("--ip-changes-per-day", type=float, default=1, help="local IP changes per client")
+    args = parser.parse_args()
+
+    duration = int(args.hours * 3600)
+    outage = (args.outage_start, args.outage_end)
+    print(f"{args.clients} clients, {args.hours:g}h, portal down {outage[0]}-{outage[1]}s")
+    results = {}
+    for policy in ("fixed", "adaptive"):
+        per_second = simulate(policy, args.clients, duration, outage, args.ip_changes_per_day)
+        # Steady state: from one max_refresh_interval in until the outage
+        steady = [per_second[s] for s in range(MAX_REFRESH_INTERVAL, outage[0])]
+        recovery = [per_second[s] for s in range(outage[1], outage[1] + BACKOFF_MAX)]
+        results[policy] = {
+            "mean": sum(steady) / len(steady),
+            "peak": max(per_second.values()),
+            "recovery_peak": max(recovery),
+        }
+        print(f"  {policy:<9} steady {results[policy]['mean']:7.1f} req/s, peak {results[policy]['peak']:6d} req/s, "
+              f"peak after outage {results[policy]['recovery_peak']:6d} req/s")
+
+    fixed, adaptive = results["fixed"], results["adaptive"]
+    common.expect(adaptive["mean"] < fixed["mean"] / 5, "adaptive steady load is under a fifth of the fixed loop's")
+    common.expect(adaptive["peak"] < fixed["peak"] / 10, "startup jitter spreads clients that start together")
+    common.expect(adaptive["recovery_peak"] < fixed["recovery_peak"], "backoff spreads the reconnects after an outage")
+    common.finish()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Shared setup for the check scripts."""
+
+import argparse
+import logging
+import sys
+import threading
+import time
+
+import redis as redis_lib
+
+log = logging.getLogger(__name__)
+
+_failures = []
+
+
+def parser(description: str) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--backend", choices=("memory", "redis"), default="memory",
+                        help="in-memory fakeredis or REDIS_URL (writes test data)")
+    parser.add_argument("--verbose", action="store_true", help="keep the portal's INFO logs")
+    return parser
+
+
+def connect(args) -> redis_lib.Redis:
+    """Configure logging and return the Redis client selected by --backend."""
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s", force=True)
+    if args.backend == "redis":
+        import main
+        return main.connect_redis()
+    try:
+        import fakeredis
+    except ImportError:
+        sys.exit("--backend memory needs fakeredis (pip install fakeredis)")
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+def init_portal(r: redis_lib.Redis):
+    """Initialize the web role's modules (as the portal does) and return the Flask app."""
+    import main
+    return main.init_web(r)
+
+
+def init_bot(r: redis_lib.Redis):
+    """Initialize the bot's modules without a Discord connection and return the bot module."""
+    import audit
+    import bot
+    import challenge
+    import events
+    import firewall
+    import session_tokens
+    import store
+
+    audit.init(r, source="bot")
+    for module in (bot, challenge, firewall, events, store, session_tokens):
+        module.init(r)
+    return bot
+
+
+class RoundTrips:
+    """Counts Redis round trips made through a client while active.
+
+    Each command and each pipeline execution counts as one.
+    """
+
+    def __init__(self, r: redis_lib.Redis):
+        self.r = r
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def _tick(self) -> None:
+        with self._lock:
+            self.count += 1
+
+    def __enter__(self):
+        execute_command = self.r.execute_command
+        pipeline_execute = redis_lib.client.Pipeline.execute
+
+        def counted_command(*args, **kwargs):
+            self._tick()
+            return execute_command(*args, **kwargs)
+
+        def counted_pipeline(pipe, *args, **kwargs):
+            if pipe.command_stack:
+                self._tick()
+            return pipeline_execute(pipe, *args, **kwargs)
+
+        self.r.execute_command = counted_command
+        redis_lib.client.Pipeline.execute = counted_pipeline
+        self._restore = lambda: (self.r.__dict__.pop("execute_command", None),
+                                 setattr(redis_lib.client.Pipeline, "execute", pipeline_execute))
+        return self
+
+    def __exit__(self, *exc):
+        self._restore()
+
+
+def timed(fn, *args, **kwargs) -> tuple[object, float]:
+    """Run fn and return (result, seconds)."""
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def expect(condition: bool, description: str) -> None:
+    """Record and print the outcome of one expectation."""
+    print(f"  {'ok  ' if condition else 'FAIL'} {description}")
+    if not condition:
+        _failures.append(description)
+
+
+def finish() -> None:
+    """Exit with status 1 if any expectation failed."""
+    if _failures:
+        print(f"{len(_failures)} check(s) failed")
+        sys.exit(1)
+    print("all checks passed")
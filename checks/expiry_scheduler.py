@@ -0,0 +1,100 @@
+"""
+Expiry-indexed session scheduler benchmark.
+
+Seeds --sessions sessions, a few of them (--due) close to expiry, and
+compares the bot's due-session lookup (store.due_sessions, which reads
+only the due range of the expiry index) with the old full scan (SCAN
+every session key, then TTL per key). Then runs the bot's expiry task
+twice against a stubbed Discord client and checks that each due user is
+warned exactly once, with the warnings marked in one round trip.
+"""
+
+import asyncio
+import time
+from collections import Counter
+
+from checks import common
+
+import config
+import session_tokens
+import store
+
+
+def _seed(r, sessions: int, due: int) -> list[str]:
+    """Create sessions through the store; the first `due` ones expire within the warning window."""
+    tokens = [session_tokens.issue() for _ in range(sessions)]
+    for i, token in enumerate(tokens):
+        store.create_session(token, str(i % 5000), f"player{i % 5000}", f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}")
+    soon = int(config.SESSION_WARNING_THRESHOLD / 2)
+    pipe = r.pipeline(transaction=False)
+    for token in tokens[:due]:
+        # As if these sessions were created long ago
+        pipe.expire(f"{store.SESSION_PREFIX}{token}", soon)
+        pipe.zadd(store.EXPIRY_KEY, {token: int(time.time()) + soon})
+    pipe.execute()
+    return tokens[:due]
+
+
+class _StubClient:
+    """Stands in for discord.Client: fetch_user returns a user that records DMs."""
+
+    def __init__(self):
+        self.sent = Counter()
+
+    async def fetch_user(self, user_id: int):
+        client = self
+
+        class User:
+            async def send(self, **kwargs):
+                client.sent[user_id] += 1
+
+        return User()
+
+
+def _legacy_scan(r) -> list[str]:
+    """The old check: SCAN all sessions and ask each one's TTL."""
+    due = []
+    for key in r.scan_iter(f"{store.SESSION_PREFIX}*"):
+        ttl = r.ttl(key)
+        if 0 < ttl <= config.SESSION_WARNING_THRESHOLD:
+            due.append(key[len(store.SESSION_PREFIX):])
+    return due
+
+
+def main():
+    parser = common.parser("Session expiry scheduler benchmark")
+    parser.add_argument("--sessions", type=int, default=100_000, help="sessions to seed")
+    parser.add_argument("--due", type=int, default=50, help="sessions inside the warning window")
+    args = parser.parse_args()
+    r = common.connect(args)
+    bot = common.init_bot(r)
+
+    _, elapsed = common.timed(_seed, r, args.sessions, args.due)
+    print(f"Seeded {args.sessions} sessions in {elapsed:.1f}s")
+    with common.RoundTrips(r) as trips:
+        due, indexed = common.timed(store.due_sessions, config.SESSION_WARNING_THRESHOLD)
+    lookup = trips.count
+    print(f"  expiry index: {len(due)} due in {indexed * 1000:.1f} ms, {lookup} round trips")
+    with common.RoundTrips(r) as trips:
+        legacy, scanned = common.timed(_legacy_scan, r)
+    print(f"  full scan:    {len(legacy)} due in {scanned * 1000:.1f} ms, {trips.count} round trips")
+
+    common.expect({token for token, _, _ in due} == set(legacy), "both find the same due sessions")
+    common.expect(len(due) == args.due, f"exactly the {args.due} seeded sessions are due")
+
+    stub = _StubClient()
+    bot.dm_dispatcher.client = stub
+    with common.RoundTrips(r) as trips:
+        asyncio.run(bot.check_expiring_sessions.coro())
+    print(f"  expiry task:  {sum(stub.sent.values())} warnings, {trips.count} round trips")
+    asyncio.run(bot.check_expiring_sessions.coro())
+    expected = {int(session["discord_id"]) for _, session, _ in due}
+    common.expect(set(stub.sent) == expected and set(stub.sent.values()) == {1},
+                  "each due user is warned exactly once over two runs")
+    common.expect(trips.count == lookup + 2, "a run adds one round trip for the marks and one for the audit")
+    common.expect(store.due_sessions(config.SESSION_WARNING_THRESHOLD) == [], "warned sessions are not due again")
+    common.finish()
+
+
+if __name__ == "__main__":
+    main()
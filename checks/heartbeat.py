@@ -0,0 +1,65 @@
+"""
+Heartbeat fast path benchmark for /api/refresh-session at 10k heartbeats/minute.
+
+Seeds --players sessions, ages --aged of them below
+SESSION_REFRESH_FRACTION of their TTL, then sends --heartbeats
+unchanged-IP heartbeats round-robin. Reports round trips per heartbeat,
+TTL writes versus skipped writes, and in-process throughput against the
+167 heartbeats/s that 10k per minute needs.
+"""
+
+from checks import common
+
+import challenge
+import config
+import metrics
+import session_tokens
+import store
+
+
+def main():
+    parser = common.parser("Heartbeat fast path benchmark")
+    parser.add_argument("--players", type=int, default=1000, help="sessions sending heartbeats")
+    parser.add_argument("--aged", type=int, default=100, help="sessions whose TTL is due for renewal")
+    parser.add_argument("--heartbeats", type=int, default=10_000, help="heartbeats to send")
+    args = parser.parse_args()
+    r = common.connect(args)
+    app = common.init_portal(r)
+    challenge.set_mode("off")
+    client = app.test_client(use_cookies=False)
+
+    players = []
+    for i in range(args.players):
+        token, ip = session_tokens.issue(), f"10.1.{i >> 8 & 255}.{i & 255}"
+        store.create_session(token, str(i), f"player{i}", ip)
+        players.append((token, ip))
+    aged_ttl = int(store.renewal_ttl(players[0][0], None) * config.SESSION_REFRESH_FRACTION / 2)
+    for token, _ in players[:args.aged]:
+        r.expire(f"{store.SESSION_PREFIX}{token}", aged_ttl)
+
+    before = metrics.snapshot()
+    statuses = set()
+    with common.RoundTrips(r) as trips:
+        def beat():
+            for n in range(args.heartbeats):
+                token, ip = players[n % len(players)]
+                statuses.add(client.post("/api/refresh-session", headers={"X-Session-Token": token},
+                                         environ_base={"REMOTE_ADDR": ip}).status_code)
+        _, elapsed = common.timed(beat)
+    after = metrics.snapshot()
+    writes = after.get("refresh.ttl_writes", 0) - before.get("refresh.ttl_writes", 0)
+    skipped = after.get("refresh.writes_skipped", 0) - before.get("refresh.writes_skipped", 0)
+    rate = args.heartbeats / elapsed
+
+    print(f"{args.heartbeats} heartbeats from {args.players} players in {elapsed:.2f}s ({rate:,.0f}/s)")
+    print(f"  {trips.count / args.heartbeats:.2f} round trips/heartbeat, {writes} TTL writes, {skipped} skipped")
+    common.expect(statuses == {200}, "every heartbeat succeeded")
+    common.expect(writes == args.aged, "only sessions below the refresh fraction were renewed, once each")
+    common.expect(skipped == args.heartbeats - args.aged, "every other heartbeat skipped its write")
+    common.expect(trips.count <= args.heartbeats + 2 * args.aged, "unchanged heartbeats cost one round trip")
+    common.expect(rate > 10_000 / 60, "one process keeps up with 10k heartbeats/minute")
+    common.finish()
+
+
+if __name__ == "__main__":
+    main()
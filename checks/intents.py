@@ -0,0 +1,31 @@
+"""
+Gateway intents check: the bot only subscribes to guild messages (and
+their content) when DISCORD_MESSAGE_FALLBACK is on; DMs stay available
+either way.
+"""
+
+from checks import common
+
+import bot
+import config
+
+
+def main():
+    args = common.parser("Discord gateway intents check").parse_args()
+    common.connect(args)
+    previous = config.DISCORD_MESSAGE_FALLBACK
+    try:
+        for fallback in (False, True):
+            config.DISCORD_MESSAGE_FALLBACK = fallback
+            intents = bot._intents()
+            state = "on" if fallback else "off"
+            common.expect(intents.message_content == fallback, f"fallback {state}: message_content follows it")
+            common.expect(intents.guild_messages == fallback, f"fallback {state}: guild_messages follows it")
+            common.expect(intents.dm_messages and intents.guilds, f"fallback {state}: DMs and guilds stay on")
+    finally:
+        config.DISCORD_MESSAGE_FALLBACK = previous
+    common.finish()
+
+
+if __name__ == "__main__":
+    main()
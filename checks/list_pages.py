@@ -0,0 +1,69 @@
+"""
+/whitelist list pagination at 50k entries: per-page cost must not grow.
+
+Seeds --entries active records and reads pages from the start, the
+middle and the end of the index, with and without an IP prefix filter,
+reporting round trips and time per page. Also runs the name filter and
+checks the page count and cursor handling.
+"""
+
+import time
+
+from checks import common
+
+import store
+
+PAGE = 25
+
+
+def _seed(entries: int) -> list[str]:
+    ips = [f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(entries)]
+    records = ({"type": "active", "ip": ip, "discord_id": str(i), "discord_name": f"player{i % 1000}",
+                "timestamp": time.time()} for i, ip in enumerate(ips))
+    store.import_records(records)
+    return sorted(ips)
+
+
+def _page(r, label: str, after: str | None, **filters) -> tuple[list, str | None, int]:
+    with common.RoundTrips(r) as trips:
+        (entries, cursor), elapsed = common.timed(store.page_active, after, PAGE, **filters)
+    print(f"  {label:<24} {len(entries):>3} entries, {trips.count} round trips, {elapsed * 1000:.2f} ms")
+    return entries, cursor, trips.count
+
+
+def main():
+    parser = common.parser("Paginated active listing benchmark")
+    parser.add_argument("--entries", type=int, default=50_000, help="active records to seed")
+    args = parser.parse_args()
+    r = common.connect(args)
+    common.init_bot(r)
+
+    ips, elapsed = common.timed(_seed, args.entries)
+    print(f"Seeded {len(ips)} active records in {elapsed:.1f}s")
+    common.expect(store.count_active() == len(ips), "the index counts every record")
+
+    costs = []
+    for label, after in (("first page", None), ("middle page", ips[len(ips) // 2]), ("last page", ips[-PAGE - 1])):
+        entries, cursor, cost = _page(r, label, after)
+        costs.append(cost)
+        common.expect(len(entries) == PAGE, f"{label} is full")
+    common.expect(len(set(costs)) == 1, "every page costs the same round trips")
+
+    prefix = ips[len(ips) // 2].rsplit(".", 1)[0] + "."
+    entries, _, _ = _page(r, f"prefix {prefix}", None, ip_prefix=prefix)
+    common.expect(all(ip.startswith(prefix) for ip, _ in entries), "prefix filter only returns matching IPs")
+
+    entries, _, _ = _page(r, "name player7", None, name="PLAYER7")
+    common.expect(entries and all("player7" in record["discord_name"] for _, record in entries),
+                  "name filter is a case-insensitive substring match")
+
+    after, pages = None, 0
+    while pages < 3:
+        entries, after = store.page_active(after, PAGE)
+        pages += 1
+    common.expect(entries[0][0] == ips[2 * PAGE], "cursors walk the index in IP order")
+    common.finish()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Sentinel/Cluster check: key layout, cluster code paths and replica reads.
+
+Meant for a local multi-instance setup: run it with --backend redis and
+REDIS_MODE=sentinel or cluster (plus REDIS_READ_FROM_REPLICAS=true to
+cover replica reads). It walks a session through redemption, IP change,
+expiry sweep and revocation, and checks that with hash tags every key of
+one IP lands in one slot. In memory, --cluster-path runs the pipelined
+cluster variants of the store on the single node instead of the scripts.
+"""
+
+import time
+
+from redis.crc import key_slot
+
+from checks import common
+
+import config
+import firewall
+import profiles
+import redis_conn
+import session_tokens
+import store
+
+
+def _keys_of(r, ident: str) -> list[str]:
+    """Keys named after ident (per-IP / per-session keys, tagged or not)."""
+    return [key for key in r.scan_iter(f"*{ident}*") if redis_conn.ident("", key.rsplit(":", 1)[-1]) == ident]
+
+
+def _eventually(check, timeout: float = 2.0) -> bool:
+    """Poll check() for up to timeout seconds (replication lag)."""
+    deadline = time.monotonic() + timeout
+    while not check():
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def main():
+    parser = common.parser("Sentinel/Cluster layout and routing check")
+    parser.add_argument("--cluster-path", action="store_true",
+                        help="use the store's cluster variants on a single node")
+    args = parser.parse_args()
+    r = common.connect(args)
+    common.init_portal(r)
+    if args.cluster_path:
+        store._clustered = True
+    print(f"Mode {config.REDIS_MODE}, hash tags {'on' if config.REDIS_HASH_TAGS else 'off'}, "
+          f"{'cluster' if store._clustered else 'script'} path, "
+          f"replica reads {'on' if config.REDIS_READ_FROM_REPLICAS else 'off'}")
+
+    ip, new_ip, discord_id = "203.0.113.10", "203.0.113.11", "3900000001"
+    token = session_tokens.issue()
+    store.create_code("MI01", ip)
+    common.expect(store.redeem_code("MI01", discord_id, "player", token) == (ip, profiles.DEFAULT),
+                  "code redeemed")
+    common.expect(store.redeem_code("MI01", discord_id, "player", token) is None, "code redeemed only once")
+    common.expect(firewall.is_whitelisted(ip), "primary sees the IP right after redemption")
+    common.expect(store.get_pending(ip) == token, "pending session token written")
+
+    if config.REDIS_HASH_TAGS:
+        slots = {key_slot(key.encode()) for key in _keys_of(r, ip)}
+        common.expect(len(slots) == 1, f"all keys of {ip} share one slot ({len(_keys_of(r, ip))} keys)")
+    common.expect(_eventually(lambda: firewall.is_whitelisted(ip, from_replica=True)),
+                  "replica reads catch up with the write")
+
+    store.move_session(token, store.get_session(token), new_ip)
+    common.expect(not firewall.is_whitelisted(ip) and firewall.is_whitelisted(new_ip), "session moved to the new IP")
+
+    # Backdate the IP's expiry so the sweep collects it
+    r.zadd(profiles.scoped(store.ACTIVE_EXPIRY_KEY, None), {new_ip: 1})
+    removed = store.sweep_expired_actives(0)
+    common.expect(removed == [(profiles.DEFAULT, new_ip)], "expired IP swept")
+    common.expect(store.get_pending(new_ip) is None and not firewall.is_whitelisted(new_ip),
+                  "sweep removed the active record and pending token")
+
+    store.create_session(token, discord_id, "player", ip)
+    revoked, _ = store.revoke_user(discord_id)
+    common.expect(revoked == 1 and store.get_session(token) is None, "revocation removed the session")
+    common.finish()
+
+
+if __name__ == "__main__":
+    main()
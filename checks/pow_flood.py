@@ -0,0 +1,121 @@
+"""
+Attack mode flood benchmark: Redis round trips per request with and without PoW.
+
+Floods "/" and /api/request-code from --requests distinct IPs (a wide
+botnet, so per-IP rate limits never trip) with attack mode off and then
+on, where no request carries a solution: those must be turned away
+without touching Redis. Also checks the gate's behaviour: a signed
+session token skips the challenge, a whitelisted IP without one does not,
+a solved browser cookie keeps working until it expires, an API solution
+is accepted once, malformed solutions are refused, and attack detection
+is not counted while the mode is forced off.
+"""
+
+import hashlib
+import ipaddress
+
+from checks import common
+
+import challenge
+import config
+import metrics
+import session_tokens
+import store
+import web
+
+
+def solve(challenge_text: str, difficulty: int) -> str:
+    n = 0
+    while True:
+        solved = f"{challenge_text}:{n}"
+        if int.from_bytes(hashlib.sha256(solved.encode()).digest(), "big") >> (256 - difficulty) == 0:
+            return solved
+        n += 1
+
+
+def _set_mode(mode: str) -> None:
+    challenge.set_mode(mode)
+    challenge._mode_checked = 0  # skip the MODE_POLL_INTERVAL cache
+
+
+def _flood(r, client, first_ip: str, requests: int) -> float:
+    base = int(ipaddress.IPv4Address(first_ip))
+    with common.RoundTrips(r) as trips:
+        for i in range(requests):
+            env = {"REMOTE_ADDR": str(ipaddress.IPv4Address(base + i))}
+            if i % 2:
+                client.post("/api/request-code", json={}, environ_base=env)
+            else:
+                client.get("/", environ_base=env)
+    return trips.count / requests
+
+
+def main():
+    parser = common.parser("Attack mode flood benchmark")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per flood, one per IP")
+    args = parser.parse_args()
+    r = common.connect(args)
+    app = common.init_portal(r)
+    client = app.test_client(use_cookies=False)
+    previous_mode = r.get(challenge.MODE_KEY)
+    try:
+        _checks(r, client, args.requests)
+    finally:
+        if previous_mode:
+            r.set(challenge.MODE_KEY, previous_mode)
+        else:
+            r.delete(challenge.MODE_KEY)
+    common.finish()
+
+
+def _checks(r, client, requests: int) -> None:
+    _set_mode("off")
+    off = _flood(r, client, "100.64.0.0", requests)
+    _set_mode("on")
+    on = _flood(r, client, "100.65.0.0", requests)
+    print(f"  attack mode off: {off:.2f} round trips/request")
+    print(f"  attack mode on:  {on:.2f} round trips/request (unsolved)")
+    common.expect(on < off, "unsolved requests cost fewer round trips than code generation")
+    # Only the odd attack mode re-read (every MODE_POLL_INTERVAL seconds)
+    common.expect(on < 0.05, "an unsolved request is turned away before touching Redis")
+
+    store.create_code("PW01", "203.0.113.20")
+    store.redeem_code("PW01", "1", "player", "token")
+    page = client.get("/", environ_base={"REMOTE_ADDR": "203.0.113.20"}).get_data(as_text=True)
+    common.expect("var challenge" in page, "a whitelisted IP without a session is still challenged")
+    cookie = f"{web._session_cookie(None)}={session_tokens.issue()}"
+    page = client.get("/", headers={"Cookie": cookie},
+                      environ_base={"REMOTE_ADDR": "203.0.113.20"}).get_data(as_text=True)
+    common.expect("var challenge" not in page, "a signed session cookie skips the challenge")
+    forged = client.get("/", headers={"Cookie": f"{web._session_cookie(None)}=forged"},
+                        environ_base={"REMOTE_ADDR": "203.0.113.20"}).get_data(as_text=True)
+    common.expect("var challenge" in forged, "a forged session cookie does not")
+
+    statuses = [client.post("/api/request-code", json={"pow": pow_value},
+                            environ_base={"REMOTE_ADDR": "203.0.113.23"}).status_code
+                for pow_value in ("\u00e9:1", 5, ["a"])]
+    common.expect(statuses == [403, 403, 403], f"malformed solutions are refused, not a crash: {statuses}")
+
+    env = {"REMOTE_ADDR": "203.0.113.21"}
+    issued = challenge.issue(env["REMOTE_ADDR"])
+    cookie = f"{web.POW_COOKIE}={solve(issued['challenge'], issued['difficulty'])}"
+    pages = [client.get("/", headers={"Cookie": cookie}, environ_base=env).get_data(as_text=True) for _ in range(2)]
+    common.expect(all('id="code"' in page for page in pages), "a solved cookie is reused until it expires")
+
+    env = {"REMOTE_ADDR": "203.0.113.22"}
+    issued = challenge.issue(env["REMOTE_ADDR"])
+    solved = solve(issued["challenge"], issued["difficulty"])
+    first = client.post("/api/request-code", json={"pow": solved}, environ_base=env).get_json()
+    replay = client.post("/api/request-code", json={"pow": solved}, environ_base=env).get_json()
+    common.expect(first.get("code") and replay.get("error") == "pow_required", "an API solution is accepted once")
+
+    _set_mode("off")
+    detections = metrics.snapshot().get("attack.detections", 0)
+    for _ in range(config.ATTACK_MODE_THRESHOLD * config.ATTACK_MODE_WINDOW * 2):
+        challenge.record_hit()
+    common.expect(metrics.snapshot().get("attack.detections", 0) == detections,
+                  "no attack is detected while the mode is forced off")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Blocklist prefix set microbenchmark at 1M prefixes.
+
+Writes --prefixes random networks (90% IPv4, 10% IPv6) to a list file,
+loads it the way the portal does (prefixset.load_file), and reports load
+time, table size (nbytes and traced allocations) and lookup cost for
+IPv4 and IPv6 addresses. Longest-prefix matching is checked on a small
+hand-made table first.
+"""
+
+import argparse
+import ipaddress
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from checks import common
+
+import prefixset
+from prefixset import ALLOW, BLOCK, PrefixSet
+
+
+def _check_matching() -> None:
+    table = PrefixSet()
+    for network, value in (("10.0.0.0/8", BLOCK), ("10.1.0.0/16", ALLOW), ("10.1.2.3/32", BLOCK),
+                           ("2001:db8::/32", BLOCK), ("2001:db8::1/128", ALLOW)):
+        table.add(network, value)
+    table.freeze()
+    cases = {"10.2.3.4": BLOCK, "10.1.9.9": ALLOW, "10.1.2.3": BLOCK, "11.0.0.1": None,
+             "2001:db8::5": BLOCK, "2001:db8::1": ALLOW, "::ffff:10.1.2.3": BLOCK, "2002::1": None}
+    common.expect(all(table.lookup(ip) == value for ip, value in cases.items()),
+                  "longest prefix wins, IPv6 and IPv4-mapped addresses included")
+
+
+def _write_list(path: str, prefixes: int, rng: random.Random) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        for _ in range(prefixes * 9 // 10):
+            length = rng.choice((16, 20, 22, 24, 24, 24, 28, 32))
+            f.write(f"{ipaddress.IPv4Address(rng.getrandbits(32) >> (32 - length) << (32 - length))}/{length}\n")
+        for _ in range(prefixes - prefixes * 9 // 10):
+            length = rng.choice((32, 48, 56, 64))
+            f.write(f"{ipaddress.IPv6Address(rng.getrandbits(128) >> (128 - length) << (128 - length))}/{length}\n")
+
+
+def _lookup_cost(table: PrefixSet, ips: list[str]) -> tuple[float, int]:
+    started = time.perf_counter()
+    hits = sum(table.lookup(ip) is not None for ip in ips)
+    return (time.perf_counter() - started) / len(ips), hits
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prefix set microbenchmark")
+    parser.add_argument("--prefixes", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=100_000)
+    args = parser.parse_args()
+    rng = random.Random(1)
+
+    _check_matching()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "blocklist.txt")
+        _write_list(path, args.prefixes, rng)
+        tracemalloc.start()
+        table = PrefixSet()
+        _, elapsed = common.timed(prefixset.load_file, table, path, BLOCK)
+        table.freeze()
+        traced, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    print(f"Loaded {table.count} prefixes in {elapsed:.1f}s: tables {table.nbytes() / 2**20:.1f} MiB, "
+          f"traced {traced / 2**20:.1f} MiB (peak while loading {peak / 2**20:.1f} MiB)")
+
+    v4 = [str(ipaddress.IPv4Address(rng.getrandbits(32))) for _ in range(args.lookups)]
+    v6 = [str(ipaddress.IPv6Address(rng.getrandbits(128))) for _ in range(args.lookups)]
+    for label, ips in (("IPv4", v4), ("IPv6", v6)):
+        cost, hits = _lookup_cost(table, ips)
+        print(f"  {label} lookup: {cost * 1e6:.2f} us ({hits} of {len(ips)} random addresses blocked)")
+        common.expect(cost < 50e-6, f"{label} lookups stay under 50 us at {table.count} prefixes")
+    common.expect(table.nbytes() < 16 * args.prefixes, "tables use under 16 bytes per prefix")
+    common.finish()
+
+
+if __name__ == "__main__":
+    main()
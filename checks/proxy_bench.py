@@ -0,0 +1,94 @@
+"""
+Trusted proxy middleware: forwarding rules and per-request overhead.
+
+Checks which peers may set X-Forwarded-For, which address becomes the
+client IP and that an untrusted private proxy is reported, then measures the middleware's overhead per request with
+Cloudflare's published ranges as the trusted set and with a 100k-prefix
+set.
+"""
+
+import argparse
+import ipaddress
+import logging
+import random
+import timeit
+
+from checks import common
+
+import prefixset
+import proxy
+
+CLOUDFLARE = (
+    "173.245.48.0/20 103.21.244.0/22 103.22.200.0/22 103.31.4.0/22 141.101.64.0/18 108.162.192.0/18 "
+    "190.93.240.0/20 188.114.96.0/20 197.234.240.0/22 198.41.128.0/17 162.158.0.0/15 104.16.0.0/13 "
+    "104.24.0.0/14 172.64.0.0/13 131.0.72.0/22 2400:cb00::/32 2606:4700::/32 2803:f800::/32 "
+    "2405:b500::/32 2405:8100::/32 2a06:98c0::/29 2c0f:f248::/32"
+).split()
+
+
+def _app(environ, start_response):
+    return [environ["REMOTE_ADDR"]]
+
+
+def _client_ip(middleware, peer: str, forwarded_for: str) -> str:
+    environ = {"REMOTE_ADDR": peer, "HTTP_X_FORWARDED_FOR": forwarded_for, "wsgi.url_scheme": "http"}
+    return middleware(environ, None)[0]
+
+
+def _trusted(networks) -> prefixset.PrefixSet:
+    table = prefixset.PrefixSet()
+    for network in networks:
+        table.add(network)
+    return table.freeze()
+
+
+def _overhead(trusted: prefixset.PrefixSet, requests: int) -> float:
+    middleware = proxy.TrustedProxyMiddleware(_app, trusted, x_for=2)
+    environ = {"REMOTE_ADDR": "173.245.48.7", "HTTP_X_FORWARDED_FOR": "203.0.113.9, 173.245.48.5",
+               "HTTP_X_FORWARDED_PROTO": "https", "wsgi.url_scheme": "http"}
+    bare = timeit.timeit(lambda: _app(dict(environ), None), number=requests)
+    wrapped = timeit.timeit(lambda: middleware(dict(environ), None), number=requests)
+    return (wrapped - bare) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Trusted proxy middleware microbenchmark")
+    parser.add_argument("--requests", type=int, default=100_000)
+    args = parser.parse_args()
+
+    middleware = proxy.TrustedProxyMiddleware(_app, _trusted(["127.0.0.1", *CLOUDFLARE]), x_for=2)
+    cases = [
+        ("127.0.0.1", "1.1.1.1", "1.1.1.1", "a trusted peer sets the client IP"),
+        ("8.8.8.8", "1.1.1.1", "8.8.8.8", "an untrusted peer cannot spoof X-Forwarded-For"),
+        ("127.0.0.1", "6.6.6.6, 173.245.48.5", "6.6.6.6", "trusted hops are skipped"),
+        ("127.0.0.1", "9.9.9.9, 2.2.2.2", "2.2.2.2", "the rightmost untrusted entry wins"),
+        ("127.0.0.1", "garbage", "127.0.0.1", "invalid entries are ignored"),
+    ]
+    for peer, forwarded_for, expected, description in cases:
+        common.expect(_client_ip(middleware, peer, forwarded_for) == expected, description)
+
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    logging.getLogger(proxy.__name__).addHandler(handler)
+    local_only = proxy.TrustedProxyMiddleware(_app, _trusted(["127.0.0.1"]))
+    _client_ip(local_only, "172.18.0.2", "1.1.1.1")
+    _client_ip(local_only, "172.18.0.3", "1.1.1.1")
+    common.expect(len([r for r in records if r.levelno == logging.ERROR]) == 1,
+                  "an untrusted private proxy is reported once")
+    logging.getLogger(proxy.__name__).removeHandler(handler)
+
+    rng = random.Random(1)
+    big = [*CLOUDFLARE]
+    for _ in range(100_000):
+        length = rng.choice((16, 20, 24, 32))
+        big.append(f"{ipaddress.IPv4Address(rng.getrandbits(32))}/{length}")
+    for label, networks in (("Cloudflare ranges", CLOUDFLARE), ("100k prefixes", big)):
+        cost = _overhead(_trusted(networks), args.requests)
+        print(f"  {label}: {cost * 1e6:.2f} us/request")
+        common.expect(cost < 50e-6, f"overhead with {label} stays under 50 us")
+    common.finish()
+
+
+if __name__ == "__main__":
+    main()
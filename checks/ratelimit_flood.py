@@ -0,0 +1,67 @@
+"""
+Flood benchmark for the rate limiter: Redis round trips per rejected request.
+
+Floods "/" from one IP and from a wide range of IPs and reports how many
+requests were rejected, and what each rejection cost in Redis round trips.
+Once an IP is over its limit (or over the flood threshold) the limiter
+rejects it in-process, so a rejected "/" only costs the whitelist lookup
+that runs before it.
+"""
+
+import ipaddress
+
+from checks import common
+
+import challenge
+import config
+import metrics
+import ratelimit
+
+
+def _flood(r, client, ips: list[str]) -> tuple[int, int, float]:
+    """GET "/" once per entry of ips; returns (requests, 429s, round trips per 429)."""
+    before = metrics.snapshot().get("ratelimit.local_rejects", 0)
+    with common.RoundTrips(r) as trips:
+        _, elapsed = common.timed(lambda: [
+            client.get("/", environ_base={"REMOTE_ADDR": ip}).status_code for ip in ips
+        ])
+    rejected = metrics.snapshot().get("ratelimit.local_rejects", 0) - before
+    print(f"  {len(ips)} requests in {elapsed:.2f}s, {rejected} rejected in-process, "
+          f"{trips.count / len(ips):.2f} round trips/request")
+    return len(ips), rejected, trips.count
+
+
+def main():
+    parser = common.parser("Rate limiter flood benchmark")
+    parser.add_argument("--requests", type=int, default=5000, help="requests per flood")
+    args = parser.parse_args()
+    r = common.connect(args)
+    app = common.init_portal(r)
+    challenge.set_mode("off")
+    client = app.test_client(use_cookies=False)
+
+    limit, _ = config.RATE_LIMITS["index"]
+    allowed = [ratelimit.allow("index", "198.51.100.1") for _ in range(limit + 2)]
+    common.expect(allowed == [True] * limit + [False, False], f"index policy allows exactly {limit} codes")
+
+    # Per-IP state is in-process; measure Redis once the IP has been rejected
+    with common.RoundTrips(r) as trips:
+        for _ in range(1000):
+            ratelimit.allow("index", "198.51.100.1")
+    common.expect(trips.count == 0, "an IP over its limit is rejected without Redis")
+
+    print("Single IP flood on /")
+    requests, rejected, round_trips = _flood(r, client, ["198.51.100.2"] * args.requests)
+    common.expect(rejected >= requests - limit - config.RATE_LIMIT_FLOOD_MAX,
+                  "all but the first requests are rejected in-process")
+    common.expect(round_trips <= requests + 4 * limit, "rejections add no round trips beyond the whitelist lookup")
+
+    print("Wide flood on / (one request per IP)")
+    base = int(ipaddress.IPv4Address("100.64.0.0"))
+    _flood(r, client, [str(ipaddress.IPv4Address(base + i)) for i in range(args.requests)])
+    print("  (each new IP costs Redis until it trips its own limit; see attack mode)")
+    common.finish()
+
+
+if __name__ == "__main__":
+    main()
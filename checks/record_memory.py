@@ -0,0 +1,125 @@
+"""
+Record encoding memory report: legacy JSON strings versus compact hashes.
+
+Seeds --records synthetic sessions and active records in both encodings
+under a scratch prefix, measures a sample of each with MEMORY USAGE (the
+same sampling as memory_report.py) and prints the cost per 100k records,
+so the hash migration can be compared before/after without a live
+whitelist. fakeredis has no MEMORY USAGE: with --backend memory the
+payload bytes (JSON length, or the hash's field and value lengths) are
+reported instead; use --backend redis for real numbers.
+"""
+
+import json
+import time
+from collections import defaultdict
+
+import redis as redis_lib
+
+from checks import common
+
+import memory_report
+import profiles
+import store
+
+SCRATCH = "whitelist:memcheck:"
+
+
+def _records(i: int) -> tuple[dict, dict]:
+    """A session and an active record shaped like the ones the portal writes."""
+    now = time.time()
+    session = {
+        "discord_id": str(300_000_000_000_000_000 + i),
+        "discord_name": f"player{i}",
+        "ip": f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}",
+        "created_at": now,
+        "profile": profiles.DEFAULT,
+    }
+    active = {"discord_id": session["discord_id"], "discord_name": session["discord_name"], "timestamp": now}
+    return session, active
+
+
+def _seed(r: redis_lib.Redis, records: int) -> None:
+    for start in range(0, records, 1000):
+        pipe = r.pipeline(transaction=False)
+        for i in range(start, min(start + 1000, records)):
+            session, active = _records(i)
+            # Legacy records: the whole dict as one JSON string
+            pipe.set(f"{SCRATCH}json:session:{i}", json.dumps(session))
+            pipe.set(f"{SCRATCH}json:active:{i}", json.dumps(active))
+            pipe.hset(f"{SCRATCH}hash:session:{i}", mapping=store._pack(session, store.SESSION_FIELDS))
+            pipe.hset(f"{SCRATCH}hash:active:{i}", mapping=store._pack(active, store.ACTIVE_FIELDS))
+        pipe.execute()
+
+
+def _payload(r: redis_lib.Redis, prefix: str, sample: int) -> dict[str, list[int]]:
+    """Stand-in for memory_report.measure: bytes of the stored values, without overhead."""
+    keys = []
+    for key in r.scan_iter(f"{prefix}*", count=1000):
+        keys.append(key)
+        if len(keys) >= sample:
+            break
+    pipe = r.pipeline(transaction=False)
+    for key in keys:
+        pipe.type(key)
+    kinds = pipe.execute()
+    pipe = r.pipeline(transaction=False)
+    for key, kind in zip(keys, kinds):
+        if kind == "hash":
+            pipe.hgetall(key)
+        else:
+            pipe.get(key)
+    sizes = defaultdict(list)
+    for kind, value in zip(kinds, pipe.execute()):
+        if kind == "hash":
+            sizes[kind].append(sum(len(field) + len(str(v)) for field, v in value.items()))
+        elif value is not None:
+            sizes[kind].append(len(value))
+    return sizes
+
+
+def _cleanup(r: redis_lib.Redis) -> None:
+    batch = []
+    for key in r.scan_iter(f"{SCRATCH}*", count=1000):
+        batch.append(key)
+        if len(batch) >= 1000:
+            r.unlink(*batch)
+            batch = []
+    if batch:
+        r.unlink(*batch)
+
+
+def main():
+    parser = common.parser("Record encoding memory report")
+    parser.add_argument("--records", type=int, default=20_000, help="records seeded per encoding and family")
+    parser.add_argument("--sample", type=int, default=2000, help="keys measured per encoding and family")
+    args = parser.parse_args()
+    r = common.connect(args)
+
+    try:
+        r.memory_usage("missing")
+        measure, unit = memory_report.measure, "MEMORY USAGE"
+    except redis_lib.ResponseError:
+        measure, unit = _payload, "payload bytes (no MEMORY USAGE on this backend)"
+
+    _, elapsed = common.timed(_seed, r, args.records)
+    print(f"Seeded {args.records} records per encoding and family in {elapsed:.1f}s; measuring {unit}")
+    try:
+        for family in ("session", "active"):
+            averages = {}
+            for encoding in ("json", "hash"):
+                sizes = measure(r, f"{SCRATCH}{encoding}:{family}:", args.sample)
+                for kind, values in sizes.items():
+                    averages[kind] = sum(values) / len(values)
+                    print(f"  {family:<8} {memory_report.ENCODINGS.get(kind, kind):<14} "
+                          f"sampled={len(values):<6} avg={averages[kind]:7.1f} B  "
+                          f"per 100k={averages[kind] * 100_000 / 1024 / 1024:7.2f} MiB")
+            common.expect(averages.get("hash", 0) < averages.get("string", 0),
+                          f"{family} records are smaller as hashes")
+    finally:
+        _cleanup(r)
+    common.finish()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Concurrent redemption of one code: exactly one caller may win.
+
+Starts --threads callers redeeming the same code at once, --rounds times,
+and checks that each round has a single winner, a single firewall add and
+a session only for the winner. Then compares the latency and Redis round
+trips of the bot's redemption (store.get_code, whose profile is passed to
+store.redeem_code) with the old sequence (GET, firewall enqueue, DEL and
+three writes, one round trip each).
+"""
+
+import json
+import secrets
+import threading
+import time
+
+from checks import common
+
+import firewall
+import session_tokens
+import store
+
+
+def _race(r, code: str, ip: str, threads: int) -> list:
+    store.create_code(code, ip)
+    barrier = threading.Barrier(threads)
+    results = [None] * threads
+
+    def redeem(i: int) -> None:
+        token = session_tokens.issue()
+        barrier.wait()
+        results[i] = (token, store.redeem_code(code, str(i), f"player{i}", token))
+
+    workers = [threading.Thread(target=redeem, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return results
+
+
+def _legacy_redeem(r, code: str, discord_id: str, discord_name: str, token: str) -> str | None:
+    """The pre-script redemption: six round trips, racy between GET and DEL."""
+    raw = r.get(f"{store.CODE_PREFIX}{code}")
+    if raw is None:
+        return None
+    ip = json.loads(raw)["ip"]
+    r.rpush(firewall.QUEUE_KEY, json.dumps({"action": "add", "ip": ip}))
+    r.delete(f"{store.CODE_PREFIX}{code}")
+    r.set(f"legacy:active:{ip}", json.dumps({"discord_id": discord_id, "discord_name": discord_name,
+                                             "timestamp": time.time()}))
+    r.setex(f"legacy:session:{token}", 3600, json.dumps({"discord_id": discord_id, "discord_name": discord_name,
+                                                           "ip": ip, "created_at": time.time()}))
+    r.setex(f"legacy:pending_session:{ip}", 3600, token)
+    return ip
+
+
+def main():
+    parser = common.parser("Concurrent code redemption check")
+    parser.add_argument("--threads", type=int, default=32, help="concurrent redeemers per round")
+    parser.add_argument("--rounds", type=int, default=20, help="codes raced for")
+    parser.add_argument("--latency", type=int, default=2000, help="sequential redemptions to time")
+    args = parser.parse_args()
+    r = common.connect(args)
+    common.init_bot(r)
+
+    print(f"Racing {args.threads} redeemers for each of {args.rounds} codes")
+    single_winner = single_add = sessions_ok = True
+    for n in range(args.rounds):
+        ip = f"198.18.{n // 250}.{n % 250 + 1}"
+        queued = r.llen(firewall.QUEUE_KEY)
+        results = _race(r, f"R{n:03d}", ip, args.threads)
+        winners = [(token, redeemed) for token, redeemed in results if redeemed]
+        single_winner &= len(winners) == 1 and winners[0][1][0] == ip
+        single_add &= r.llen(firewall.QUEUE_KEY) - queued == 1
+        sessions_ok &= sum(store.get_session(token) is not None for token, _ in results) == 1
+    common.expect(single_winner, "every code redeemed by exactly one caller")
+    common.expect(single_add, "exactly one firewall add per code")
+    common.expect(sessions_ok, "a session exists only for the winner")
+
+    # In memory the Lua interpreter dominates; against a real Redis each
+    # round trip adds network latency, so the round trip count is what is checked
+    latencies, round_trips = {}, {}
+    for name, redeem in (("script", lambda c, t: store.redeem_code(c, "1", "player", t, store.get_code(c)["profile"])),
+                         ("legacy", lambda c, t: _legacy_redeem(r, c, "1", "player", t))):
+        codes = [f"{name[0].upper()}{i:05d}" for i in range(args.latency)]
+        for i, code in enumerate(codes):
+            store.create_code(code, f"198.19.{i // 250}.{i % 250 + 1}")
+        with common.RoundTrips(r) as trips:
+            _, elapsed = common.timed(lambda: [redeem(code, secrets.token_hex(16)) for code in codes])
+        latencies[name] = elapsed / len(codes)
+        round_trips[name] = trips.count / len(codes)
+        print(f"  {name}: {latencies[name] * 1e6:.0f} us/redemption, {round_trips[name]:.1f} round trips")
+    common.expect(round_trips["script"] < round_trips["legacy"], "the atomic script needs fewer round trips")
+    common.expect(round_trips["script"] <= 2, "a redemption reads the code once, then runs the script")
+    common.finish()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Configuration reload under load: no request may fail while SIGHUP reloads.
+
+Serves the portal on a local threaded server, keeps --clients clients
+sending status checks, bulk status checks and session heartbeats, and
+meanwhile rewrites a .env file and sends this process SIGHUP --reloads
+times (the handler main.py installs), ending with an invalid value.
+Checks that every request succeeded, that the last valid values were
+applied and that the invalid one was rejected. Gunicorn's worker
+rotation on SIGHUP to the master is not covered here.
+"""
+
+import http.client
+import json
+import logging
+import os
+import signal
+import tempfile
+import threading
+import time
+
+import werkzeug.serving
+
+from checks import common
+
+import challenge
+import config
+import main as portal
+import session_tokens
+import store
+
+
+class Client(threading.Thread):
+    def __init__(self, port: int, token: str, ip: str, stop: threading.Event):
+        super().__init__(daemon=True)
+        self.port = port
+        self.token = token
+        self.ip = ip
+        self.stop = stop
+        self.ok = 0
+        self.failures = []
+
+    def _request(self, conn, method: str, path: str, body=None, headers=None) -> None:
+        headers = {"Content-Type": "application/json", **(headers or {})}
+        conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+        resp = conn.getresponse()
+        data = resp.read()
+        if resp.status == 200:
+            self.ok += 1
+        else:
+            self.failures.append(f"{method} {path}: {resp.status} {data[:80]!r}")
+
+    def run(self):
+        while not self.stop.is_set():
+            try:
+                conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=10)
+                self._request(conn, "GET", f"/status?ip={self.ip}")
+                self._request(conn, "POST", "/status/bulk", {"ips": [self.ip] * 5})
+                self._request(conn, "POST", "/api/refresh-session", {"session_token": self.token})
+                conn.close()
+            except (OSError, http.client.HTTPException) as e:
+                self.failures.append(repr(e))
+
+
+def _write_env(path: str, code_ttl, bulk_max) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"CODE_TTL={code_ttl}\nSTATUS_BULK_MAX={bulk_max}\nRATE_LIMIT_INDEX=3/300\n")
+
+
+def main():
+    parser = common.parser("Configuration reload under load")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--reloads", type=int, default=20)
+    args = parser.parse_args()
+    r = common.connect(args)
+    app = common.init_portal(r)
+    challenge.set_mode("off")
+
+    env_file = tempfile.NamedTemporaryFile("w", suffix=".env", delete=False)
+    env_file.close()
+    _write_env(env_file.name, config.CODE_TTL, config.STATUS_BULK_MAX)
+    config._ENV_FILE = env_file.name  # reload from the scratch file instead of the real .env
+    portal.install_reload_handler()
+
+    if not args.verbose:
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = werkzeug.serving.make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    # Clients connect from 127.0.0.1, so their sessions are bound to it
+    stop = threading.Event()
+    clients = []
+    for n in range(args.clients):
+        token = session_tokens.issue()
+        store.create_session(token, str(n), f"player{n}", "127.0.0.1")
+        clients.append(Client(server.server_port, token, "127.0.0.1", stop))
+    for client in clients:
+        client.start()
+
+    try:
+        for n in range(1, args.reloads + 1):
+            _write_env(env_file.name, 300 + n, 500 + n)
+            os.kill(os.getpid(), signal.SIGHUP)
+            time.sleep(0.25)
+        _write_env(env_file.name, "not-a-number", 1)
+        os.kill(os.getpid(), signal.SIGHUP)
+        time.sleep(0.5)
+    finally:
+        stop.set()
+        for client in clients:
+            client.join()
+        server.shutdown()
+        os.unlink(env_file.name)
+
+    ok = sum(client.ok for client in clients)
+    failures = [failure for client in clients for failure in client.failures]
+    print(f"{ok} requests succeeded, {len(failures)} failed across {args.reloads + 1} reloads")
+    for failure in failures[:5]:
+        print(f"    {failure}")
+    common.expect(ok > 0 and not failures, "no request failed during the reloads")
+    common.expect((config.CODE_TTL, config.STATUS_BULK_MAX) == (300 + args.reloads, 500 + args.reloads),
+                  "the last valid values were applied")
+    common.finish()
+
+
+if __name__ == "__main__":
+    main()
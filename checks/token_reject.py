@@ -0,0 +1,101 @@
+"""
+Signed session tokens: in-process rejection and its throughput.
+
+Checks that valid tokens verify and that tampered, expired, oversized,
+non-string and non-ASCII ones do not (also through the portal routes), that key rotation keeps accepting tokens of
+the previous key, and that legacy tokens follow SESSION_TOKEN_LEGACY.
+Then sprays forged tokens at /api/refresh-session, checking that none
+of them reaches Redis, and compares the rejection rate with a Redis
+session lookup per token.
+"""
+
+import time
+
+from checks import common
+
+import challenge
+import config
+import session_tokens
+import store
+
+
+def _forged(n: int, kid: str) -> list[str]:
+    expires = int(time.time()) + 3600
+    return [f"{kid}.{expires}.{i:032x}.{i:032x}" for i in range(n)]
+
+
+def main():
+    parser = common.parser("Signed session token rejection benchmark")
+    parser.add_argument("--tokens", type=int, default=100_000, help="forged tokens to verify")
+    parser.add_argument("--requests", type=int, default=5000, help="forged tokens sent to the portal")
+    args = parser.parse_args()
+    r = common.connect(args)
+    app = common.init_portal(r)
+    challenge.set_mode("off")
+    client = app.test_client(use_cookies=False)
+
+    token = session_tokens.issue()
+    kid, expires, nonce, signature = token.split(".")
+    common.expect(session_tokens.verify(token), "an issued token verifies")
+    common.expect(not session_tokens.verify(f"{kid}.{expires}.{nonce}.{'0' * len(signature)}"),
+                  "a tampered signature is rejected")
+    common.expect(not session_tokens.verify(f"{kid}.{int(time.time()) - 1}.{nonce}.{signature}"),
+                  "a changed expiry is rejected")
+    common.expect(not session_tokens.verify("x" * 300), "oversized tokens are rejected")
+    common.expect(not any(session_tokens.verify(bad) for bad in (5, None, ["a"], {"t": 1})),
+                  "non-string tokens are rejected")
+    common.expect(not session_tokens.verify(f"{kid}.{expires}.{nonce}.{'é' * len(signature)}"),
+                  "non-ASCII tokens are rejected")
+    env = {"REMOTE_ADDR": "198.51.100.7"}
+    statuses = [
+        client.post("/api/refresh-session", json={"session_token": 5}, environ_base=env).status_code,
+        client.post("/api/refresh-session", json=[token], environ_base=env).status_code,
+        client.post("/api/refresh-session", headers={"X-Session-Token": f"{kid}.{expires}.{nonce}.{'é' * 32}"},
+                    environ_base=env).status_code,
+        client.get("/api/session-info", query_string={"token": f"{kid}.{expires}.{nonce}.{'é' * 32}"},
+                   environ_base=env).status_code,
+    ]
+    common.expect(statuses == [401, 400, 401, 401], "malformed tokens and bodies get 4xx, not 500")
+
+    keys = config.SESSION_TOKEN_KEYS
+    try:
+        config.SESSION_TOKEN_KEYS = {"new": b"rotated-secret", kid: session_tokens._keys()[kid]}
+        rotated = session_tokens.issue()
+        common.expect(rotated.startswith("new.") and session_tokens.verify(token),
+                      "after rotation new tokens use the new key and old ones still verify")
+        config.SESSION_TOKEN_KEYS = {"new": b"rotated-secret"}
+        common.expect(not session_tokens.verify(token) and session_tokens.verify(rotated),
+                      "dropping the old key invalidates its tokens")
+    finally:
+        config.SESSION_TOKEN_KEYS = keys
+
+    legacy = "ab" * 32
+    legacy_setting = config.SESSION_TOKEN_LEGACY
+    try:
+        config.SESSION_TOKEN_LEGACY = True
+        accepted = session_tokens.verify(legacy)
+        config.SESSION_TOKEN_LEGACY = False
+        common.expect(accepted and not session_tokens.verify(legacy), "legacy tokens follow SESSION_TOKEN_LEGACY")
+    finally:
+        config.SESSION_TOKEN_LEGACY = legacy_setting
+
+    forged = _forged(max(args.tokens, args.requests), kid)
+    rejected, elapsed = common.timed(lambda: sum(not session_tokens.verify(t) for t in forged[:args.tokens]))
+    print(f"  in-process: {rejected} rejected at {args.tokens / elapsed:,.0f}/s")
+    lookups = min(args.tokens, 20_000)
+    _, elapsed = common.timed(lambda: [store.get_session_with_ttl(t) for t in forged[:lookups]])
+    print(f"  Redis lookup per token: {lookups / elapsed:,.0f}/s")
+    common.expect(rejected == args.tokens, "every forged token is rejected")
+
+    statuses = set()
+    with common.RoundTrips(r) as trips:
+        for t in forged[:args.requests]:
+            statuses.add(client.post("/api/refresh-session", headers={"X-Session-Token": t},
+                                     environ_base={"REMOTE_ADDR": "198.51.100.7"}).status_code)
+    print(f"  /api/refresh-session: {args.requests} forged tokens, {trips.count} round trips")
+    common.expect(statuses == {401} and trips.count == 0, "forged tokens are refused without touching Redis")
+    common.finish()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Validation notification harness: long-poll (/api/wait-code) versus polling.
+
+Simulated desktop clients wait for their code to be validated while a
+stand-in for the bot redeems each code after a random delay and publishes
+the validation event. Each mode reports the requests clients sent and
+the latency between validation and the client receiving its session.
+The polling mode calls /api/check-code every --poll-interval seconds,
+like the desktop client did before.
+"""
+
+import random
+import statistics
+import threading
+import time
+
+from checks import common
+
+import challenge
+import config
+import events
+import session_tokens
+import store
+
+
+class Player(threading.Thread):
+    def __init__(self, client, ip: str, mode: str, poll_interval: float, deadline: float):
+        super().__init__(daemon=True)
+        self.client = client
+        self.ip = ip
+        self.mode = mode
+        self.poll_interval = poll_interval
+        self.deadline = deadline
+        self.requests = 0
+        self.received_at = None
+
+    def run(self):
+        env = {"REMOTE_ADDR": self.ip}
+        while time.monotonic() < self.deadline:
+            started = time.monotonic()
+            if self.mode == "wait":
+                resp = self.client.post("/api/wait-code", json={}, environ_base=env)
+            else:
+                resp = self.client.post("/api/check-code", json={}, environ_base=env)
+            self.requests += 1
+            if resp.status_code == 200 and resp.get_json().get("validated"):
+                self.received_at = time.monotonic()
+                return
+            # Like the client: an immediate answer means wait before asking again
+            if self.mode == "poll" or time.monotonic() - started < 1:
+                time.sleep(self.poll_interval)
+
+
+def _run(app, mode: str, players: int, max_delay: float, poll_interval: float, seed: int) -> dict:
+    rng = random.Random(seed)
+    client = app.test_client(use_cookies=False)
+    deadline = time.monotonic() + max_delay + config.WAIT_CODE_TIMEOUT + poll_interval + 5
+    crowd = []
+    for n in range(players):
+        ip = f"192.0.2.{n + 1}" if mode == "wait" else f"198.51.100.{n + 1}"
+        code = f"{mode[0].upper()}{n:03d}"
+        store.create_code(code, ip)
+        crowd.append((Player(client, ip, mode, poll_interval, deadline), code, rng.uniform(0.5, max_delay)))
+
+    for player, _, _ in crowd:
+        player.start()
+    started = time.monotonic()
+    validated_at = {}
+    for player, code, delay in sorted(crowd, key=lambda entry: entry[2]):
+        time.sleep(max(0.0, started + delay - time.monotonic()))
+        # What the bot does on /codigo
+        ip, profile = store.redeem_code(code, "1", "player", session_tokens.issue())
+        validated_at[player.ip] = time.monotonic()
+        events.publish_validated(ip, profile)
+    for player, _, _ in crowd:
+        player.join()
+
+    latencies = [p.received_at - validated_at[p.ip] for p, _, _ in crowd if p.received_at]
+    result = {
+        "delivered": len(latencies),
+        "requests": sum(p.requests for p, _, _ in crowd),
+        "p50": statistics.median(latencies) if latencies else None,
+        "max": max(latencies) if latencies else None,
+    }
+    print(f"  {mode}: {result['delivered']}/{players} delivered, {result['requests']} requests, "
+          f"latency p50 {result['p50'] * 1000:.0f} ms, max {result['max'] * 1000:.0f} ms")
+    return result
+
+
+def main():
+    parser = common.parser("Long-poll versus polling for code validation")
+    parser.add_argument("--players", type=int, default=12, help="clients waiting at once (<= WEB_MAX_HOLDS)")
+    parser.add_argument("--max-delay", type=float, default=8, help="validation happens within this many seconds")
+    parser.add_argument("--poll-interval", type=float, default=5, help="polling mode interval")
+    args = parser.parse_args()
+    r = common.connect(args)
+    app = common.init_portal(r)
+    challenge.set_mode("off")
+
+    print(f"{args.players} players, validated within {args.max_delay:.0f}s")
+    wait = _run(app, "wait", args.players, args.max_delay, args.poll_interval, seed=1)
+    poll = _run(app, "poll", args.players, args.max_delay, args.poll_interval, seed=1)
+    common.expect(wait["delivered"] == args.players, "every long-polling client got its session")
+    common.expect(wait["requests"] < poll["requests"], "long-poll sends fewer requests than polling")
+    common.expect(wait["max"] < 1, "long-poll delivers within a second of validation")
+    statuses = [app.test_client().post("/api/wait-code", json=body).status_code for body in ([1], 5, "x")]
+    common.expect(statuses == [400] * 3, f"non-object bodies get 400, not a crash: {statuses}")
+    common.finish()
+
+
+if __name__ == "__main__":
+    main()
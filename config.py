@@ -1,7 +1,16 @@
+import importlib.util
+import logging
 import os
-from dotenv import load_dotenv
+import threading
 
-load_dotenv()
+from dotenv import dotenv_values, find_dotenv, load_dotenv
+
+log = logging.getLogger(__name__)
+
+_ENV_FILE = find_dotenv()
+load_dotenv(_ENV_FILE)
+# Values read from the file, to tell them apart from the real environment on reload
+_env_file_values = dotenv_values(_ENV_FILE) if _ENV_FILE else {}
 
 FLASK_HOST = os.getenv("FLASK_HOST", "0.0.0.0")
 FLASK_PORT = int(os.getenv("FLASK_PORT", "5000"))
@@ -9,24 +18,100 @@ FLASK_PORT = int(os.getenv("FLASK_PORT", "5000"))
 DISCORD_TOKEN = os.getenv("DISCORD_TOKEN", "")
 DISCORD_CHANNEL_ID = int(os.getenv("DISCORD_CHANNEL_ID", "0"))
 DISCORD_GUILD_ID = int(os.getenv("DISCORD_GUILD_ID", "0"))
+# Also accept codes typed as messages in DISCORD_CHANNEL_ID (requires the
+# privileged message_content intent)
+DISCORD_MESSAGE_FALLBACK = os.getenv("DISCORD_MESSAGE_FALLBACK", "false").lower() in ("1", "true", "yes")
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+# single | sentinel | cluster (see redis_conn.py)
+REDIS_MODE = os.getenv("REDIS_MODE", "single").lower()
+REDIS_SENTINELS = [s.strip() for s in os.getenv("REDIS_SENTINELS", "").split(",") if s.strip()]
+REDIS_SENTINEL_MASTER = os.getenv("REDIS_SENTINEL_MASTER", "mymaster")
+REDIS_SENTINEL_PASSWORD = os.getenv("REDIS_SENTINEL_PASSWORD", "")
+REDIS_PASSWORD = os.getenv("REDIS_PASSWORD", "")
+# Wrap per-IP/per-session identifiers in hash tags; required in cluster mode.
+# Changing it on an existing deployment orphans the keys in the old layout.
+REDIS_HASH_TAGS = os.getenv(
+    "REDIS_HASH_TAGS", "true" if REDIS_MODE == "cluster" else "false"
+).lower() in ("1", "true", "yes")
+# Serve /status and /status/bulk from replicas (sentinel/cluster only)
+REDIS_READ_FROM_REPLICAS = os.getenv("REDIS_READ_FROM_REPLICAS", "false").lower() in ("1", "true", "yes")
 
 CODE_TTL = int(os.getenv("CODE_TTL", "300"))
 
+
+def _parse_rate(value: str) -> tuple[int, int]:
+    """Parse a "<limit>/<seconds>" rate policy."""
+    limit, _, window = value.partition("/")
+    return int(limit), int(window)
+
+
+# Per-route code generation limits, "<max codes>/<window seconds>"
+RATE_LIMITS = {
+    "index": _parse_rate(os.getenv("RATE_LIMIT_INDEX", "3/300")),
+    "api_request_code": _parse_rate(os.getenv("RATE_LIMIT_API_REQUEST_CODE", "3/300")),
+}
+# In-process flood pre-filter: more than FLOOD_MAX hits per FLOOD_WINDOW seconds
+# from one IP are rejected without touching Redis.
+RATE_LIMIT_FLOOD_MAX = int(os.getenv("RATE_LIMIT_FLOOD_MAX", "20"))
+RATE_LIMIT_FLOOD_WINDOW = int(os.getenv("RATE_LIMIT_FLOOD_WINDOW", "10"))
+
 IPSET_NAME = os.getenv("IPSET_NAME", "jogadores_permitidos")
 PROTECTED_PORTS = os.getenv("PROTECTED_PORTS", "30120")
 
+# Files with one CIDR per line. Blocked networks cannot get codes, renew or be
+# whitelisted; allowlist entries carve exceptions (longest prefix wins).
+# Files are re-read when they change, checked every PREFIX_RELOAD_INTERVAL seconds.
+PREFIX_BLOCKLIST_FILES = [p.strip() for p in os.getenv("PREFIX_BLOCKLIST_FILES", "").split(",") if p.strip()]
+PREFIX_ALLOWLIST_FILES = [p.strip() for p in os.getenv("PREFIX_ALLOWLIST_FILES", "").split(",") if p.strip()]
+PREFIX_RELOAD_INTERVAL = int(os.getenv("PREFIX_RELOAD_INTERVAL", "30"))
+
+# X-Forwarded-* headers are only honored when the direct peer is in this set
+# (IPs/CIDRs, plus files with one CIDR per line, e.g. Cloudflare's ranges)
 TRUSTED_PROXIES = [
     p.strip() for p in os.getenv("TRUSTED_PROXIES", "127.0.0.1").split(",") if p.strip()
 ]
-
+TRUSTED_PROXY_FILES = [p.strip() for p in os.getenv("TRUSTED_PROXY_FILES", "").split(",") if p.strip()]
+# Maximum X-Forwarded-For entries read (number of proxy hops in front of Flask)
 PROXY_FIX_X_FOR = int(os.getenv("PROXY_FIX_X_FOR", "1"))
 
 PORTAL_URL = os.getenv("PORTAL_URL", "http://localhost:5000")
 
+# Attack mode: "/" and /api/request-code require a proof-of-work first.
+# "auto" turns it on for ATTACK_MODE_COOLDOWN seconds when a process sees more
+# than ATTACK_MODE_THRESHOLD req/s (averaged over ATTACK_MODE_WINDOW seconds)
+# on those routes; "on"/"off" force it. /whitelist ataque overrides at runtime.
+ATTACK_MODE = os.getenv("ATTACK_MODE", "auto").lower()
+ATTACK_MODE_THRESHOLD = int(os.getenv("ATTACK_MODE_THRESHOLD", "20"))
+ATTACK_MODE_WINDOW = int(os.getenv("ATTACK_MODE_WINDOW", "10"))
+ATTACK_MODE_COOLDOWN = int(os.getenv("ATTACK_MODE_COOLDOWN", "300"))
+# Challenge signing key; generated once and shared through Redis when empty
+POW_SECRET = os.getenv("POW_SECRET", "")
+# Leading zero bits required (max 32); each bit doubles the client work
+POW_DIFFICULTY = min(int(os.getenv("POW_DIFFICULTY", "16")), 32)
+POW_TTL = int(os.getenv("POW_TTL", "120"))
+
+# Maximum seconds /api/wait-code and /api/code-events hold a request open
+WAIT_CODE_TIMEOUT = int(os.getenv("WAIT_CODE_TIMEOUT", "25"))
+# Requests one web process may hold open at once on those endpoints; beyond
+# it they answer immediately and the client polls. Keep it below WEB_THREADS
+# so code pages cannot take every thread away from "/" and heartbeats.
+WEB_MAX_HOLDS = int(os.getenv("WEB_MAX_HOLDS", str(max(int(os.getenv("WEB_THREADS", "32")) // 2, 1))))
+# Reconnect delay (seconds) sent to browsers whose code-events stream was refused
+HOLD_RETRY = int(os.getenv("HOLD_RETRY", "10"))
+
+# Maximum number of IPs accepted by POST /status/bulk
+STATUS_BULK_MAX = int(os.getenv("STATUS_BULK_MAX", "500"))
+STATUS_BULK_TOKEN = os.getenv("STATUS_BULK_TOKEN", "")
+
 LOG_WEBHOOK = os.getenv("LOG_WEBHOOK", "")
 
+# Audit log stream: approximate maximum entries, and age after which the bot trims them (0 = keep)
+AUDIT_MAXLEN = int(os.getenv("AUDIT_MAXLEN", "500000"))
+AUDIT_RETENTION_DAYS = int(os.getenv("AUDIT_RETENTION_DAYS", "90"))
+
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
 RECAPTCHA_SITE_KEY = os.getenv("RECAPTCHA_SITE_KEY", "")
 RECAPTCHA_SECRET_KEY = os.getenv("RECAPTCHA_SECRET_KEY", "")
 RECAPTCHA_SCORE_THRESHOLD = float(os.getenv("RECAPTCHA_SCORE_THRESHOLD", "0.5"))
@@ -34,3 +119,146 @@ RECAPTCHA_SCORE_THRESHOLD = float(os.getenv("RECAPTCHA_SCORE_THRESHOLD", "0.5"))
 SESSION_TTL = int(os.getenv("SESSION_TTL", str(15 * 24 * 3600)))  # 15 days
 SESSION_WARNING_THRESHOLD = int(os.getenv("SESSION_WARNING_THRESHOLD", str(2 * 24 * 3600)))  # 2 days before expiry
 SESSION_CHECK_INTERVAL = int(os.getenv("SESSION_CHECK_INTERVAL", "3600"))  # Check every 1 hour
+# Heartbeats from an unchanged IP only reset the session TTL once less than
+# this fraction of SESSION_TTL remains; other heartbeats write nothing
+SESSION_REFRESH_FRACTION = float(os.getenv("SESSION_REFRESH_FRACTION", "0.9"))
+
+
+def _parse_token_keys(value: str) -> dict[str, bytes]:
+    """Parse "kid:secret,..." into {kid: secret}, the signing key first."""
+    keys = {}
+    for entry in value.split(","):
+        kid, _, secret = entry.strip().partition(":")
+        if not kid:
+            continue
+        if not kid.isalnum() or not secret:
+            raise ValueError(f"Invalid SESSION_TOKEN_KEYS entry for key {kid!r}")
+        keys[kid] = secret.encode()
+    return keys
+
+
+# Session token signing (see session_tokens.py): keys, lifetime of a token (a session
+# cannot be renewed past it) and whether unsigned pre-signing tokens still work
+SESSION_TOKEN_KEYS = _parse_token_keys(os.getenv("SESSION_TOKEN_KEYS", ""))
+SESSION_TOKEN_TTL = int(os.getenv("SESSION_TOKEN_TTL", str(365 * 24 * 3600)))
+SESSION_TOKEN_LEGACY = os.getenv("SESSION_TOKEN_LEGACY", "true").lower() in ("1", "true", "yes")
+
+
+def _load_profiles(default: str) -> dict[str, dict]:
+    """Server profiles: {name: {"ipset", "ports", "session_ttl", "channel_id"}}.
+
+    The default profile uses IPSET_NAME, PROTECTED_PORTS, SESSION_TTL and
+    DISCORD_CHANNEL_ID. Extra profiles are named in SERVER_PROFILES and
+    read PROFILE_<NAME>_IPSET / _PORTS / _SESSION_TTL / _CHANNEL_ID.
+    """
+    profiles = {default: {
+        "ipset": IPSET_NAME,
+        "ports": PROTECTED_PORTS,
+        "session_ttl": SESSION_TTL,
+        "channel_id": DISCORD_CHANNEL_ID,
+    }}
+    for name in os.getenv("SERVER_PROFILES", "").split(","):
+        name = name.strip().lower()
+        if not name or name == default:
+            continue
+        if not name.replace("_", "").replace("-", "").isalnum():
+            raise ValueError(f"Invalid server profile name {name!r}")
+        env = f"PROFILE_{name.upper().replace('-', '_')}_"
+        profiles[name] = {
+            "ipset": os.getenv(env + "IPSET", f"{IPSET_NAME}_{name}"),
+            "ports": os.getenv(env + "PORTS", PROTECTED_PORTS),
+            "session_ttl": int(os.getenv(env + "SESSION_TTL", str(SESSION_TTL))),
+            "channel_id": int(os.getenv(env + "CHANNEL_ID", "0")),
+        }
+    return profiles
+
+
+# One whitelist per protected game server (see profiles.py)
+DEFAULT_PROFILE = os.getenv("DEFAULT_PROFILE", "main").strip().lower()
+SERVER_PROFILES = _load_profiles(DEFAULT_PROFILE)
+
+# Active IP garbage collector: removes IPs whose sessions expired more than
+# ACTIVE_GC_GRACE seconds ago (grace lets connected players finish), every ACTIVE_GC_INTERVAL
+ACTIVE_GC_INTERVAL = int(os.getenv("ACTIVE_GC_INTERVAL", "300"))
+ACTIVE_GC_GRACE = int(os.getenv("ACTIVE_GC_GRACE", "3600"))
+
+# Expiry warning DMs sent in parallel and retries on Discord rate limits
+DM_CONCURRENCY = int(os.getenv("DM_CONCURRENCY", "5"))
+DM_MAX_RETRIES = int(os.getenv("DM_MAX_RETRIES", "3"))
+
+
+# Settings a running process cannot change (connections, listening address,
+# Discord login, Redis key layout); reload() keeps their startup values.
+FROZEN = frozenset({
+    "FLASK_HOST", "FLASK_PORT",
+    "DISCORD_TOKEN", "DISCORD_GUILD_ID", "DISCORD_MESSAGE_FALLBACK",
+    "REDIS_URL", "REDIS_MODE", "REDIS_SENTINELS", "REDIS_SENTINEL_MASTER",
+    "REDIS_SENTINEL_PASSWORD", "REDIS_PASSWORD", "REDIS_HASH_TAGS", "REDIS_READ_FROM_REPLICAS",
+    "DEFAULT_PROFILE", "POW_SECRET", "WEB_MAX_HOLDS",
+})
+
+_reload_lock = threading.Lock()
+_reload_callbacks = []
+
+
+def on_reload(callback) -> None:
+    """Call callback() after every reload(), to rebuild state derived from settings."""
+    _reload_callbacks.append(callback)
+
+
+def _refresh_env() -> None:
+    """Apply .env changes to os.environ.
+
+    Only variables that came from the file are touched: a value set in the
+    real environment (shell, docker-compose "environment:") still wins.
+    """
+    global _env_file_values
+    values = dotenv_values(_ENV_FILE) if _ENV_FILE else {}
+    for name, old in _env_file_values.items():
+        if name not in values and old is not None and os.environ.get(name) == old:
+            del os.environ[name]
+    for name, value in values.items():
+        if value is None:
+            continue
+        current = os.environ.get(name)
+        if current is None or current == _env_file_values.get(name):
+            os.environ[name] = value
+    _env_file_values = values
+
+
+def reload() -> list[str]:
+    """Re-read .env and apply the new settings in place (SIGHUP, see main.py).
+
+    Modules read settings as config.NAME when they use them, so new values
+    apply from the next request/iteration. If a value does not parse, the
+    error is logged and the current settings are kept. Returns the names of
+    the settings that changed.
+    """
+    with _reload_lock:
+        try:
+            _refresh_env()
+            spec = importlib.util.find_spec(__name__)
+            fresh = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(fresh)
+        except Exception as e:
+            log.error("Configuration reload failed, keeping the current settings: %s", e)
+            return []
+
+        settings = globals()
+        changed = []
+        for name, value in vars(fresh).items():
+            if name.startswith("_") or not name.isupper() or settings.get(name) == value:
+                continue
+            if name in FROZEN:
+                log.warning("%s changed but needs a restart, keeping the current value", name)
+                continue
+            settings[name] = value
+            changed.append(name)
+
+    log.info("Configuration reloaded, %s", f"changed: {', '.join(changed)}" if changed else "no changes")
+    for callback in list(_reload_callbacks):
+        try:
+            callback()
+        except Exception as e:
+            log.error("Reload callback %s failed: %s", getattr(callback, "__qualname__", callback), e)
+    return changed
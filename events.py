@@ -0,0 +1,94 @@
+import logging
+import threading
+import time
+
+import profiles
+
+log = logging.getLogger(__name__)
+
+_redis = None
+
+CHANNEL_PREFIX = "whitelist:validated:"
+
+
+def init(redis_client):
+    global _redis
+    _redis = redis_client
+
+
+def _topic(ip: str, profile: str | None) -> str:
+    """Channel suffix: the IP, prefixed with the profile outside the default one."""
+    if not profile or profile == profiles.DEFAULT:
+        return ip
+    return f"{profile}/{ip}"
+
+
+def publish_validated(ip: str, profile: str | None = None) -> None:
+    """Notify waiting portal requests that a code for this IP was validated.
+
+    Only the IP travels over pub/sub; the session token stays in the
+    pending_session key and is handed out by the web endpoints.
+    """
+    try:
+        _redis.publish(f"{CHANNEL_PREFIX}{_topic(ip, profile)}", "1")
+    except Exception as e:
+        log.error("Failed to publish validation event for %s: %s", ip, e)
+
+
+# Web side: a single pattern subscription per process fans out to the
+# request threads currently waiting on an IP (per profile).
+_lock = threading.Lock()
+_waiters: dict[str, list[threading.Event]] = {}
+_listener: threading.Thread | None = None
+_subscribed = threading.Event()
+
+
+def _listen() -> None:
+    while True:
+        try:
+            pubsub = _redis.pubsub(ignore_subscribe_messages=True)
+            pubsub.psubscribe(f"{CHANNEL_PREFIX}*")
+            _subscribed.set()
+            for message in pubsub.listen():
+                topic = message["channel"].removeprefix(CHANNEL_PREFIX)
+                with _lock:
+                    waiting = _waiters.pop(topic, [])
+                for event in waiting:
+                    event.set()
+        except Exception as e:
+            _subscribed.clear()
+            log.error("Validation event listener failed, retrying in 1s: %s", e)
+            time.sleep(1)
+
+
+def _ensure_listener() -> None:
+    global _listener
+    with _lock:
+        if _listener is None:
+            _listener = threading.Thread(target=_listen, name="validation-events", daemon=True)
+            _listener.start()
+    _subscribed.wait(timeout=2)
+
+
+def subscribe(ip: str, profile: str | None = None) -> threading.Event:
+    """Register interest in the next validation of this IP.
+
+    Register before checking current state, then wait on the returned event,
+    so a validation between the check and the wait is not missed.
+    """
+    _ensure_listener()
+    event = threading.Event()
+    topic = _topic(ip, profile)
+    with _lock:
+        _waiters.setdefault(topic, []).append(event)
+    return event
+
+
+def unsubscribe(ip: str, event: threading.Event, profile: str | None = None) -> None:
+    topic = _topic(ip, profile)
+    with _lock:
+        waiting = _waiters.get(topic)
+        if waiting and event in waiting:
+            waiting.remove(event)
+            if not waiting:
+                del _waiters[topic]
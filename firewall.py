@@ -2,18 +2,28 @@ import ipaddress
 import json
 import logging
 
+import prefixset
+import profiles
+import redis_conn
+
 log = logging.getLogger(__name__)
 
 _redis = None
+_replica = None
 
 QUEUE_KEY = "whitelist:firewall_queue"
 ACTIVE_PREFIX = "whitelist:active:"
 
 
-def init(redis_client) -> None:
-    """Store the Redis client for later use."""
-    global _redis
+def init(redis_client, replica=None) -> None:
+    """Store the Redis clients for later use.
+
+    Membership checks asked with from_replica go to replica when given (see
+    REDIS_READ_FROM_REPLICAS).
+    """
+    global _redis, _replica
     _redis = redis_client
+    _replica = replica or redis_client
     log.info("Firewall module initialized (Redis proxy mode)")
 
 
@@ -32,37 +42,79 @@ def _enqueue(command: dict) -> bool:
         return False
 
 
-def add_ip(ip: str) -> bool:
+def _command(action: str, profile: str | None, **fields) -> dict:
+    """Queue command; the agent maps the profile to its ipset (default if absent)."""
+    return {"action": action, "profile": profile or profiles.DEFAULT, **fields}
+
+
+def add_ip(ip: str, profile: str | None = None) -> bool:
     ip = _validate_ip(ip)
-    ok = _enqueue({"action": "add", "ip": ip})
+    if prefixset.blocked(ip):
+        log.warning("Refusing to whitelist blocked IP %s", ip)
+        return False
+    ok = _enqueue(_command("add", profile, ip=ip))
     if ok:
-        log.info("Enqueued IP add: %s", ip)
+        log.info("Enqueued IP add: %s (%s)", ip, profile or profiles.DEFAULT)
     return ok
 
 
-def remove_ip(ip: str) -> bool:
+def add_many(ips: list[str], profile: str | None = None, chunk_size: int = 10_000) -> int:
+    """Enqueue many IPs in one RPUSH; the agent applies each chunk with ipset restore.
+
+    Invalid and blocked IPs are skipped. Returns the number of IPs enqueued.
+    """
+    valid = []
+    for ip in ips:
+        try:
+            ip = _validate_ip(ip)
+        except ValueError:
+            log.warning("Skipping invalid IP %r", ip)
+            continue
+        if prefixset.blocked(ip):
+            log.warning("Refusing to whitelist blocked IP %s", ip)
+            continue
+        valid.append(ip)
+    if not valid:
+        return 0
+
+    commands = [
+        json.dumps(_command("add_many", profile, ips=valid[start:start + chunk_size]))
+        for start in range(0, len(valid), chunk_size)
+    ]
+    try:
+        _redis.rpush(QUEUE_KEY, *commands)
+    except Exception as e:
+        log.error("Failed to enqueue firewall command: %s", e)
+        return 0
+    log.info("Enqueued %d IP adds in %d batches (%s)", len(valid), len(commands), profile or profiles.DEFAULT)
+    return len(valid)
+
+
+def remove_ip(ip: str, profile: str | None = None) -> bool:
     ip = _validate_ip(ip)
-    ok = _enqueue({"action": "remove", "ip": ip})
+    ok = _enqueue(_command("remove", profile, ip=ip))
     if ok:
-        log.info("Enqueued IP remove: %s", ip)
+        log.info("Enqueued IP remove: %s (%s)", ip, profile or profiles.DEFAULT)
     return ok
 
 
-def flush() -> bool:
-    ok = _enqueue({"action": "flush"})
+def flush(profile: str | None = None) -> bool:
+    """Flush one profile's ipset, or every profile's when profile is None."""
+    ok = True
+    for name in [profile] if profile else profiles.names():
+        ok = _enqueue(_command("flush", name)) and ok
     if ok:
-        log.info("Enqueued ipset flush")
+        log.info("Enqueued ipset flush (%s)", profile or "all profiles")
     return ok
 
 
-def is_whitelisted(ip: str) -> bool:
-    ip = _validate_ip(ip)
-    return _redis.exists(f"{ACTIVE_PREFIX}{ip}") == 1
-
+def is_whitelisted(ip: str, profile: str | None = None, from_replica: bool = False) -> bool:
+    """Whether ip has an active record.
 
-def list_ips() -> list[str]:
-    ips = []
-    for key in _redis.scan_iter(f"{ACTIVE_PREFIX}*"):
-        ip = key.removeprefix(ACTIVE_PREFIX)
-        ips.append(ip)
-    return ips
+    Flows that act on the answer right after a write (code generation,
+    validation polling) must read the primary; only read-only status
+    checks should pass from_replica and accept replication lag.
+    """
+    ip = _validate_ip(ip)
+    client = _replica if from_replica else _redis
+    return client.exists(redis_conn.key(profiles.scoped(ACTIVE_PREFIX, profile), ip)) == 1
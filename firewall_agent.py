@@ -4,7 +4,12 @@ Firewall agent — runs natively on the host with root privileges.
 
 Connects to Redis, restores active IPs into ipset on startup,
 then consumes commands from the firewall queue to manage ipset
-in real time.
+in real time. Each server profile (see config.py) has its own ipset
+and ports; queued commands are applied in batches, one ipset restore
+per batch for all sets.
+
+SIGHUP re-reads .env and applies only what changed: ipsets and port rules
+of added or removed profiles/ports; existing sets and rules are untouched.
 
 Usage:
     sudo python3 firewall_agent.py
@@ -20,9 +25,14 @@ import signal
 import time
 
 import redis as redis_lib
-from dotenv import load_dotenv
+from redis.cluster import RedisCluster
+from redis.sentinel import Sentinel
+from dotenv import dotenv_values, find_dotenv, load_dotenv
 
-load_dotenv()
+_ENV_FILE = find_dotenv()
+load_dotenv(_ENV_FILE)
+# Values read from the file, to tell them apart from the real environment on reload
+_env_file_values = dotenv_values(_ENV_FILE) if _ENV_FILE else {}
 
 logging.basicConfig(
     level=logging.INFO,
@@ -31,12 +41,66 @@ logging.basicConfig(
 log = logging.getLogger("firewall_agent")
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+REDIS_MODE = os.getenv("REDIS_MODE", "single").lower()
+REDIS_SENTINELS = os.getenv("REDIS_SENTINELS", "")
+REDIS_SENTINEL_MASTER = os.getenv("REDIS_SENTINEL_MASTER", "mymaster")
 IPSET_NAME = os.getenv("IPSET_NAME", "jogadores_permitidos")
 PROTECTED_PORTS = os.getenv("PROTECTED_PORTS", "30120")
+DEFAULT_PROFILE = os.getenv("DEFAULT_PROFILE", "main").strip().lower()
 QUEUE_KEY = "whitelist:firewall_queue"
 ACTIVE_PREFIX = "whitelist:active:"
+# Commands popped from the queue and applied per ipset restore
+APPLY_BATCH = int(os.getenv("FIREWALL_APPLY_BATCH", "500"))
+AUDIT_KEY = "whitelist:audit"
+AUDIT_MAXLEN = int(os.getenv("AUDIT_MAXLEN", "500000"))
+# Chain created by setup_firewall.sh; game port rules go right after its
+# ESTABLISHED and loopback rules
+CHAIN = "FILTRO_CIDADE"
+GAME_RULES_POSITION = 3
 
 _running = True
+_reload_requested = False
+
+
+def _load_profiles() -> dict[str, dict]:
+    """Profile name -> {"ipset", "ports"}, from the same variables as config.py."""
+    profiles = {DEFAULT_PROFILE: {"ipset": IPSET_NAME, "ports": PROTECTED_PORTS}}
+    for name in os.getenv("SERVER_PROFILES", "").split(","):
+        name = name.strip().lower()
+        if not name or name == DEFAULT_PROFILE:
+            continue
+        env = f"PROFILE_{name.upper().replace('-', '_')}_"
+        profiles[name] = {
+            "ipset": os.getenv(env + "IPSET", f"{IPSET_NAME}_{name}"),
+            "ports": os.getenv(env + "PORTS", PROTECTED_PORTS),
+        }
+    return profiles
+
+
+PROFILES = _load_profiles()
+
+
+def _active_prefix(profile: str) -> str:
+    """Active key prefix of a profile (mirrors profiles.scoped())."""
+    if profile == DEFAULT_PROFILE:
+        return ACTIVE_PREFIX
+    return ACTIVE_PREFIX.replace("whitelist:", f"whitelist:{profile}:", 1)
+
+
+def _connect():
+    """Connect the same way as the portal (see redis_conn.py)."""
+    if REDIS_MODE == "sentinel":
+        nodes = [(h, int(p)) for h, _, p in (s.strip().rpartition(":") for s in REDIS_SENTINELS.split(",") if s.strip())]
+        sentinel = Sentinel(
+            nodes,
+            sentinel_kwargs={"password": os.getenv("REDIS_SENTINEL_PASSWORD") or None},
+            password=os.getenv("REDIS_PASSWORD") or None,
+            decode_responses=True,
+        )
+        return sentinel.master_for(REDIS_SENTINEL_MASTER)
+    if REDIS_MODE == "cluster":
+        return RedisCluster.from_url(REDIS_URL, decode_responses=True)
+    return redis_lib.Redis.from_url(REDIS_URL, decode_responses=True)
 
 
 def _run(cmd: list[str]) -> subprocess.CompletedProcess:
@@ -47,6 +111,12 @@ def _validate_ip(ip: str) -> str:
     return str(ipaddress.ip_address(ip))
 
 
+def _ipset_restore(lines: list[str]) -> subprocess.CompletedProcess:
+    """Apply many ipset commands ("add SET IP", "del ...", "flush SET") in one process."""
+    data = "".join(line + "\n" for line in lines)
+    return subprocess.run(["ipset", "-exist", "restore"], input=data, capture_output=True, text=True, timeout=60)
+
+
 def setup_firewall() -> None:
     """Run setup_firewall.sh to create ipset + iptables rules."""
     script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "setup_firewall.sh")
@@ -60,7 +130,11 @@ def setup_firewall() -> None:
         capture_output=True,
         text=True,
         timeout=30,
-        env={**os.environ, "IPSET_NAME": IPSET_NAME, "PROTECTED_PORTS": PROTECTED_PORTS},
+        env={
+            **os.environ,
+            # "set=ports;set=ports", one entry per profile
+            "FIREWALL_SETS": ";".join(f"{p['ipset']}={p['ports']}" for p in PROFILES.values()),
+        },
     )
     if result.returncode != 0:
         log.error("setup_firewall.sh failed:\n%s", result.stderr.strip())
@@ -72,53 +146,258 @@ def setup_firewall() -> None:
     log.info("Firewall rules applied successfully")
 
 
-def restore_ips(r: redis_lib.Redis) -> int:
-    """Restore all active IPs from Redis into ipset."""
+def restore_ips(r: redis_lib.Redis, batch_size: int = 10_000, profiles: list[str] | None = None) -> int:
+    """Restore the active IPs of every profile (or only of profiles) from Redis into their ipsets."""
     count = 0
-    for key in r.scan_iter(f"{ACTIVE_PREFIX}*"):
-        ip = key.removeprefix(ACTIVE_PREFIX)
-        try:
-            ip = _validate_ip(ip)
-        except ValueError:
-            log.warning("Skipping invalid IP in Redis: %s", ip)
-            continue
-        result = _run(["ipset", "add", IPSET_NAME, ip, "-exist"])
+    batch = []
+
+    def flush_batch():
+        nonlocal count
+        result = _ipset_restore(batch)
         if result.returncode == 0:
-            count += 1
+            count += len(batch)
         else:
-            log.error("Failed to restore IP %s: %s", ip, result.stderr.strip())
+            log.error("Failed to restore %d IPs: %s", len(batch), result.stderr.strip())
+        batch.clear()
+
+    for profile, settings in PROFILES.items():
+        if profiles is not None and profile not in profiles:
+            continue
+        prefix = _active_prefix(profile)
+        for key in r.scan_iter(f"{prefix}*", count=1000):
+            # Hash-tagged layout wraps the IP in braces: whitelist:active:{ip}
+            ip = key.removeprefix(prefix).strip("{}")
+            try:
+                batch.append(f"add {settings['ipset']} {_validate_ip(ip)}")
+            except ValueError:
+                log.warning("Skipping invalid IP in Redis: %s", ip)
+                continue
+            if len(batch) >= batch_size:
+                flush_batch()
+    if batch:
+        flush_batch()
     return count
 
 
-def handle_command(cmd: dict) -> None:
-    """Execute a single firewall command from the queue."""
-    action = cmd.get("action")
+def _audit_entry(event: str, ip: str | None = None, detail: str | None = None) -> dict:
+    """An audit stream entry (same schema as audit.py)."""
+    entry = {"e": event, "s": "agent"}
+    if ip:
+        entry["ip"] = ip
+    if detail:
+        entry["x"] = detail
+    return entry
 
-    if action == "add":
-        ip = _validate_ip(cmd["ip"])
-        result = _run(["ipset", "add", IPSET_NAME, ip, "-exist"])
-        if result.returncode != 0:
-            log.error("ipset add %s failed: %s", ip, result.stderr.strip())
-        else:
-            log.info("IP added to ipset: %s", ip)
 
-    elif action == "remove":
-        ip = _validate_ip(cmd["ip"])
-        result = _run(["ipset", "del", IPSET_NAME, ip, "-exist"])
-        if result.returncode != 0:
-            log.error("ipset del %s failed: %s", ip, result.stderr.strip())
-        else:
-            log.info("IP removed from ipset: %s", ip)
+def _audit_many(r: redis_lib.Redis, entries: list[dict]) -> None:
+    """Append entries to the audit stream in one round trip; never raises."""
+    if not entries:
+        return
+    try:
+        pipe = r.pipeline(transaction=False)
+        for entry in entries:
+            pipe.xadd(AUDIT_KEY, entry, maxlen=AUDIT_MAXLEN, approximate=True)
+        pipe.execute()
+    except Exception as e:
+        log.error("Failed to record %d audit events: %s", len(entries), e)
+
+
+def _audit(r: redis_lib.Redis, event: str, ip: str | None = None, detail: str | None = None) -> None:
+    _audit_many(r, [_audit_entry(event, ip, detail)])
+
+
+# Audit event per queue action
+AUDIT_EVENTS = {"add": "fw_add", "add_many": "fw_add_many", "remove": "fw_remove", "flush": "fw_flush"}
+
 
+def _parse_command(cmd: dict) -> tuple[str, str, list[str]]:
+    """(action, ipset, IPs) of a queue command; raises ValueError/KeyError if invalid."""
+    action = cmd.get("action")
+    profile = cmd.get("profile") or DEFAULT_PROFILE
+    if profile not in PROFILES:
+        raise ValueError(f"unknown profile {profile!r}")
+    if action in ("add", "remove"):
+        ips = [_validate_ip(cmd["ip"])]
+    elif action == "add_many":
+        ips = []
+        for ip in cmd.get("ips", []):
+            try:
+                ips.append(_validate_ip(ip))
+            except ValueError:
+                log.warning("Skipping invalid IP in add_many: %s", ip)
     elif action == "flush":
-        result = _run(["ipset", "flush", IPSET_NAME])
+        ips = []
+    else:
+        raise ValueError(f"unknown action {action!r}")
+    return action, PROFILES[profile]["ipset"], ips
+
+
+def _lines(action: str, ipset: str, ips: list[str]) -> list[str]:
+    if action == "flush":
+        return [f"flush {ipset}"]
+    verb = "del" if action == "remove" else "add"
+    return [f"{verb} {ipset} {ip}" for ip in ips]
+
+
+def apply_commands(r: redis_lib.Redis, cmds: list[dict]) -> None:
+    """Apply queue commands for any number of sets with one ipset restore.
+
+    If the batch fails, each command is retried on its own so one bad
+    command does not hold back the rest.
+    """
+    parsed = []
+    for cmd in cmds:
+        try:
+            parsed.append(_parse_command(cmd))
+        except (KeyError, ValueError) as e:
+            log.error("Invalid firewall command %s: %s", cmd, e)
+    _apply(r, parsed)
+
+
+def _apply(r: redis_lib.Redis, parsed: list[tuple[str, str, list[str]]]) -> None:
+    lines = [line for action, ipset, ips in parsed for line in _lines(action, ipset, ips)]
+    if not lines:
+        return
+
+    result = _ipset_restore(lines)
+    if result.returncode != 0 and len(parsed) > 1:
+        log.warning("Batch of %d commands failed (%s), applying one by one", len(parsed), result.stderr.strip())
+        for entry in parsed:
+            _apply(r, [entry])
+        return
+
+    entries = []
+    for action, ipset, ips in parsed:
+        detail = ipset if action != "add_many" else f"{ipset}: {len(ips)} IPs"
         if result.returncode != 0:
-            log.error("ipset flush failed: %s", result.stderr.strip())
+            log.error("ipset %s on %s failed: %s", action, ipset, result.stderr.strip())
+            detail += f", failed: {result.stderr.strip()}"
+        elif action == "add_many":
+            log.info("%d IPs added to ipset %s", len(ips), ipset)
         else:
-            log.info("ipset flushed")
+            log.info("ipset %s %s", action, " ".join([ipset, *ips]))
+        entries.append(_audit_entry(AUDIT_EVENTS[action], ips[0] if len(ips) == 1 and action != "add_many" else None,
+                                    detail))
+    _audit_many(r, entries)
 
-    else:
-        log.warning("Unknown command action: %s", action)
+
+def handle_command(r: redis_lib.Redis, cmd: dict) -> None:
+    """Execute a single firewall command from the queue."""
+    apply_commands(r, [cmd])
+
+
+def _pop_batch(r: redis_lib.Redis) -> list[dict]:
+    """Block for one command, then take whatever else is queued (up to APPLY_BATCH)."""
+    result = r.blpop(QUEUE_KEY, timeout=5)
+    if result is None:
+        return []
+    raws = [result[1]]
+    if APPLY_BATCH > 1:
+        raws += r.lpop(QUEUE_KEY, APPLY_BATCH - 1) or []
+    cmds = []
+    for raw in raws:
+        try:
+            cmds.append(json.loads(raw))
+        except ValueError as e:
+            log.error("Invalid command data: %s", e)
+    return cmds
+
+
+def _refresh_env() -> None:
+    """Apply .env changes to os.environ (same rules as config._refresh_env)."""
+    global _env_file_values
+    values = dotenv_values(_ENV_FILE) if _ENV_FILE else {}
+    for name, old in _env_file_values.items():
+        if name not in values and old is not None and os.environ.get(name) == old:
+            del os.environ[name]
+    for name, value in values.items():
+        if value is None:
+            continue
+        current = os.environ.get(name)
+        if current is None or current == _env_file_values.get(name):
+            os.environ[name] = value
+    _env_file_values = values
+
+
+def _port_rules(ipset: str, port: str) -> list[list[str]]:
+    """The rules setup_firewall.sh creates for one game port of a set, in chain order."""
+    return [
+        ["-p", "tcp", "--dport", port, "-m", "set", "--match-set", ipset, "src", "-j", "ACCEPT"],
+        ["-p", "udp", "--dport", port, "-m", "set", "--match-set", ipset, "src", "-j", "ACCEPT"],
+        ["-p", "tcp", "--dport", port, "-j", "DROP"],
+        ["-p", "udp", "--dport", port, "-j", "DROP"],
+    ]
+
+
+def _ports(profiles: dict[str, dict]) -> set[tuple[str, str]]:
+    """(ipset, port) pairs protected by a profile configuration."""
+    return {
+        (p["ipset"], port.strip())
+        for p in profiles.values() for port in p["ports"].split(",") if port.strip()
+    }
+
+
+def _checked(cmd: list[str]) -> bool:
+    result = _run(cmd)
+    if result.returncode != 0:
+        log.error("%s failed: %s", " ".join(cmd), result.stderr.strip())
+    return result.returncode == 0
+
+
+def reload_firewall(r: redis_lib.Redis) -> None:
+    """Re-read .env and apply only the ipset/iptables differences.
+
+    New sets are created and filled from Redis before their port rules are
+    inserted, so whitelisted players are never dropped; rules and sets no
+    longer configured are removed afterwards. The chain is never flushed.
+    """
+    global IPSET_NAME, PROTECTED_PORTS, APPLY_BATCH, AUDIT_MAXLEN, PROFILES
+    _refresh_env()
+    try:
+        apply_batch = int(os.getenv("FIREWALL_APPLY_BATCH", "500"))
+        audit_maxlen = int(os.getenv("AUDIT_MAXLEN", "500000"))
+    except ValueError as e:
+        log.error("Reload failed, keeping the current configuration: %s", e)
+        return
+    if os.getenv("DEFAULT_PROFILE", "main").strip().lower() != DEFAULT_PROFILE:
+        log.warning("DEFAULT_PROFILE changed but needs a restart, keeping %s", DEFAULT_PROFILE)
+    APPLY_BATCH, AUDIT_MAXLEN = apply_batch, audit_maxlen
+    IPSET_NAME = os.getenv("IPSET_NAME", "jogadores_permitidos")
+    PROTECTED_PORTS = os.getenv("PROTECTED_PORTS", "30120")
+
+    old, new = PROFILES, _load_profiles()
+    old_sets = {p["ipset"] for p in old.values()}
+    new_sets = {p["ipset"] for p in new.values()}
+    for ipset in sorted(new_sets - old_sets):
+        _checked(["ipset", "create", ipset, "hash:ip", "-exist"])
+    PROFILES = new
+    refill = [name for name, p in new.items() if name not in old or old[name]["ipset"] != p["ipset"]]
+    restored = restore_ips(r, profiles=refill) if refill else 0
+
+    added = sorted(_ports(new) - _ports(old))
+    removed = sorted(_ports(old) - _ports(new))
+    for ipset, port in added:
+        # Inserted bottom-up at the same position, so ACCEPTs end up above DROPs
+        for rule in reversed(_port_rules(ipset, port)):
+            _checked(["iptables", "-I", CHAIN, str(GAME_RULES_POSITION), *rule])
+    for ipset, port in removed:
+        for rule in _port_rules(ipset, port):
+            _checked(["iptables", "-D", CHAIN, *rule])
+    for ipset in sorted(old_sets - new_sets):
+        _checked(["ipset", "destroy", ipset])
+
+    summary = (
+        f"+{len(added)} -{len(removed)} ports, +{len(new_sets - old_sets)} -{len(old_sets - new_sets)} sets, "
+        f"{restored} IPs restored"
+    )
+    log.info("Configuration reloaded: %s", summary)
+    _audit(r, "fw_reload", detail=summary)
+
+
+def _request_reload(signum, frame):
+    global _reload_requested
+    log.info("Received SIGHUP, reloading after the current batch")
+    _reload_requested = True
 
 
 def _shutdown(signum, frame):
@@ -128,13 +407,16 @@ def _shutdown(signum, frame):
 
 
 def main():
+    global _reload_requested
     signal.signal(signal.SIGINT, _shutdown)
     signal.signal(signal.SIGTERM, _shutdown)
+    signal.signal(signal.SIGHUP, _request_reload)
 
     log.info("Firewall agent starting...")
-    log.info("Redis: %s | ipset: %s", REDIS_URL, IPSET_NAME)
+    log.info("Redis: %s (%s) | profiles: %s", REDIS_URL, REDIS_MODE,
+             ", ".join(f"{name} -> {p['ipset']} ({p['ports']})" for name, p in PROFILES.items()))
 
-    r = redis_lib.Redis.from_url(REDIS_URL, decode_responses=True)
+    r = _connect()
     r.ping()
     log.info("Redis connected")
 
@@ -147,21 +429,19 @@ def main():
 
     while _running:
         try:
-            result = r.blpop(QUEUE_KEY, timeout=5)
-            if result is None:
-                continue
-            _, raw = result
-            cmd = json.loads(raw)
-            handle_command(cmd)
+            if _reload_requested:
+                _reload_requested = False
+                reload_firewall(r)
+            cmds = _pop_batch(r)
+            if cmds:
+                apply_commands(r, cmds)
         except redis_lib.ConnectionError:
             log.error("Redis connection lost, reconnecting in 5s...")
             time.sleep(5)
             try:
                 r.ping()
             except Exception:
-                r = redis_lib.Redis.from_url(REDIS_URL, decode_responses=True)
-        except ValueError as e:
-            log.error("Invalid command data: %s", e)
+                r = _connect()
         except Exception as e:
             log.error("Unexpected error: %s", e)
             time.sleep(1)
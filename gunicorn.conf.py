@@ -0,0 +1,23 @@
+import os
+
+import config
+
+# SIGHUP to the master re-executes this file, then forks new workers and
+# gracefully stops the old ones (in-flight requests get graceful_timeout to
+# finish) while the listening socket stays open. Reload first so the new
+# workers, forked from the master, start with the new .env values.
+config.reload()
+
+bind = f"{config.FLASK_HOST}:{config.FLASK_PORT}"
+workers = int(os.getenv("WEB_WORKERS", "2"))
+# Threads keep long-poll / SSE requests (/api/wait-code, /api/code-events)
+# from blocking a whole worker. At most WEB_MAX_HOLDS threads per worker hold
+# such requests (see web._holds); the rest always serve "/", heartbeats and
+# status checks. Per replica: workers * WEB_MAX_HOLDS players waiting on a
+# push, more than that fall back to polling.
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", "32"))
+timeout = 60
+graceful_timeout = 30
+accesslog = None
+errorlog = "-"
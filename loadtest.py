@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""
+Synthetic load test for the portal endpoints.
+
+Simulated players hit the portal with a weighted mix of scenarios:
+
+    fresh      new player: code from "/" (browser) or /api/request-code
+               (desktop), validated as the bot would, then /status and
+               "/" (browser) or /api/check-code (desktop) to pick up the session
+    returning  browser with a session cookie opening "/"
+    heartbeat  desktop client: /api/refresh-session and /api/session-info
+    rotation   known player from a new IP: /renew (browser) or
+               /api/refresh-session (desktop)
+
+By default the Flask app runs in-process on an in-memory Redis stand-in
+(fakeredis, a test-only dependency: pip install fakeredis), so the numbers
+measure the portal's own cost per request. --backend redis uses REDIS_URL
+instead (point it at a throwaway Redis: players, sessions and firewall
+commands are written and never cleaned up), and --url sends real HTTP to a
+running portal sharing that Redis. Over HTTP the simulated client IP goes
+in X-Forwarded-For, so the harness host must be in TRUSTED_PROXIES.
+Attack mode is switched off for the run and restored afterwards.
+
+Results (throughput, p50/p95/p99 and status codes per route) are printed
+and can be saved as JSON. Errors count 5xx, connection failures and code
+requests answered 200 without a code; --compare reports changes against a saved run
+and exits with status 1 on a regression beyond --tolerance.
+
+Usage:
+    python3 loadtest.py [--duration 30] [--concurrency 8] [--players 2000]
+                        [--mix fresh=5,returning=20,heartbeat=60,rotation=15]
+                        [--backend memory|redis] [--url http://127.0.0.1:5000]
+                        [--save run.json] [--compare baseline.json] [--tolerance 0.15]
+"""
+
+import argparse
+import http.client
+import ipaddress
+import itertools
+import json
+import logging
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from urllib.parse import urlparse
+
+import audit
+import challenge
+import config
+import events
+import firewall
+import session_tokens
+import store
+import web
+
+log = logging.getLogger(__name__)
+
+ROUTES = (
+    "/", "/renew", "/status", "/api/request-code", "/api/check-code",
+    "/api/refresh-session", "/api/session-info",
+)
+DEFAULT_MIX = "fresh=5,returning=20,heartbeat=60,rotation=15"
+CODE_RE = re.compile(r'id="code">([A-Z0-9]{4})<')
+# Simulated players get consecutive addresses from 10.0.0.0/8
+_ips = itertools.count(1)
+
+
+def _next_ip() -> str:
+    return str(ipaddress.IPv4Address(0x0A000000 + next(_ips)))
+
+
+class InProcess:
+    """Requests through Flask's test client (one per worker thread)."""
+
+    def __init__(self, app):
+        # Cookies are sent explicitly per simulated player, not kept in a jar
+        self.client = app.test_client(use_cookies=False)
+
+    def request(self, method: str, path: str, ip: str, headers: dict | None = None,
+                body: dict | None = None) -> tuple[int, str]:
+        resp = self.client.open(path, method=method, headers=headers, json=body,
+                                environ_base={"REMOTE_ADDR": ip})
+        return resp.status_code, resp.get_data(as_text=True)
+
+
+class Http:
+    """Requests over a keep-alive HTTP connection (one per worker thread)."""
+
+    def __init__(self, url: str):
+        parsed = urlparse(url)
+        conn_class = http.client.HTTPSConnection if parsed.scheme == "https" else http.client.HTTPConnection
+        self.conn = conn_class(parsed.hostname, parsed.port, timeout=30)
+
+    def request(self, method: str, path: str, ip: str, headers: dict | None = None,
+                body: dict | None = None) -> tuple[int, str]:
+        headers = {**(headers or {}), "X-Forwarded-For": ip}
+        data = None
+        if body is not None:
+            data = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        try:
+            self.conn.request(method, path, body=data, headers=headers)
+            resp = self.conn.getresponse()
+            return resp.status, resp.read().decode("utf-8", "replace")
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            raise
+
+
+class Recorder:
+    """Latencies, status codes and failed flows per route, merged across workers."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        # 200 responses that did not carry what the flow needed (e.g. no code)
+        self.failures = Counter()
+
+    def merge(self, other: "Recorder") -> None:
+        for route, values in other.latencies.items():
+            self.latencies[route].extend(values)
+        for route, counts in other.statuses.items():
+            self.statuses[route].update(counts)
+        self.failures.update(other.failures)
+
+
+class Player:
+    __slots__ = ("ip", "token", "desktop")
+
+    def __init__(self, ip: str, token: str, desktop: bool):
+        self.ip = ip
+        self.token = token
+        self.desktop = desktop
+
+
+def _validate(code: str, ip: str) -> str | None:
+    """Redeem a code like the Discord bot does; returns the session token."""
+    token = session_tokens.issue()
+    redeemed = store.redeem_code(code, str(random.randrange(10**17, 10**18)), "loadtest", token)
+    if redeemed is None:
+        return None
+    events.publish_validated(*redeemed)
+    return token
+
+
+def seed(count: int) -> list[Player]:
+    """Whitelisted players with sessions, written straight to Redis."""
+    players = []
+    for n in range(count):
+        ip = _next_ip()
+        code = f"seed{n}"
+        store.create_code(code, ip)
+        token = _validate(code, ip)
+        store.pop_pending(ip)
+        players.append(Player(ip, token, desktop=n % 2 == 0))
+    return players
+
+
+class Worker(threading.Thread):
+    def __init__(self, transport, players: list[Player], mix: list[tuple[str, int]], deadline: float):
+        super().__init__(daemon=True)
+        self.transport = transport
+        self.players = players
+        self.scenarios = [getattr(self, name) for name, _ in mix]
+        self.weights = [weight for _, weight in mix]
+        self.deadline = deadline
+        self.recorder = Recorder()
+        self.fresh_count = 0
+
+    def call(self, route: str, method: str, path: str, ip: str, **kwargs) -> tuple[int, str]:
+        started = time.perf_counter()
+        try:
+            status, text = self.transport.request(method, path, ip, **kwargs)
+        except (OSError, http.client.HTTPException):
+            status, text = 0, ""
+        self.recorder.latencies[route].append(time.perf_counter() - started)
+        self.recorder.statuses[route][status] += 1
+        return status, text
+
+    def _cookie(self, player: Player) -> dict:
+        return {"Cookie": f"{web.SESSION_COOKIE}={player.token}"}
+
+    def fresh(self) -> None:
+        ip = _next_ip()
+        self.fresh_count += 1
+        desktop = self.fresh_count % 2 == 0
+        if desktop:
+            route = "/api/request-code"
+            status, text = self.call(route, "POST", route, ip, body={})
+            code = json.loads(text).get("code") if status == 200 else None
+        else:
+            route = "/"
+            status, text = self.call(route, "GET", route, ip)
+            match = CODE_RE.search(text) if status == 200 else None
+            code = match and match.group(1)
+        if not code:
+            if status == 200:
+                self.recorder.failures[route] += 1
+            return
+        token = _validate(code, ip)
+        if token is None:
+            return
+        self.call("/status", "GET", f"/status?ip={ip}", ip)
+        if desktop:
+            self.call("/api/check-code", "POST", "/api/check-code", ip, body={})
+        else:
+            self.call("/", "GET", "/", ip)
+        self.players.append(Player(ip, token, desktop))
+
+    def _pick(self) -> Player | None:
+        return random.choice(self.players) if self.players else None
+
+    def returning(self) -> None:
+        player = self._pick()
+        if player is None:
+            return
+        self.call("/", "GET", "/", player.ip, headers=self._cookie(player))
+
+    def heartbeat(self) -> None:
+        player = self._pick()
+        if player is None:
+            return
+        headers = {"X-Session-Token": player.token}
+        self.call("/api/refresh-session", "POST", "/api/refresh-session", player.ip, headers=headers, body={})
+        self.call("/api/session-info", "GET", "/api/session-info", player.ip, headers=headers)
+
+    def rotation(self) -> None:
+        player = self._pick()
+        if player is None:
+            return
+        player.ip = _next_ip()
+        if player.desktop:
+            self.call("/api/refresh-session", "POST", "/api/refresh-session", player.ip,
+                      headers={"X-Session-Token": player.token}, body={})
+        else:
+            self.call("/renew", "POST", "/renew", player.ip, headers=self._cookie(player), body={})
+
+    def run(self) -> None:
+        while time.monotonic() < self.deadline:
+            random.choices(self.scenarios, self.weights)[0]()
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, round(pct / 100 * len(values)) - 1))]
+
+
+def summarize(recorder: Recorder, elapsed: float) -> dict:
+    routes = {}
+    for route in ROUTES:
+        values = sorted(recorder.latencies.get(route, []))
+        if not values:
+            continue
+        statuses = recorder.statuses[route]
+        routes[route] = {
+            "count": len(values),
+            "rps": len(values) / elapsed,
+            "p50_ms": _percentile(values, 50) * 1000,
+            "p95_ms": _percentile(values, 95) * 1000,
+            "p99_ms": _percentile(values, 99) * 1000,
+            "errors": sum(n for status, n in statuses.items() if status == 0 or status >= 500)
+            + recorder.failures[route],
+            "no_code": recorder.failures[route],
+            "statuses": {str(status): n for status, n in sorted(statuses.items())},
+        }
+    total = sum(r["count"] for r in routes.values())
+    return {
+        "routes": routes,
+        "total": {
+            "count": total,
+            "rps": total / elapsed,
+            "errors": sum(r["errors"] for r in routes.values()),
+        },
+    }
+
+
+def print_report(result: dict) -> None:
+    print(f"{'route':<22} {'count':>8} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}  statuses")
+    for route, r in result["routes"].items():
+        statuses = " ".join(f"{status}:{n}" for status, n in r["statuses"].items())
+        print(
+            f"{route:<22} {r['count']:>8} {r['rps']:>9.1f} {r['p50_ms']:>8.2f} "
+            f"{r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['errors']:>7}  {statuses}"
+        )
+    total = result["total"]
+    print(f"{'total':<22} {total['count']:>8} {total['rps']:>9.1f} {'':>8} {'':>8} {'':>8} {total['errors']:>7}")
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> bool:
+    """Print changes against a saved run; returns True if any route regressed."""
+    regressed = False
+    print(f"\nAgainst {baseline.get('started', 'baseline')}:")
+    for route, new in result["routes"].items():
+        old = baseline["routes"].get(route)
+        if not old:
+            continue
+        p95 = new["p95_ms"] / old["p95_ms"] - 1 if old["p95_ms"] else 0.0
+        rps = new["rps"] / old["rps"] - 1 if old["rps"] else 0.0
+        worse = p95 > tolerance or rps < -tolerance or new["errors"] > old["errors"]
+        regressed = regressed or worse
+        print(f"  {route:<22} p95 {old['p95_ms']:.2f} -> {new['p95_ms']:.2f} ms ({p95:+.0%}), "
+              f"req/s {old['rps']:.1f} -> {new['rps']:.1f} ({rps:+.0%}){'  REGRESSION' if worse else ''}")
+    return regressed
+
+
+def _parse_mix(value: str) -> list[tuple[str, int]]:
+    mix = []
+    for entry in value.split(","):
+        name, _, weight = entry.strip().partition("=")
+        if name not in ("fresh", "returning", "heartbeat", "rotation"):
+            raise argparse.ArgumentTypeError(f"unknown scenario {name!r}")
+        if int(weight) > 0:
+            mix.append((name, int(weight)))
+    if not mix:
+        raise argparse.ArgumentTypeError("empty mix")
+    return mix
+
+
+def _connect(backend: str):
+    if backend == "redis":
+        import main
+        return main.connect_redis()
+    try:
+        import fakeredis
+    except ImportError:
+        sys.exit("--backend memory needs fakeredis (pip install fakeredis)")
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic load test for the portal")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of load")
+    parser.add_argument("--concurrency", type=int, default=8, help="simulated clients in parallel")
+    parser.add_argument("--players", type=int, default=2000, help="whitelisted players seeded before the run")
+    parser.add_argument("--mix", type=_parse_mix, default=DEFAULT_MIX, help=f"scenario weights (default {DEFAULT_MIX})")
+    parser.add_argument("--backend", choices=("memory", "redis"), default="memory",
+                        help="in-memory fakeredis or REDIS_URL")
+    parser.add_argument("--url", help="send HTTP to a running portal instead (needs --backend redis)")
+    parser.add_argument("--save", help="write the results as JSON")
+    parser.add_argument("--compare", help="JSON of a previous run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="allowed p95 increase / throughput drop before a regression (0.15 = 15%%)")
+    parser.add_argument("--verbose", action="store_true", help="keep the portal's INFO logs")
+    args = parser.parse_args()
+    if args.url and args.backend != "redis":
+        parser.error("--url needs --backend redis (the harness validates codes in the portal's Redis)")
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    r = _connect(args.backend)
+    if args.url:
+        for module in (challenge, firewall, events, store, session_tokens):
+            module.init(r)
+        audit.init(r, source="loadtest")
+        transport = lambda: Http(args.url)  # noqa: E731
+    else:
+        import main as portal
+        app = portal.init_web(r)
+        transport = lambda: InProcess(app)  # noqa: E731
+
+    previous_mode = r.get(challenge.MODE_KEY)
+    challenge.set_mode("off")
+    try:
+        started = time.monotonic()
+        players = seed(args.players)
+        print(f"Seeded {len(players)} players in {time.monotonic() - started:.1f}s; "
+              f"running {args.duration:.0f}s x {args.concurrency} clients "
+              f"({'HTTP ' + args.url if args.url else 'in-process'}, {args.backend} Redis)")
+
+        deadline = time.monotonic() + args.duration
+        workers = [
+            Worker(transport(), players[i::args.concurrency], args.mix, deadline)
+            for i in range(args.concurrency)
+        ]
+        started = time.monotonic()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.monotonic() - started
+    finally:
+        if previous_mode:
+            r.set(challenge.MODE_KEY, previous_mode)
+        else:
+            r.delete(challenge.MODE_KEY)
+
+    recorder = Recorder()
+    for worker in workers:
+        recorder.merge(worker.recorder)
+    result = {
+        "started": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "settings": {
+            "duration": args.duration, "concurrency": args.concurrency, "players": args.players,
+            "mix": dict(args.mix), "backend": args.backend, "url": args.url,
+            "session_ttl": config.SESSION_TTL, "refresh_fraction": config.SESSION_REFRESH_FRACTION,
+        },
+        **summarize(recorder, elapsed),
+    }
+    print_report(result)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"\nSaved to {args.save}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(result, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,32 @@
+"""
+Entry point for the portal processes.
+
+Roles:
+    web  - Flask portal only (scale horizontally; never imports discord.py)
+    bot  - Discord bot only (run exactly one)
+    all  - both in one process, for development
+
+Usage:
+    python main.py [--role all|web|bot]    (default: $ROLE or "all")
+
+In production the web role runs under gunicorn via wsgi.py.
+
+SIGHUP reloads the configuration without restarting (see config.reload);
+under gunicorn, SIGHUP to the master also rotates the workers gracefully.
+"""
+
+import argparse
 import logging
+import os
+import signal
+import sys
 import threading
+import time
 
 import redis as redis_lib
 
-import bot
 import config
-import firewall
-import web
+import redis_conn
 
 logging.basicConfig(
     level=logging.INFO,
@@ -14,33 +34,139 @@ logging.basicConfig(
 )
 log = logging.getLogger(__name__)
 
+ROLES = ("all", "web", "bot")
+
+# ZADD GT/NX and the Lua scripts need Redis 6.2+
+MIN_REDIS_VERSION = (6, 2)
+
+
+def _redis_version(r) -> str:
+    if redis_conn.is_cluster(r):
+        # One INFO reply per primary; the oldest node decides
+        replies = r.info("server", target_nodes=r.get_primaries())
+        if "redis_version" in replies:  # single-primary cluster: reply not keyed by node
+            replies = {"": replies}
+        versions = [info["redis_version"] for info in replies.values()]
+        return min(versions, key=lambda v: tuple(int(p) for p in v.split(".")[:2]))
+    return r.info("server")["redis_version"]
+
+
+def connect_redis() -> redis_lib.Redis:
+    """Connect to Redis and run the startup health checks shared by all roles."""
+    r = redis_conn.connect()
+    r.ping()
+    version = _redis_version(r)
+    if tuple(int(p) for p in version.split(".")[:2]) < MIN_REDIS_VERSION:
+        raise RuntimeError(f"Redis {version} is too old, need {'.'.join(map(str, MIN_REDIS_VERSION))}+")
+    log.info(
+        "Redis connected (mode %s, version %s, hash tags %s, replica reads %s)",
+        config.REDIS_MODE, version,
+        "on" if config.REDIS_HASH_TAGS else "off",
+        "on" if config.REDIS_READ_FROM_REPLICAS else "off",
+    )
+    return r
+
+
+def init_web(r: redis_lib.Redis):
+    """Initialize the modules used by the portal and return the Flask app."""
+    import audit
+    import challenge
+    import events
+    import firewall
+    import prefixset
+    import ratelimit
+    import session_tokens
+    import store
+    import web
 
-def start_flask():
-    web.app.run(
+    prefixset.start()
+    replica = redis_conn.connect_replica(r)
+    audit.init(r, source="web")
+    for module in (web, challenge, events, ratelimit, session_tokens):
+        module.init(r)
+    for module in (firewall, store):
+        module.init(r, replica)
+
+    template = os.path.join(web.app.root_path, web.app.template_folder, "index.html")
+    if not os.path.isfile(template):
+        raise RuntimeError(f"Template not found: {template}")
+    return web.app
+
+
+def init_bot(r: redis_lib.Redis):
+    """Initialize the modules used by the Discord bot and return the bot module."""
+    if not config.DISCORD_TOKEN:
+        raise RuntimeError("DISCORD_TOKEN is not set")
+
+    import audit
+    import bot
+    import challenge
+    import events
+    import firewall
+    import prefixset
+    import session_tokens
+    import store
+
+    prefixset.start()
+    audit.init(r, source="bot")
+    for module in (bot, challenge, firewall, events, store, session_tokens):
+        module.init(r)
+    return bot
+
+
+def install_reload_handler() -> None:
+    """Reload the configuration on SIGHUP."""
+    def handle(signum, frame):
+        # Off the signal handler: reload callbacks read files and talk to the bot loop
+        threading.Thread(target=config.reload, daemon=True, name="config-reload").start()
+
+    signal.signal(signal.SIGHUP, handle)
+
+
+def start_flask(app):
+    app.run(
         host=config.FLASK_HOST,
         port=config.FLASK_PORT,
         debug=False,
         use_reloader=False,
+        threaded=True,
     )
 
 
 def main():
-    log.info("Initializing whitelist portal...")
+    parser = argparse.ArgumentParser(description="Whitelist portal")
+    parser.add_argument("--role", choices=ROLES, default=os.getenv("ROLE", "all"))
+    role = parser.parse_args().role
 
-    r = redis_lib.Redis.from_url(config.REDIS_URL, decode_responses=True)
-    r.ping()
-    log.info("Redis connected")
+    log.info("Initializing whitelist portal (role: %s)...", role)
+    started = time.perf_counter()
+
+    try:
+        r = connect_redis()
+        app = init_web(r) if role in ("web", "all") else None
+        discord_bot = init_bot(r) if role in ("bot", "all") else None
+    except Exception as e:
+        log.error("Startup check failed: %s", e)
+        sys.exit(1)
+    install_reload_handler()
+
+    log.info(
+        "Role %s ready in %.0f ms (discord.py loaded: %s)",
+        role, (time.perf_counter() - started) * 1000, "discord" in sys.modules,
+    )
 
-    web.init(r)
-    bot.init(r)
-    firewall.init(r)
+    if discord_bot is None:
+        log.info("Flask starting on %s:%s", config.FLASK_HOST, config.FLASK_PORT)
+        start_flask(app)
+        return
 
-    flask_thread = threading.Thread(target=start_flask, daemon=True)
-    flask_thread.start()
-    log.info("Flask started on %s:%s", config.FLASK_HOST, config.FLASK_PORT)
+    if app is not None:
+        flask_thread = threading.Thread(target=start_flask, args=(app,), daemon=True)
+        flask_thread.start()
+        log.info("Flask started on %s:%s", config.FLASK_HOST, config.FLASK_PORT)
 
     log.info("Starting Discord bot...")
-    bot.client.run(config.DISCORD_TOKEN, log_handler=None)
+    discord_bot.client.run(config.DISCORD_TOKEN, log_handler=None)
 
 
 if __name__ == "__main__":
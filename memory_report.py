@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Memory report for whitelist records.
+
+Samples session and active keys, measures them with MEMORY USAGE and
+extrapolates bytes per 100k records, split by encoding (legacy JSON
+strings vs compact hashes), so the effect of the hash migration can be
+read off a live Redis. For before/after numbers on a scratch keyspace
+seeded with both encodings, run python3 -m checks.record_memory.
+
+Usage:
+    python3 memory_report.py [--sample 2000]
+"""
+
+import argparse
+from collections import defaultdict
+
+import redis as redis_lib
+
+import redis_conn
+import store
+
+ENCODINGS = {"string": "json (legacy)", "hash": f"hash v{store.FORMAT_VERSION}"}
+
+
+def measure(r: redis_lib.Redis, prefix: str, sample: int) -> dict[str, list[int]]:
+    keys = []
+    for key in r.scan_iter(f"{prefix}*", count=1000):
+        keys.append(key)
+        if len(keys) >= sample:
+            break
+
+    pipe = r.pipeline(transaction=False)
+    for key in keys:
+        pipe.type(key)
+        pipe.memory_usage(key, samples=0)
+    replies = pipe.execute()
+
+    sizes = defaultdict(list)
+    for kind, usage in zip(replies[::2], replies[1::2]):
+        if usage is not None:
+            sizes[kind].append(usage)
+    return sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Whitelist record memory report")
+    parser.add_argument("--sample", type=int, default=2000, help="keys sampled per family")
+    args = parser.parse_args()
+
+    r = redis_conn.connect()
+
+    for label, prefix in (("sessions", store.SESSION_PREFIX), ("active", store.ACTIVE_PREFIX)):
+        sizes = measure(r, prefix, args.sample)
+        if not sizes:
+            print(f"{label}: no keys")
+            continue
+        for kind, values in sorted(sizes.items()):
+            avg = sum(values) / len(values)
+            print(
+                f"{label:<9} {ENCODINGS.get(kind, kind):<14} "
+                f"sampled={len(values):<6} avg={avg:7.1f} B  per 100k={avg * 100_000 / 1024 / 1024:7.2f} MiB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+import threading
+from collections import Counter
+
+_lock = threading.Lock()
+_counters: Counter = Counter()
+
+
+def incr(name: str, amount: int = 1) -> None:
+    """Increment an in-process counter."""
+    with _lock:
+        _counters[name] += amount
+
+
+def snapshot() -> dict:
+    """Return a copy of all counters."""
+    with _lock:
+        return dict(_counters)
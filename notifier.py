@@ -0,0 +1,85 @@
+import asyncio
+import logging
+import random
+from collections import Counter, OrderedDict
+
+import discord
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+
+class DMDispatcher:
+    """Send DMs to many users with bounded concurrency.
+
+    Works with anything shaped like discord.Client: ``fetch_user(id)``
+    returning an object with an async ``send(**kwargs)``. User objects are
+    cached, each user receives at most one message per dispatch, and rate
+    limits / server errors are retried with exponential backoff.
+    """
+
+    def __init__(self, client, concurrency: int = 5, max_retries: int = 3,
+                 backoff: float = 1.0, cache_size: int = 5000):
+        self.client = client
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.cache_size = cache_size
+        self.counters: Counter = Counter()
+        self._users: OrderedDict = OrderedDict()
+
+    async def _get_user(self, user_id: int):
+        user = self._users.get(user_id)
+        if user is not None:
+            self._users.move_to_end(user_id)
+            return user
+        user = await self.client.fetch_user(user_id)
+        self._users[user_id] = user
+        if len(self._users) > self.cache_size:
+            self._users.popitem(last=False)
+        return user
+
+    def _count(self, outcome: str) -> str:
+        self.counters[outcome] += 1
+        metrics.incr(f"dm.{outcome}")
+        return outcome
+
+    async def _send(self, user_id: int, message: dict) -> str:
+        for attempt in range(self.max_retries + 1):
+            try:
+                user = await self._get_user(user_id)
+                await user.send(**message)
+                return self._count("sent")
+            except discord.Forbidden:
+                return self._count("forbidden")
+            except discord.NotFound:
+                return self._count("failed")
+            except (discord.RateLimited, discord.HTTPException) as e:
+                if isinstance(e, discord.RateLimited):
+                    delay = e.retry_after
+                elif e.status == 429 or e.status >= 500:
+                    delay = self.backoff * 2 ** attempt
+                else:
+                    log.error("DM to %s failed: %s", user_id, e)
+                    return self._count("failed")
+                if attempt == self.max_retries:
+                    log.error("DM to %s failed after %d retries: %s", user_id, attempt, e)
+                    return self._count("failed")
+                self.counters["retried"] += 1
+                await asyncio.sleep(delay + random.uniform(0, self.backoff))
+            except Exception as e:
+                log.error("DM to %s failed: %s", user_id, e)
+                return self._count("failed")
+
+    async def dispatch(self, messages: dict[int, dict]) -> dict[int, str]:
+        """Send one message per user; returns user_id -> sent/forbidden/failed."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def worker(user_id: int, message: dict) -> str:
+            async with semaphore:
+                return await self._send(user_id, message)
+
+        user_ids = list(messages)
+        outcomes = await asyncio.gather(*(worker(uid, messages[uid]) for uid in user_ids))
+        return dict(zip(user_ids, outcomes))
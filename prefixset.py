@@ -0,0 +1,233 @@
+"""
+In-memory IPv4/IPv6 network lists with longest-prefix matching.
+
+PrefixSet keeps one sorted array of network keys per prefix length
+(4 bytes per IPv4 prefix, 8 bytes per IPv6 prefix up to /64), so a
+million prefixes fit in a few MiB. A lookup binary-searches each prefix
+length present, longest first.
+
+The module-level blocklist is loaded from PREFIX_BLOCKLIST_FILES, with
+PREFIX_ALLOWLIST_FILES as exceptions (the longest matching prefix wins,
+an allow entry wins a tie), and reloaded when the files change.
+"""
+
+import bisect
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from array import array
+
+import config
+
+log = logging.getLogger(__name__)
+
+BLOCK = 0
+ALLOW = 1
+
+
+def parse_network(text: str) -> tuple[int, int, int]:
+    """Parse "addr[/len]" into (version, address int, prefix length).
+
+    Host bits are allowed (as with strict=False). Much faster than
+    ipaddress.ip_network, which matters when loading large lists.
+    """
+    addr, _, length = text.partition("/")
+    if ":" in addr:
+        version, bits = 6, 128
+        value = int.from_bytes(socket.inet_pton(socket.AF_INET6, addr), "big")
+    else:
+        version, bits = 4, 32
+        value = int.from_bytes(socket.inet_pton(socket.AF_INET, addr), "big")
+    prefixlen = int(length) if length else bits
+    if not 0 <= prefixlen <= bits:
+        raise ValueError(f"Invalid prefix length in {text!r}")
+    return version, value, prefixlen
+
+
+_V4_MAPPED = 0xFFFF << 32
+
+
+def parse_ip(text: str) -> tuple[int, int]:
+    """Parse an IP into (version, int); IPv4-mapped IPv6 becomes IPv4."""
+    try:
+        if ":" in text:
+            value = int.from_bytes(socket.inet_pton(socket.AF_INET6, text), "big")
+            if value >> 32 == 0xFFFF:
+                return 4, value ^ _V4_MAPPED
+            return 6, value
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, text), "big")
+    except OSError:
+        raise ValueError(f"Invalid IP address {text!r}") from None
+
+
+class PrefixSet:
+    """Longest-prefix match table. Build with add(), then call freeze()."""
+
+    def __init__(self):
+        self._pending = {4: {}, 6: {}}  # version -> {prefixlen: {key: value}}
+        self._tables = {4: [], 6: []}  # version -> [(prefixlen, shift, keys, values)]
+        self.count = 0
+
+    def add(self, network, value: int = 1) -> None:
+        """Add a network (str or ip_network) mapped to a small int value (0-255)."""
+        if isinstance(network, str):
+            version, address, prefixlen = parse_network(network)
+        else:
+            version, address, prefixlen = network.version, int(network.network_address), network.prefixlen
+        shift = (32 if version == 4 else 128) - prefixlen
+        by_len = self._pending[version].setdefault(prefixlen, {})
+        by_len[address >> shift] = value
+
+    def freeze(self) -> "PrefixSet":
+        """Compact the added networks into the lookup tables."""
+        self.count = 0
+        for version, by_len in self._pending.items():
+            tables = []
+            for prefixlen in sorted(by_len, reverse=True):
+                entries = by_len[prefixlen]
+                shift = (32 if version == 4 else 128) - prefixlen
+                if prefixlen > 64:
+                    # Rare long IPv6 prefixes do not fit an 8-byte array slot
+                    keys = dict(entries)
+                    values = None
+                else:
+                    ordered = sorted(entries)
+                    keys = array("I" if prefixlen <= 32 else "Q", ordered)
+                    values = bytes(entries[k] for k in ordered)
+                tables.append((prefixlen, shift, keys, values))
+                self.count += len(entries)
+            self._tables[version] = tables
+        self._pending = {4: {}, 6: {}}
+        return self
+
+    def lookup(self, ip) -> int | None:
+        """Value of the longest prefix containing ip, or None."""
+        if isinstance(ip, str):
+            version, n = parse_ip(ip)
+        elif ip.version == 6 and ip.ipv4_mapped:
+            version, n = 4, int(ip.ipv4_mapped)
+        else:
+            version, n = ip.version, int(ip)
+        for _, shift, keys, values in self._tables[version]:
+            key = n >> shift
+            if values is None:
+                value = keys.get(key)
+                if value is not None:
+                    return value
+                continue
+            i = bisect.bisect_left(keys, key)
+            if i < len(keys) and keys[i] == key:
+                return values[i]
+        return None
+
+    def __contains__(self, ip) -> bool:
+        return self.lookup(ip) is not None
+
+    def nbytes(self) -> int:
+        """Approximate memory held by the lookup tables."""
+        total = 0
+        for tables in self._tables.values():
+            for _, _, keys, values in tables:
+                if values is None:
+                    total += sys.getsizeof(keys) + sum(sys.getsizeof(k) for k in keys)
+                else:
+                    total += keys.itemsize * len(keys) + len(values)
+        return total
+
+
+def load_file(table: PrefixSet, path: str, value: int) -> None:
+    """Add every network of a file with one CIDR or IP per line (# comments)."""
+    invalid = 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            try:
+                table.add(line, value)
+            except (OSError, ValueError):  # inet_pton raises OSError
+                invalid += 1
+                if invalid <= 5:
+                    log.warning("Ignoring invalid network in %s: %r", path, line)
+    if invalid:
+        log.warning("%s: %d invalid lines ignored", path, invalid)
+
+
+# Module-level blocklist, swapped atomically on reload
+_blocklist = PrefixSet()
+_mtimes: dict[str, float] = {}
+_reloader: threading.Thread | None = None
+_started = False
+
+
+def _files() -> list[tuple[str, int]]:
+    return (
+        [(path, BLOCK) for path in config.PREFIX_BLOCKLIST_FILES]
+        + [(path, ALLOW) for path in config.PREFIX_ALLOWLIST_FILES]
+    )
+
+
+def _current_mtimes() -> dict[str, float]:
+    mtimes = {}
+    for path, _ in _files():
+        try:
+            mtimes[path] = os.stat(path).st_mtime
+        except OSError:
+            mtimes[path] = 0.0
+    return mtimes
+
+
+def load() -> None:
+    """Rebuild the blocklist from the configured files."""
+    global _blocklist, _mtimes
+    started = time.monotonic()
+    mtimes = _current_mtimes()
+    table = PrefixSet()
+    for path, value in _files():  # allow files last, so they win ties
+        try:
+            load_file(table, path, value)
+        except OSError as e:
+            log.error("Could not read prefix list %s: %s", path, e)
+    _blocklist = table.freeze()
+    _mtimes = mtimes
+    if table.count:
+        log.info(
+            "Prefix lists loaded: %d prefixes, %.1f KiB, in %.2fs",
+            table.count, table.nbytes() / 1024, time.monotonic() - started,
+        )
+
+
+def _watch() -> None:
+    while True:
+        time.sleep(config.PREFIX_RELOAD_INTERVAL)
+        try:
+            if _current_mtimes() != _mtimes:
+                load()
+        except Exception as e:
+            log.error("Prefix list reload failed: %s", e)
+
+
+def start() -> None:
+    """Load the lists and watch the files for changes (once per process).
+
+    Runs again on config reload, picking up new file lists.
+    """
+    global _reloader, _started
+    load()
+    if not _started:
+        _started = True
+        config.on_reload(start)
+    if _reloader is None and _files() and config.PREFIX_RELOAD_INTERVAL > 0:
+        _reloader = threading.Thread(target=_watch, daemon=True, name="prefixset-reload")
+        _reloader.start()
+
+
+def blocked(ip) -> bool:
+    return _blocklist.lookup(ip) == BLOCK
+
+
+def stats() -> dict:
+    return {"prefixset.prefixes": _blocklist.count, "prefixset.bytes": _blocklist.nbytes()}
@@ -0,0 +1,59 @@
+"""
+Server profiles: one whitelist per protected game server.
+
+Each profile has its own ipset and ports (applied by the firewall agent),
+session TTL and Discord code channel (see config.SERVER_PROFILES). Codes
+and sessions record the profile they belong to, and active IPs, pending
+session tokens and per-user IP indexes live in a per-profile key
+namespace, so the same IP can be whitelisted on one server and not on
+another. The default profile keeps the original key names.
+"""
+
+import config
+
+DEFAULT = config.DEFAULT_PROFILE
+
+
+def names() -> list[str]:
+    return list(config.SERVER_PROFILES)
+
+
+def resolve(name: str | None) -> str:
+    """Profile name for a request parameter; empty means the default. Raises ValueError."""
+    name = (name or "").strip().lower() or DEFAULT
+    if name not in config.SERVER_PROFILES:
+        raise ValueError(f"Unknown server profile {name!r}")
+    return name
+
+
+def get(name: str | None) -> dict:
+    return config.SERVER_PROFILES[name or DEFAULT]
+
+
+def session_ttl(name: str | None) -> int:
+    return get(name)["session_ttl"]
+
+
+def max_session_ttl() -> int:
+    """Longest session TTL of any profile (lifetime of cross-profile indexes)."""
+    return max(profile["session_ttl"] for profile in config.SERVER_PROFILES.values())
+
+
+def for_channel(channel_id: int) -> str | None:
+    for name, profile in config.SERVER_PROFILES.items():
+        if profile["channel_id"] and profile["channel_id"] == channel_id:
+            return name
+    return None
+
+
+def scoped(key: str, name: str | None) -> str:
+    """Redis key or prefix in a profile's namespace: whitelist:x -> whitelist:<name>:x."""
+    if not name or name == DEFAULT:
+        return key
+    return key.replace("whitelist:", f"whitelist:{name}:", 1)
+
+
+def portal_url(name: str | None) -> str:
+    if not name or name == DEFAULT:
+        return config.PORTAL_URL
+    return f"{config.PORTAL_URL}?profile={name}"
@@ -0,0 +1,117 @@
+"""
+WSGI middleware that honors X-Forwarded-* headers only from trusted proxies.
+
+Replaces werkzeug's ProxyFix, which trusts the configured number of hops
+from any peer. Here the headers are used only when the direct peer is in
+the TRUSTED_PROXIES / TRUSTED_PROXY_FILES prefix set. The client IP is
+then the rightmost X-Forwarded-For entry that is not itself a trusted
+proxy, reading at most PROXY_FIX_X_FOR entries.
+"""
+
+import ipaddress
+import logging
+
+import config
+import prefixset
+
+log = logging.getLogger(__name__)
+
+
+def load_trusted() -> prefixset.PrefixSet:
+    """Build the trusted proxy set from TRUSTED_PROXIES and TRUSTED_PROXY_FILES."""
+    trusted = prefixset.PrefixSet()
+    for entry in config.TRUSTED_PROXIES:
+        try:
+            trusted.add(entry)
+        except (OSError, ValueError):
+            log.warning("Ignoring invalid TRUSTED_PROXIES entry: %r", entry)
+    for path in config.TRUSTED_PROXY_FILES:
+        try:
+            prefixset.load_file(trusted, path, 1)
+        except OSError as e:
+            log.error("Could not read trusted proxy list %s: %s", path, e)
+    trusted.freeze()
+    log.info("Trusted proxies: %d prefixes", trusted.count)
+    return trusted
+
+
+def _last(value: str) -> str:
+    return value.rsplit(",", 1)[-1].strip()
+
+
+class TrustedProxyMiddleware:
+    def __init__(self, app, trusted: prefixset.PrefixSet, x_for: int = 1):
+        self.app = app
+        self.trusted = trusted
+        self.x_for = x_for
+        self._warned = False
+
+    def reload(self) -> None:
+        """Re-read the trusted proxy settings (config reload callback)."""
+        self.trusted = load_trusted()
+        self.x_for = config.PROXY_FIX_X_FOR
+
+    def _is_trusted(self, ip: str) -> bool:
+        try:
+            return self.trusted.lookup(ip) is not None
+        except ValueError:
+            return False
+
+    def _warn_untrusted(self, peer: str) -> None:
+        """Flag a likely missing TRUSTED_PROXIES entry, once per process.
+
+        A private peer sending X-Forwarded-For is almost always the reverse
+        proxy itself; without it in TRUSTED_PROXIES every visitor shares the
+        proxy's IP for codes, rate limits and the whitelist.
+        """
+        try:
+            private = ipaddress.ip_address(peer).is_private
+        except ValueError:
+            return
+        if private:
+            self._warned = True
+            log.error("X-Forwarded-For received from untrusted private peer %s; add the reverse proxy "
+                      "to TRUSTED_PROXIES or all clients will be seen as %s", peer, peer)
+
+    def _client_ip(self, peer: str, forwarded_for: str) -> str:
+        client = peer
+        for hop, entry in enumerate(reversed(forwarded_for.split(","))):
+            if hop >= self.x_for:
+                break
+            entry = entry.strip()
+            try:
+                prefixset.parse_ip(entry)
+            except ValueError:
+                break
+            # Store IPv6 in canonical form; it becomes part of Redis keys
+            client = str(ipaddress.ip_address(entry)) if ":" in entry else entry
+            if self.trusted.lookup(client) is None:
+                break
+        return client
+
+    def __call__(self, environ, start_response):
+        peer = environ.get("REMOTE_ADDR", "")
+        if not peer or not self._is_trusted(peer):
+            if not self._warned and "HTTP_X_FORWARDED_FOR" in environ:
+                self._warn_untrusted(peer)
+            return self.app(environ, start_response)
+
+        environ["proxy.orig"] = {
+            "REMOTE_ADDR": peer,
+            "wsgi.url_scheme": environ.get("wsgi.url_scheme"),
+            "HTTP_HOST": environ.get("HTTP_HOST"),
+            "SCRIPT_NAME": environ.get("SCRIPT_NAME"),
+        }
+        forwarded_for = environ.get("HTTP_X_FORWARDED_FOR")
+        if forwarded_for:
+            environ["REMOTE_ADDR"] = self._client_ip(peer, forwarded_for)
+        proto = environ.get("HTTP_X_FORWARDED_PROTO")
+        if proto:
+            environ["wsgi.url_scheme"] = _last(proto)
+        host = environ.get("HTTP_X_FORWARDED_HOST")
+        if host:
+            environ["HTTP_HOST"] = _last(host)
+        prefix = environ.get("HTTP_X_FORWARDED_PREFIX")
+        if prefix:
+            environ["SCRIPT_NAME"] = _last(prefix).rstrip("/")
+        return self.app(environ, start_response)
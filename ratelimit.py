@@ -0,0 +1,104 @@
+import logging
+import secrets
+import threading
+import time
+
+import config
+import metrics
+
+log = logging.getLogger(__name__)
+
+_redis = None
+_script = None
+
+KEY_PREFIX = "whitelist:ratelimit:"
+
+# Sliding-window log: one sorted set per (route, ip), scored by hit time in ms.
+# Trims, counts and records the hit in a single atomic round trip.
+# Returns {allowed, retry_after_ms}.
+_SLIDING_WINDOW = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+if redis.call('ZCARD', KEYS[1]) >= limit then
+    local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    return {0, tonumber(oldest[2]) + window - now}
+end
+redis.call('ZADD', KEYS[1], now, ARGV[4])
+redis.call('PEXPIRE', KEYS[1], window)
+return {1, 0}
+"""
+
+# In-process pre-filter, shared by all request threads.
+_lock = threading.Lock()
+_blocked: dict[tuple[str, str], float] = {}  # (route, ip) -> monotonic deadline
+_flood: dict[str, list] = {}  # ip -> [window_start, hits]
+_MAX_TRACKED = 100_000
+
+
+def init(redis_client):
+    global _redis, _script
+    _redis = redis_client
+    _script = redis_client.register_script(_SLIDING_WINDOW)
+
+
+def _prune(now: float) -> None:
+    """Drop stale pre-filter entries once the tables grow too large."""
+    if len(_blocked) > _MAX_TRACKED:
+        for k in [k for k, until in _blocked.items() if until <= now]:
+            del _blocked[k]
+        if len(_blocked) > _MAX_TRACKED:
+            _blocked.clear()
+    if len(_flood) > _MAX_TRACKED:
+        window = config.RATE_LIMIT_FLOOD_WINDOW
+        for k in [k for k, (start, _) in _flood.items() if now - start >= window]:
+            del _flood[k]
+        if len(_flood) > _MAX_TRACKED:
+            _flood.clear()
+
+
+def _prefilter(route: str, ip: str, now: float) -> bool:
+    """Return False if the request can be rejected without touching Redis."""
+    with _lock:
+        until = _blocked.get((route, ip))
+        if until is not None:
+            if until > now:
+                return False
+            del _blocked[(route, ip)]
+
+        entry = _flood.get(ip)
+        if entry is None or now - entry[0] >= config.RATE_LIMIT_FLOOD_WINDOW:
+            _prune(now)
+            _flood[ip] = [now, 1]
+            return True
+        entry[1] += 1
+        return entry[1] <= config.RATE_LIMIT_FLOOD_MAX
+
+
+def allow(route: str, ip: str) -> bool:
+    """Return True if the IP is within the rate limit policy for the route.
+
+    Obviously abusive IPs (over the flood threshold, or already rejected by
+    Redis for the rest of their window) are rejected in-process.
+    """
+    now = time.monotonic()
+    if not _prefilter(route, ip, now):
+        metrics.incr("ratelimit.local_rejects")
+        return False
+
+    limit, window = config.RATE_LIMITS[route]
+    now_ms = int(time.time() * 1000)
+    metrics.incr("ratelimit.redis_calls")
+    allowed, retry_after_ms = _script(
+        keys=[f"{KEY_PREFIX}{route}:{ip}"],
+        args=[now_ms, window * 1000, limit, f"{now_ms}-{secrets.token_hex(4)}"],
+    )
+    if allowed:
+        return True
+
+    metrics.incr("ratelimit.redis_rejects")
+    with _lock:
+        _blocked[(route, ip)] = now + max(retry_after_ms, 0) / 1000
+    log.info("Rate limit hit on %s for %s (retry in %.0fs)", route, ip, retry_after_ms / 1000)
+    return False
@@ -0,0 +1,88 @@
+"""
+Redis connections and key layout.
+
+REDIS_MODE selects how the portal reaches Redis:
+    single   - one node at REDIS_URL (default)
+    sentinel - the master named REDIS_SENTINEL_MASTER, found via REDIS_SENTINELS
+    cluster  - a Redis Cluster, seeded from REDIS_URL
+
+With REDIS_HASH_TAGS on (the default in cluster mode) per-IP and
+per-session keys wrap their identifier in a hash tag, e.g.
+"whitelist:active:{1.2.3.4}" and "whitelist:pending_session:{1.2.3.4}",
+so all keys of one IP or one session land in the same slot.
+"""
+
+import redis as redis_lib
+from redis.cluster import RedisCluster
+from redis.sentinel import Sentinel
+
+import config
+
+MODES = ("single", "sentinel", "cluster")
+
+_sentinel = None
+
+
+def _sentinels() -> list[tuple[str, int]]:
+    nodes = []
+    for entry in config.REDIS_SENTINELS:
+        host, _, port = entry.rpartition(":")
+        nodes.append((host, int(port)))
+    return nodes
+
+
+def _get_sentinel() -> Sentinel:
+    global _sentinel
+    if _sentinel is None:
+        _sentinel = Sentinel(
+            _sentinels(),
+            sentinel_kwargs={"password": config.REDIS_SENTINEL_PASSWORD or None},
+            password=config.REDIS_PASSWORD or None,
+            decode_responses=True,
+        )
+    return _sentinel
+
+
+def connect():
+    """Client for reads and writes against the primary."""
+    if config.REDIS_MODE == "sentinel":
+        return _get_sentinel().master_for(config.REDIS_SENTINEL_MASTER)
+    if config.REDIS_MODE == "cluster":
+        return RedisCluster.from_url(config.REDIS_URL, decode_responses=True)
+    if config.REDIS_MODE != "single":
+        raise ValueError(f"Unknown REDIS_MODE {config.REDIS_MODE!r}, expected one of {', '.join(MODES)}")
+    return redis_lib.Redis.from_url(config.REDIS_URL, decode_responses=True)
+
+
+def connect_replica(primary):
+    """Client for membership checks that tolerate replication lag.
+
+    Returns the primary client itself unless REDIS_READ_FROM_REPLICAS is
+    set and the mode has replicas to read from.
+    """
+    if not config.REDIS_READ_FROM_REPLICAS:
+        return primary
+    if config.REDIS_MODE == "sentinel":
+        return _get_sentinel().slave_for(config.REDIS_SENTINEL_MASTER)
+    if config.REDIS_MODE == "cluster":
+        return RedisCluster.from_url(config.REDIS_URL, decode_responses=True, read_from_replicas=True)
+    return primary
+
+
+def is_cluster(client) -> bool:
+    return isinstance(client, RedisCluster)
+
+
+def key(prefix: str, ident: str) -> str:
+    """Build a per-IP / per-session key, hash-tagged when enabled."""
+    if config.REDIS_HASH_TAGS:
+        return f"{prefix}{{{ident}}}"
+    return f"{prefix}{ident}"
+
+
+def ident(prefix: str, full_key: str) -> str:
+    """Inverse of key(): the identifier of a key found by SCAN."""
+    value = full_key.removeprefix(prefix)
+    if value.startswith("{") and value.endswith("}"):
+        value = value[1:-1]
+    return value
@@ -0,0 +1,106 @@
+"""
+Signed session tokens.
+
+A token is "<kid>.<expires>.<nonce>.<signature>": the signature is an
+HMAC of the rest under the key named kid, so forged, tampered and expired
+tokens are rejected in-process before any Redis lookup. The session
+itself still lives in Redis; a valid signature only means the token is
+worth looking up.
+
+Keys come from SESSION_TOKEN_KEYS ("kid:secret,..."): the first one signs
+new tokens and all of them are accepted, so a key is rotated by putting a
+new one first and dropping the old one once its tokens have expired (or
+at once, to invalidate them). Without SESSION_TOKEN_KEYS a key is
+generated and shared through Redis under kid "0".
+
+Tokens issued before signing existed (plain hex/alphanumeric) are still
+accepted while SESSION_TOKEN_LEGACY is on; disable it once old sessions
+have expired or been renewed through the Discord flow.
+"""
+
+import hashlib
+import hmac
+import logging
+import secrets
+import time
+
+import config
+import metrics
+
+log = logging.getLogger(__name__)
+
+_redis = None
+
+SECRET_KEY = "whitelist:session_token_secret"
+GENERATED_KID = "0"
+# Longest token either format can produce; anything longer is rejected unread
+MAX_LENGTH = 128
+LEGACY_MAX_LENGTH = 64
+
+_generated: dict[str, bytes] = {}
+
+
+def init(redis_client):
+    global _redis
+    _redis = redis_client
+    _keys()
+
+
+def _keys() -> dict[str, bytes]:
+    """Accepted keys by kid, the signing key first (re-read after config reloads)."""
+    if config.SESSION_TOKEN_KEYS:
+        return config.SESSION_TOKEN_KEYS
+    if not _generated:
+        # Shared by all processes so a token issued by the bot validates on any web worker
+        _redis.set(SECRET_KEY, secrets.token_hex(32), nx=True)
+        _generated[GENERATED_KID] = _redis.get(SECRET_KEY).encode()
+    return _generated
+
+
+def _sign(key: bytes, payload: str) -> str:
+    return hmac.new(key, payload.encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def issue() -> str:
+    """A new signed session token, valid for SESSION_TOKEN_TTL seconds."""
+    kid, key = next(iter(_keys().items()))
+    payload = f"{kid}.{int(time.time()) + config.SESSION_TOKEN_TTL}.{secrets.token_hex(16)}"
+    return f"{payload}.{_sign(key, payload)}"
+
+
+def is_legacy(token: str) -> bool:
+    return "." not in token
+
+
+def verify(token: str) -> bool:
+    """Check a client-supplied token without touching Redis."""
+    # Tokens come straight from JSON bodies and headers: anything but a short
+    # ASCII string is forged (and would break len()/compare_digest below)
+    if not isinstance(token, str) or not token or len(token) > MAX_LENGTH or not token.isascii():
+        ok = False
+    elif is_legacy(token):
+        ok = config.SESSION_TOKEN_LEGACY and len(token) <= LEGACY_MAX_LENGTH and token.isalnum()
+    else:
+        try:
+            kid, expires, nonce, signature = token.split(".")
+            key = _keys().get(kid)
+            ok = (
+                key is not None
+                and int(expires) > time.time()
+                and hmac.compare_digest(signature, _sign(key, f"{kid}.{expires}.{nonce}"))
+            )
+        except ValueError:
+            ok = False
+    if not ok:
+        metrics.incr("tokens.rejected")
+    return ok
+
+
+def lifetime(token: str) -> float:
+    """Seconds until a signed token expires (infinite for legacy tokens)."""
+    if is_legacy(token):
+        return float("inf")
+    try:
+        return max(int(token.split(".")[1]) - time.time(), 0)
+    except (IndexError, ValueError):
+        return 0
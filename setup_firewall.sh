@@ -4,6 +4,9 @@ set -e
 # --- CONFIGURAÇÕES DE PORTAS ---
 IPSET_NAME="${IPSET_NAME:-jogadores_permitidos}"
 GAME_PORT="${PROTECTED_PORTS:-30120}"
+# Um ipset por perfil de servidor: "set=portas;set2=portas" (passado pelo firewall_agent)
+FIREWALL_SETS="${FIREWALL_SETS:-$IPSET_NAME=$GAME_PORT}"
+IFS=';' read -ra SETS <<< "$FIREWALL_SETS"
 
 # Todas as suas portas de serviço (Web, API, Assets, Docker)
 WEB_SERVICES="80,443,3000,3001,9090,4445"
@@ -14,10 +17,12 @@ GLOBAL_CONN_LIMIT=50         # Máximo de conexões TCP simultâneas por IP
 WEB_PKT_LIMIT="2000/sec"     # Limite de pacotes para evitar flood nas APIs
 WEB_BURST="200"
 
-echo "[*] Iniciando blindagem das portas: $WEB_SERVICES e $GAME_PORT"
+echo "[*] Iniciando blindagem das portas: $WEB_SERVICES e $FIREWALL_SETS"
 
-# 1. Garantir IPSET
-ipset create "$IPSET_NAME" hash:ip -exist
+# 1. Garantir um IPSET por perfil
+for ENTRY in "${SETS[@]}"; do
+    ipset create "${ENTRY%%=*}" hash:ip -exist
+done
 
 # 2. Criar/Limpar nossa Chain customizada
 if iptables -N FILTRO_CIDADE 2>/dev/null; then
@@ -35,16 +40,19 @@ iptables -A FILTRO_CIDADE -m conntrack --ctstate RELATED,ESTABLISHED -j ACCEPT
 iptables -A FILTRO_CIDADE -i lo -j ACCEPT
 
 # B. PORTAS DO JOGO (Prioridade Total)
-# Se o IP está no IPSet, ACEITA e ignora os limites abaixo.
-IFS=',' read -ra GAME_PORTS <<< "$GAME_PORT"
-for PORT in "${GAME_PORTS[@]}"; do
-    PORT=$(echo "$PORT" | tr -d ' ')
-    echo "[*] Protegendo porta do jogo: $PORT"
-    iptables -A FILTRO_CIDADE -p tcp --dport "$PORT" -m set --match-set "$IPSET_NAME" src -j ACCEPT
-    iptables -A FILTRO_CIDADE -p udp --dport "$PORT" -m set --match-set "$IPSET_NAME" src -j ACCEPT
-    # Se NÃO está no IPSet e tentou a porta do jogo -> DROP
-    iptables -A FILTRO_CIDADE -p tcp --dport "$PORT" -j DROP
-    iptables -A FILTRO_CIDADE -p udp --dport "$PORT" -j DROP
+# Se o IP está no IPSet do perfil, ACEITA e ignora os limites abaixo.
+for ENTRY in "${SETS[@]}"; do
+    SET_NAME="${ENTRY%%=*}"
+    IFS=',' read -ra GAME_PORTS <<< "${ENTRY#*=}"
+    for PORT in "${GAME_PORTS[@]}"; do
+        PORT=$(echo "$PORT" | tr -d ' ')
+        echo "[*] Protegendo porta do jogo: $PORT ($SET_NAME)"
+        iptables -A FILTRO_CIDADE -p tcp --dport "$PORT" -m set --match-set "$SET_NAME" src -j ACCEPT
+        iptables -A FILTRO_CIDADE -p udp --dport "$PORT" -m set --match-set "$SET_NAME" src -j ACCEPT
+        # Se NÃO está no IPSet e tentou a porta do jogo -> DROP
+        iptables -A FILTRO_CIDADE -p tcp --dport "$PORT" -j DROP
+        iptables -A FILTRO_CIDADE -p udp --dport "$PORT" -j DROP
+    done
 done
 
 # C. LIMITE GLOBAL DE 50 CONEXÕES (Para todo o resto)
@@ -0,0 +1,914 @@
+import json
+import logging
+import time
+
+import config
+import firewall
+import profiles
+import redis_conn
+import session_tokens
+
+log = logging.getLogger(__name__)
+
+_redis = None
+# Client for membership reads; a replica when REDIS_READ_FROM_REPLICAS is on
+_replica = None
+# Redis Cluster: no MULTI, no scripts in pipelines, and scripts may only
+# touch keys in one slot, so multi-key scripts are replaced by pipelines
+_clustered = False
+
+# Keys marked "per profile" exist once per server profile, namespaced with
+# profiles.scoped(); the rest are shared and their records carry the profile.
+CODE_PREFIX = "whitelist:code:"
+SESSION_PREFIX = "whitelist:session:"
+ACTIVE_PREFIX = "whitelist:active:"  # per profile
+PENDING_PREFIX = "whitelist:pending_session:"  # per profile
+# Per-Discord-user index: tokens and IPs (per profile) owned by a discord_id
+USER_SESSIONS_PREFIX = "whitelist:user_sessions:"
+USER_IPS_PREFIX = "whitelist:user_ips:"
+# Expiry index: sorted set of session tokens scored by expiry (unix time)
+EXPIRY_KEY = "whitelist:session_expiry"
+WARNED_PREFIX = "whitelist:warned:"
+LEGACY_WARNED_KEY = "whitelist:warned_sessions"
+_BACKFILL_MARKER = "whitelist:session_expiry:backfilled"
+# Lexicographically ordered set of active IPs (all scores 0), for paging
+# and IP prefix queries without SCAN (per profile)
+ACTIVE_INDEX_KEY = "whitelist:active_ips"
+_ACTIVE_BACKFILL_MARKER = "whitelist:active_ips:backfilled"
+# Active IPs scored by the latest expiry of a session pointing at them;
+# the garbage collector removes IPs whose sessions are all gone (per profile)
+ACTIVE_EXPIRY_KEY = "whitelist:active_expiry"
+_ACTIVE_EXPIRY_BACKFILL_MARKER = "whitelist:active_expiry:backfilled"
+
+# Session and active records are Redis hashes with short field names.
+# "v" carries the format version; records written before versioning are
+# JSON strings and get converted to hashes the first time they are read.
+FORMAT_VERSION = "1"
+SESSION_FIELDS = {"discord_id": "d", "discord_name": "n", "ip": "i", "created_at": "c", "profile": "p"}
+ACTIVE_FIELDS = {"discord_id": "d", "discord_name": "n", "timestamp": "t"}
+_FLOAT_FIELDS = {"created_at", "timestamp"}
+
+# Converts a legacy JSON string to a hash in place, keeping its TTL
+_MIGRATE = """
+if redis.call('TYPE', KEYS[1]).ok ~= 'string' then
+    return 0
+end
+local ttl = redis.call('PTTL', KEYS[1])
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], unpack(ARGV))
+if ttl > 0 then
+    redis.call('PEXPIRE', KEYS[1], ttl)
+end
+return 1
+"""
+
+# Claims a code and records its validation atomically: active record,
+# session, expiry index, pending cookie, per-user index and the firewall
+# add command. Field names mirror SESSION_FIELDS / ACTIVE_FIELDS and key()
+# mirrors redis_conn.key(); per-profile keys and prefixes are passed in
+# already scoped. Returns the IP, or false if the code is
+# unknown/expired/already used.
+# The per-IP/per-session/per-user keys are built from ARGV and not declared
+# in KEYS, which Redis only tolerates on a single node: cluster deployments
+# never run this script and go through _redeem_clustered instead.
+_REDEEM = """
+local function key(prefix, id)
+    if ARGV[12] == '1' then
+        return prefix .. '{' .. id .. '}'
+    end
+    return prefix .. id
+end
+
+local raw = redis.call('GET', KEYS[1])
+if not raw then
+    return false
+end
+redis.call('DEL', KEYS[1])
+
+local ip = cjson.decode(raw).ip
+local token, discord_id, discord_name = ARGV[1], ARGV[2], ARGV[3]
+local now, ttl, version = tonumber(ARGV[4]), tonumber(ARGV[5]), ARGV[6]
+local profile, index_ttl = ARGV[13], tonumber(ARGV[14])
+
+local active = key(ARGV[8], ip)
+redis.call('DEL', active)
+redis.call('HSET', active, 'v', version, 'd', discord_id, 'n', discord_name, 't', now)
+redis.call('ZADD', KEYS[4], 0, ip)
+
+local session = key(ARGV[7], token)
+redis.call('HSET', session, 'v', version, 'd', discord_id, 'n', discord_name, 'i', ip, 'c', now, 'p', profile)
+redis.call('EXPIRE', session, ttl)
+redis.call('ZADD', KEYS[2], now + ttl, token)
+redis.call('ZADD', KEYS[5], 'GT', now + ttl, ip)
+redis.call('SET', key(ARGV[9], ip), token, 'EX', ttl)
+
+local user_sessions = key(ARGV[10], discord_id)
+redis.call('SADD', user_sessions, token)
+redis.call('EXPIRE', user_sessions, index_ttl)
+local user_ips = key(ARGV[11], discord_id)
+redis.call('SADD', user_ips, ip)
+redis.call('EXPIRE', user_ips, index_ttl)
+
+redis.call('RPUSH', KEYS[3], cjson.encode({action = 'add', ip = ip, profile = profile}))
+return ip
+"""
+
+# Removes up to ARGV[2] active IPs (and their pending session cookie)
+# whose session expiry is <= ARGV[1] and enqueues their firewall removal. Checking the score inside the script
+# means an IP renewed meanwhile is never collected. Like _REDEEM it builds
+# undeclared keys from ARGV, so cluster mode uses _sweep_clustered.
+_SWEEP = """
+local function key(prefix, id)
+    if ARGV[5] == '1' then
+        return prefix .. '{' .. id .. '}'
+    end
+    return prefix .. id
+end
+
+local ips = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, ip in ipairs(ips) do
+    local active = key(ARGV[3], ip)
+    if redis.call('TYPE', active).ok == 'hash' then
+        local discord_id = redis.call('HGET', active, 'd')
+        if discord_id then
+            redis.call('SREM', key(ARGV[4], discord_id), ip)
+        end
+    end
+    redis.call('DEL', active, key(ARGV[7], ip))
+    redis.call('ZREM', KEYS[1], ip)
+    redis.call('ZREM', KEYS[2], ip)
+    redis.call('RPUSH', KEYS[3], cjson.encode({action = 'remove', ip = ip, profile = ARGV[6]}))
+end
+return ips
+"""
+
+_migrate_script = None
+_redeem_script = None
+_sweep_script = None
+
+
+def init(redis_client, replica=None):
+    global _redis, _replica, _clustered, _migrate_script, _redeem_script, _sweep_script
+    _redis = redis_client
+    _replica = replica or redis_client
+    _clustered = redis_conn.is_cluster(redis_client)
+    _migrate_script = redis_client.register_script(_MIGRATE)
+    _redeem_script = redis_client.register_script(_REDEEM)
+    _sweep_script = redis_client.register_script(_SWEEP)
+
+
+_key = redis_conn.key
+
+
+def _pipeline():
+    """Transactional pipeline, or a plain one in cluster mode (no MULTI)."""
+    return _redis.pipeline(transaction=not _clustered)
+
+
+def _pack(data: dict, fields: dict) -> dict:
+    packed = {"v": FORMAT_VERSION}
+    for name, short in fields.items():
+        value = data.get(name)
+        if value is not None:
+            # Whole seconds are enough for timestamps and keep the hash small
+            packed[short] = int(value) if name in _FLOAT_FIELDS else value
+    return packed
+
+
+def _unpack(packed: dict, fields: dict) -> dict:
+    data = {}
+    for name, short in fields.items():
+        if short in packed:
+            value = packed[short]
+            data[name] = float(value) if name in _FLOAT_FIELDS else value
+    return data
+
+
+def _read_many(prefix: str, ids: list[str], fields: dict, client=None) -> list[dict | None]:
+    """Fetch records in one pipeline, migrating legacy JSON values found.
+
+    Legacy values make HGETALL fail with WRONGTYPE; those are fetched with
+    GET in a second round trip. Reads from a replica skip the migration.
+    """
+    if not ids:
+        return []
+    client = client or _redis
+    pipe = client.pipeline(transaction=False)
+    for record_id in ids:
+        pipe.hgetall(_key(prefix, record_id))
+    replies = pipe.execute(raise_on_error=False)
+
+    results = [_unpack(reply, fields) if isinstance(reply, dict) and reply else None for reply in replies]
+    legacy = [i for i, reply in enumerate(replies) if isinstance(reply, Exception)]
+    if not legacy:
+        return results
+
+    pipe = client.pipeline(transaction=False)
+    for i in legacy:
+        pipe.get(_key(prefix, ids[i]))
+    migrated = []
+    for i, raw in zip(legacy, pipe.execute()):
+        if raw:
+            results[i] = json.loads(raw)
+            migrated.append(i)
+
+    if migrated and client is _redis:
+        pipe = None if _clustered else _redis.pipeline(transaction=False)
+        for i in migrated:
+            args = [item for pair in _pack(results[i], fields).items() for item in pair]
+            _migrate_script(keys=[_key(prefix, ids[i])], args=args, client=pipe)
+        if pipe is not None:
+            pipe.execute()
+        log.info("Migrated %d legacy %s* records to hashes", len(migrated), prefix)
+
+    return results
+
+
+_scoped = profiles.scoped
+
+
+def _index_user(pipe, discord_id: str, token: str | None = None, ip: str | None = None,
+                profile: str | None = None) -> None:
+    """Queue index updates for a user; index keys live as long as the longest session."""
+    if not discord_id:
+        return
+    ttl = profiles.max_session_ttl()
+    if token:
+        pipe.sadd(_key(USER_SESSIONS_PREFIX, discord_id), token)
+        pipe.expire(_key(USER_SESSIONS_PREFIX, discord_id), ttl)
+    if ip:
+        user_ips = _key(_scoped(USER_IPS_PREFIX, profile), discord_id)
+        pipe.sadd(user_ips, ip)
+        pipe.expire(user_ips, ttl)
+
+
+def renewal_ttl(token: str, profile: str | None) -> int:
+    """Session TTL of the profile, capped so the session ends with its token."""
+    return int(min(profiles.session_ttl(profile), session_tokens.lifetime(token)))
+
+
+def _schedule(pipe, token: str, ip: str | None, profile: str | None) -> None:
+    """Queue a session TTL reset together with its expiry index entries."""
+    ttl = renewal_ttl(token, profile)
+    expires_at = int(time.time()) + ttl
+    pipe.expire(_key(SESSION_PREFIX, token), ttl)
+    pipe.zadd(EXPIRY_KEY, {token: expires_at})
+    if ip:
+        pipe.zadd(_scoped(ACTIVE_EXPIRY_KEY, profile), {ip: expires_at}, gt=True)
+
+
+def _set_active(pipe, ip: str, discord_id: str, discord_name: str, profile: str | None) -> None:
+    """Queue a full overwrite of an active record."""
+    key = _key(_scoped(ACTIVE_PREFIX, profile), ip)
+    record = {"discord_id": discord_id, "discord_name": discord_name, "timestamp": time.time()}
+    pipe.delete(key)
+    pipe.hset(key, mapping=_pack(record, ACTIVE_FIELDS))
+    pipe.zadd(_scoped(ACTIVE_INDEX_KEY, profile), {ip: 0})
+
+
+def get_session(token: str) -> dict | None:
+    return _read_many(SESSION_PREFIX, [token], SESSION_FIELDS)[0]
+
+
+def get_sessions(tokens: list[str]) -> list[dict | None]:
+    return _read_many(SESSION_PREFIX, tokens, SESSION_FIELDS)
+
+
+def session_ttl(token: str) -> int:
+    return _redis.ttl(_key(SESSION_PREFIX, token))
+
+
+def get_session_with_ttl(token: str) -> tuple[dict | None, int]:
+    """A session and its remaining TTL in one pipelined round trip."""
+    key = _key(SESSION_PREFIX, token)
+    pipe = _redis.pipeline(transaction=False)
+    pipe.hgetall(key)
+    pipe.ttl(key)
+    packed, ttl = pipe.execute(raise_on_error=False)
+    if isinstance(packed, Exception):
+        # Legacy JSON record: the regular read path migrates it
+        return get_session(token), ttl
+    return (_unpack(packed, SESSION_FIELDS) if packed else None), ttl
+
+
+def get_active(ip: str, profile: str | None = None) -> dict | None:
+    return _read_many(_scoped(ACTIVE_PREFIX, profile), [ip], ACTIVE_FIELDS)[0]
+
+
+def get_active_many(ips: list[str], from_replica: bool = False, profile: str | None = None) -> list[dict | None]:
+    """Active records for many IPs in a single pipelined round trip."""
+    return _read_many(_scoped(ACTIVE_PREFIX, profile), ips, ACTIVE_FIELDS,
+                      client=_replica if from_replica else None)
+
+
+def get_pending(ip: str, profile: str | None = None) -> str | None:
+    """Session token waiting to be handed to the browser/client at this IP."""
+    return _redis.get(_key(_scoped(PENDING_PREFIX, profile), ip))
+
+
+def pop_pending(ip: str, profile: str | None = None) -> str | None:
+    """Claim the pending session token of an IP; only one caller gets it."""
+    return _redis.getdel(_key(_scoped(PENDING_PREFIX, profile), ip))
+
+
+def create_session(token: str, discord_id: str, discord_name: str, ip: str, profile: str | None = None) -> dict:
+    """Create a session for an already whitelisted IP."""
+    session_data = {
+        "discord_id": discord_id,
+        "discord_name": discord_name,
+        "ip": ip,
+        "created_at": time.time(),
+        "profile": profile or profiles.DEFAULT,
+    }
+    pipe = _pipeline()
+    pipe.hset(_key(SESSION_PREFIX, token), mapping=_pack(session_data, SESSION_FIELDS))
+    _schedule(pipe, token, ip, profile)
+    _index_user(pipe, discord_id, token=token, ip=ip, profile=profile)
+    pipe.execute()
+    return session_data
+
+
+def create_code(code: str, ip: str, profile: str | None = None) -> None:
+    data = json.dumps({"ip": ip, "created_at": time.time(), "profile": profile or profiles.DEFAULT})
+    _redis.setex(f"{CODE_PREFIX}{code}", config.CODE_TTL, data)
+
+
+def get_code(code: str) -> dict | None:
+    """A pending code's record (ip, profile, created_at), or None if it does not exist."""
+    raw = _redis.get(f"{CODE_PREFIX}{code}")
+    if not raw:
+        return None
+    record = json.loads(raw)
+    record["profile"] = record.get("profile") or profiles.DEFAULT
+    return record
+
+
+def redeem_code(code: str, discord_id: str, discord_name: str, token: str,
+                profile: str | None = None) -> tuple[str, str] | None:
+    """Atomically claim a code and whitelist its IP under a new session.
+
+    Exactly one caller can redeem a given code. Returns (IP, profile), or
+    None if the code is invalid, expired or already redeemed. Callers that
+    already read the code (get_code) pass its profile to save a round trip.
+    """
+    # Codes never change once written, so the profile (which decides the
+    # keys the script touches) can be read ahead of the atomic claim
+    if profile is None:
+        record = get_code(code)
+        if record is None:
+            return None
+        profile = record["profile"]
+    if profile not in config.SERVER_PROFILES:
+        log.warning("Code %s belongs to unknown profile %s", code, profile)
+        return None
+
+    if _clustered:
+        ip = _redeem_clustered(code, discord_id, discord_name, token, profile)
+    else:
+        ip = _redeem_script(
+            keys=[f"{CODE_PREFIX}{code}", EXPIRY_KEY, firewall.QUEUE_KEY,
+                  _scoped(ACTIVE_INDEX_KEY, profile), _scoped(ACTIVE_EXPIRY_KEY, profile)],
+            args=[
+                token, discord_id, discord_name, int(time.time()), renewal_ttl(token, profile), FORMAT_VERSION,
+                SESSION_PREFIX, _scoped(ACTIVE_PREFIX, profile), _scoped(PENDING_PREFIX, profile),
+                USER_SESSIONS_PREFIX, _scoped(USER_IPS_PREFIX, profile),
+                "1" if config.REDIS_HASH_TAGS else "0", profile, profiles.max_session_ttl(),
+            ],
+        )
+    return (ip, profile) if ip else None
+
+
+def _redeem_clustered(code: str, discord_id: str, discord_name: str, token: str, profile: str) -> str | None:
+    """Cluster variant of the redeem script.
+
+    GETDEL still lets exactly one caller claim the code; the writes that
+    follow span slots and are pipelined without MULTI.
+    """
+    raw = _redis.getdel(f"{CODE_PREFIX}{code}")
+    if not raw:
+        return None
+    ip = json.loads(raw)["ip"]
+    session_data = {"discord_id": discord_id, "discord_name": discord_name, "ip": ip,
+                    "created_at": time.time(), "profile": profile}
+
+    pipe = _pipeline()
+    _set_active(pipe, ip, discord_id, discord_name, profile)
+    pipe.hset(_key(SESSION_PREFIX, token), mapping=_pack(session_data, SESSION_FIELDS))
+    _schedule(pipe, token, ip, profile)
+    pipe.set(_key(_scoped(PENDING_PREFIX, profile), ip), token, ex=renewal_ttl(token, profile))
+    _index_user(pipe, discord_id, token=token, ip=ip, profile=profile)
+    pipe.rpush(firewall.QUEUE_KEY, json.dumps({"action": "add", "ip": ip, "profile": profile}))
+    pipe.execute()
+    return ip
+
+
+def move_session(token: str, session_data: dict, new_ip: str) -> None:
+    """Point a session (and its active record) at a new IP.
+
+    Only the session's IP field is rewritten.
+    """
+    discord_id = session_data["discord_id"]
+    old_ip = session_data.get("ip")
+    profile = session_data.get("profile")
+
+    pipe = _pipeline()
+    if old_ip and old_ip != new_ip:
+        pipe.delete(_key(_scoped(ACTIVE_PREFIX, profile), old_ip))
+        pipe.zrem(_scoped(ACTIVE_INDEX_KEY, profile), old_ip)
+        pipe.zrem(_scoped(ACTIVE_EXPIRY_KEY, profile), old_ip)
+        if discord_id:
+            pipe.srem(_key(_scoped(USER_IPS_PREFIX, profile), discord_id), old_ip)
+    _set_active(pipe, new_ip, discord_id, session_data["discord_name"], profile)
+    pipe.hset(_key(SESSION_PREFIX, token), SESSION_FIELDS["ip"], new_ip)
+    _schedule(pipe, token, new_ip, profile)
+    _index_user(pipe, discord_id, token=token, ip=new_ip, profile=profile)
+    pipe.execute()
+
+
+def touch_session(token: str, ip: str | None, profile: str | None = None) -> None:
+    """Reset a session's TTL and the expiry index entries of it and its IP."""
+    pipe = _pipeline()
+    _schedule(pipe, token, ip, profile)
+    pipe.execute()
+
+
+def remove_active(ip: str, profile: str | None = None) -> None:
+    """Delete an active record and drop the IP from its owner's index."""
+    record = get_active(ip, profile)
+    pipe = _pipeline()
+    pipe.delete(_key(_scoped(ACTIVE_PREFIX, profile), ip))
+    pipe.zrem(_scoped(ACTIVE_INDEX_KEY, profile), ip)
+    pipe.zrem(_scoped(ACTIVE_EXPIRY_KEY, profile), ip)
+    if record:
+        discord_id = record.get("discord_id")
+        if discord_id:
+            pipe.srem(_key(_scoped(USER_IPS_PREFIX, profile), discord_id), ip)
+    pipe.execute()
+
+
+def list_user(discord_id: str) -> tuple[dict[str, dict], list[tuple[str, str]]]:
+    """Return ({token: session}, [(profile, active IP)]) for a Discord user.
+
+    Cost is proportional to the user's own sessions; index entries whose
+    session expired or whose IP now belongs to someone else are pruned.
+    """
+    sessions_key = _key(USER_SESSIONS_PREFIX, discord_id)
+    names = profiles.names()
+
+    pipe = _redis.pipeline(transaction=False)
+    pipe.smembers(sessions_key)
+    for profile in names:
+        pipe.smembers(_key(_scoped(USER_IPS_PREFIX, profile), discord_id))
+    tokens, *ips_by_profile = (sorted(m) for m in pipe.execute())
+
+    sessions = {}
+    stale_tokens = []
+    for token, data in zip(tokens, get_sessions(tokens)):
+        if data:
+            sessions[token] = data
+        else:
+            stale_tokens.append(token)
+
+    active_ips = []
+    stale_ips = {}
+    for profile, ips in zip(names, ips_by_profile):
+        for ip, record in zip(ips, get_active_many(ips, profile=profile)):
+            if record and record.get("discord_id") == discord_id:
+                active_ips.append((profile, ip))
+            else:
+                stale_ips.setdefault(profile, []).append(ip)
+
+    if stale_tokens or stale_ips:
+        pipe = _redis.pipeline(transaction=False)
+        if stale_tokens:
+            pipe.srem(sessions_key, *stale_tokens)
+        for profile, ips in stale_ips.items():
+            pipe.srem(_key(_scoped(USER_IPS_PREFIX, profile), discord_id), *ips)
+        pipe.execute()
+
+    return sessions, active_ips
+
+
+def revoke_user(discord_id: str) -> tuple[int, list[tuple[str, str]]]:
+    """Delete every session and active record of a Discord user.
+
+    Returns (sessions revoked, (profile, IP) pairs to remove from the firewall).
+    """
+    sessions, ips = list_user(discord_id)
+    # One key per DEL: cluster pipelines reject multi-key deletes
+    keys = [_key(USER_SESSIONS_PREFIX, discord_id)]
+    keys += [_key(_scoped(USER_IPS_PREFIX, profile), discord_id) for profile in profiles.names()]
+    pipe = _pipeline()
+    for token, data in sessions.items():
+        keys += [_key(SESSION_PREFIX, token), _key(WARNED_PREFIX, token)]
+        pipe.zrem(EXPIRY_KEY, token)
+        if data.get("ip"):
+            keys.append(_key(_scoped(PENDING_PREFIX, data.get("profile")), data["ip"]))
+    for profile, ip in ips:
+        keys += [_key(_scoped(ACTIVE_PREFIX, profile), ip), _key(_scoped(PENDING_PREFIX, profile), ip)]
+        pipe.zrem(_scoped(ACTIVE_INDEX_KEY, profile), ip)
+        pipe.zrem(_scoped(ACTIVE_EXPIRY_KEY, profile), ip)
+    for key in keys:
+        pipe.delete(key)
+    pipe.execute()
+    return len(sessions), ips
+
+
+def count_active(ip_prefix: str = "", profile: str | None = None) -> int:
+    index = _scoped(ACTIVE_INDEX_KEY, profile)
+    if ip_prefix:
+        return _redis.zlexcount(index, f"[{ip_prefix}", f"[{ip_prefix}\xff")
+    return _redis.zcard(index)
+
+
+def page_active(after: str | None, limit: int, ip_prefix: str = "", name: str = "",
+                max_scan: int = 5000, profile: str | None = None) -> tuple[list[tuple[str, dict]], str | None]:
+    """Return one page of (ip, active record) in IP order, plus the next cursor.
+
+    Pages are read from the active index with ZRANGEBYLEX starting after the
+    cursor, and their records fetched in one pipeline, so cost per page does
+    not depend on the whitelist size. A name filter (case-insensitive
+    substring) reads at most max_scan index entries per page.
+    """
+    low = f"({after}" if after else (f"[{ip_prefix}" if ip_prefix else "-")
+    high = f"[{ip_prefix}\xff" if ip_prefix else "+"
+    batch_size = 500 if name else limit
+    name = name.lower()
+    index = _scoped(ACTIVE_INDEX_KEY, profile)
+
+    entries = []
+    scanned = 0
+    while True:
+        batch = _redis.zrangebylex(index, low, high, start=0, num=batch_size)
+        if not batch:
+            return entries, None
+
+        stale = []
+        for ip, record in zip(batch, get_active_many(batch, profile=profile)):
+            if record is None:
+                stale.append(ip)
+                continue
+            if name and name not in record.get("discord_name", "").lower():
+                continue
+            entries.append((ip, record))
+            if len(entries) == limit:
+                if stale:
+                    _redis.zrem(index, *stale)
+                return entries, ip
+        if stale:
+            _redis.zrem(index, *stale)
+
+        if len(batch) < batch_size:
+            return entries, None
+        scanned += len(batch)
+        low = f"({batch[-1]}"
+        if scanned >= max_scan:
+            return entries, batch[-1]
+
+
+def backfill_active_index() -> int:
+    """Index active records created before the active index existed (runs once)."""
+    if not _redis.set(_ACTIVE_BACKFILL_MARKER, "1", nx=True):
+        return 0
+
+    count = 0
+    batch = []
+    for key in _redis.scan_iter(f"{ACTIVE_PREFIX}*", count=1000):
+        batch.append(redis_conn.ident(ACTIVE_PREFIX, key))
+        if len(batch) >= 1000:
+            _redis.zadd(ACTIVE_INDEX_KEY, dict.fromkeys(batch, 0))
+            count += len(batch)
+            batch.clear()
+    if batch:
+        _redis.zadd(ACTIVE_INDEX_KEY, dict.fromkeys(batch, 0))
+        count += len(batch)
+
+    log.info("Active index backfilled with %d IPs", count)
+    return count
+
+
+# Key families deleted by purge_all(); the per-profile ones once per profile
+PURGE_PREFIXES = (SESSION_PREFIX, USER_SESSIONS_PREFIX, WARNED_PREFIX)
+PURGE_PROFILE_PREFIXES = (ACTIVE_PREFIX, PENDING_PREFIX, USER_IPS_PREFIX)
+
+
+def purge_all(batch_size: int = 1000):
+    """Delete all whitelist state, yielding the running count of deleted keys.
+
+    Index keys go first; then each key family is walked with SCAN and
+    removed with one variadic UNLINK per batch, i.e. about two round trips
+    per batch_size keys. In cluster mode SCAN walks every primary and
+    UNLINK is split per slot by the client.
+    """
+    deleted = _redis.unlink(EXPIRY_KEY)
+    prefixes = list(PURGE_PREFIXES)
+    for profile in profiles.names():
+        deleted += _redis.unlink(_scoped(ACTIVE_INDEX_KEY, profile), _scoped(ACTIVE_EXPIRY_KEY, profile))
+        prefixes += [_scoped(prefix, profile) for prefix in PURGE_PROFILE_PREFIXES]
+    yield deleted
+    for prefix in prefixes:
+        batch = []
+        for key in _redis.scan_iter(match=f"{prefix}*", count=batch_size):
+            batch.append(key)
+            if len(batch) >= batch_size:
+                deleted += _redis.unlink(*batch)
+                batch.clear()
+                yield deleted
+        if batch:
+            deleted += _redis.unlink(*batch)
+            yield deleted
+
+
+def export_records(batch_size: int = 1000):
+    """Yield every active record and session as a plain dict, batch by batch.
+
+    Active records are read in IP order from each profile's active index,
+    sessions in expiry order from the session expiry index; each batch
+    costs two pipelined round trips and memory stays bounded by the batch
+    size. Sessions carry their absolute expiry ("expires_at"), so the
+    remaining TTL survives the transfer.
+
+    The export is not atomic: each batch is read consistently, but
+    records changed while the export runs may or may not appear.
+    """
+    for profile in profiles.names():
+        after = "-"
+        while True:
+            ips = _redis.zrangebylex(_scoped(ACTIVE_INDEX_KEY, profile), after, "+", start=0, num=batch_size)
+            if not ips:
+                break
+            for ip, record in zip(ips, get_active_many(ips, profile=profile)):
+                if record:
+                    yield {"type": "active", "profile": profile, "ip": ip, **record}
+            after = f"({ips[-1]}"
+
+    # Cursor: the last expiry read and how many tokens with it were read
+    # (expiries are whole seconds, so many sessions share one). Already
+    # expired entries are skipped.
+    score, skip = int(time.time()), 0
+    while True:
+        page = _redis.zrangebyscore(EXPIRY_KEY, score, "+inf", start=skip, num=batch_size, withscores=True)
+        if not page:
+            break
+        yield from _export_sessions([token for token, _ in page])
+        last = page[-1][1]
+        ties = sum(1 for _, entry_score in page if entry_score == last)
+        score, skip = last, skip + ties if last == score else ties
+        if len(page) < batch_size:
+            break
+
+
+def _export_sessions(tokens: list[str]):
+    sessions = get_sessions(tokens)
+    pipe = _redis.pipeline(transaction=False)
+    for token in tokens:
+        pipe.pttl(_key(SESSION_PREFIX, token))
+    now = time.time()
+    for token, data, pttl in zip(tokens, sessions, pipe.execute()):
+        if data is None or pttl == -2:
+            continue  # expired since it was indexed
+        expires_at = int(now + pttl / 1000) if pttl > 0 else None
+        yield {"type": "session", "token": token, "profile": profiles.DEFAULT, **data, "expires_at": expires_at}
+
+
+def import_records(records, batch_size: int = 1000) -> tuple[dict[str, int], dict[str, list[str]]]:
+    """Write exported records back, batch_size records per pipeline.
+
+    Existing records with the same IP/token are overwritten. Sessions keep
+    their exported expiry (already expired ones are skipped, ones without
+    an expiry get their profile's session TTL); the expiry, active and
+    per-user indexes are rebuilt along the way. Records of profiles not
+    configured here count as invalid. Returns (counts, {profile: imported
+    active IPs}); the firewall is left to the caller, so it can be updated
+    in one batch.
+    """
+    counts = {"active": 0, "session": 0, "expired": 0, "invalid": 0}
+    ips = {}
+    now = int(time.time())
+    pipe = _redis.pipeline(transaction=False)
+    queued = 0
+    for record in records:
+        kind = record.get("type")
+        try:
+            profile = profiles.resolve(record.get("profile"))
+        except ValueError:
+            kind = None
+        if kind == "active" and record.get("ip"):
+            ip = record["ip"]
+            key = _key(_scoped(ACTIVE_PREFIX, profile), ip)
+            pipe.delete(key)
+            pipe.hset(key, mapping=_pack(record, ACTIVE_FIELDS))
+            pipe.zadd(_scoped(ACTIVE_INDEX_KEY, profile), {ip: 0})
+            _index_user(pipe, record.get("discord_id"), ip=ip, profile=profile)
+            ips.setdefault(profile, []).append(ip)
+        elif kind == "session" and record.get("token"):
+            expires_at = record.get("expires_at") or now + profiles.session_ttl(profile)
+            ttl = int(expires_at) - now
+            if ttl <= 0:
+                counts["expired"] += 1
+                continue
+            token = record["token"]
+            key = _key(SESSION_PREFIX, token)
+            pipe.delete(key)
+            pipe.hset(key, mapping=_pack({**record, "profile": profile}, SESSION_FIELDS))
+            pipe.expire(key, ttl)
+            pipe.zadd(EXPIRY_KEY, {token: now + ttl})
+            if record.get("ip"):
+                pipe.zadd(_scoped(ACTIVE_EXPIRY_KEY, profile), {record["ip"]: now + ttl}, gt=True)
+            _index_user(pipe, record.get("discord_id"), token=token)
+        else:
+            counts["invalid"] += 1
+            continue
+        counts[kind] += 1
+        queued += 1
+        if queued >= batch_size:
+            pipe.execute()
+            pipe = _redis.pipeline(transaction=False)
+            queued = 0
+    if queued:
+        pipe.execute()
+
+    # Active IPs without an imported session get one full session TTL,
+    # as in backfill_active_expiry()
+    for profile, profile_ips in ips.items():
+        default = now + profiles.session_ttl(profile)
+        for start in range(0, len(profile_ips), batch_size):
+            _redis.zadd(_scoped(ACTIVE_EXPIRY_KEY, profile),
+                        dict.fromkeys(profile_ips[start:start + batch_size], default), nx=True)
+    return counts, ips
+
+
+def sweep_expired_actives(grace: int, batch_size: int = 500) -> list[tuple[str, str]]:
+    """Remove active records (and enqueue firewall removals) for IPs whose
+    sessions all expired more than grace seconds ago, in every profile.
+    Returns the removed (profile, IP) pairs."""
+    cutoff = int(time.time()) - grace
+    removed = []
+    for profile in profiles.names():
+        while True:
+            if _clustered:
+                ips = _sweep_clustered(cutoff, batch_size, profile)
+            else:
+                ips = _sweep_script(
+                    keys=[_scoped(ACTIVE_EXPIRY_KEY, profile), _scoped(ACTIVE_INDEX_KEY, profile),
+                          firewall.QUEUE_KEY],
+                    args=[cutoff, batch_size, _scoped(ACTIVE_PREFIX, profile), _scoped(USER_IPS_PREFIX, profile),
+                          "1" if config.REDIS_HASH_TAGS else "0", profile, _scoped(PENDING_PREFIX, profile)],
+                )
+            removed.extend((profile, ip) for ip in ips)
+            if len(ips) < batch_size:
+                break
+    return removed
+
+
+def _sweep_clustered(cutoff: int, batch_size: int, profile: str) -> list[str]:
+    """Cluster variant of the sweep script.
+
+    An IP renewed between the range read and the removal pipeline can
+    still be collected; the next visit to the portal re-adds it.
+    """
+    expiry_key = _scoped(ACTIVE_EXPIRY_KEY, profile)
+    ips = _redis.zrangebyscore(expiry_key, "-inf", cutoff, start=0, num=batch_size)
+    if not ips:
+        return []
+    records = get_active_many(ips, profile=profile)
+    pipe = _pipeline()
+    for ip, record in zip(ips, records):
+        if record and record.get("discord_id"):
+            pipe.srem(_key(_scoped(USER_IPS_PREFIX, profile), record["discord_id"]), ip)
+        pipe.delete(_key(_scoped(ACTIVE_PREFIX, profile), ip), _key(_scoped(PENDING_PREFIX, profile), ip))
+        pipe.rpush(firewall.QUEUE_KEY, json.dumps({"action": "remove", "ip": ip, "profile": profile}))
+    pipe.zrem(expiry_key, *ips)
+    pipe.zrem(_scoped(ACTIVE_INDEX_KEY, profile), *ips)
+    pipe.execute()
+    return ips
+
+
+def backfill_active_expiry() -> int:
+    """Score active IPs indexed before the active expiry index existed (runs once).
+
+    IPs get the latest expiry among their sessions; IPs without any known
+    session get one full SESSION_TTL from now.
+    """
+    if not _redis.set(_ACTIVE_EXPIRY_BACKFILL_MARKER, "1", nx=True):
+        return 0
+
+    start = 0
+    while True:
+        chunk = _redis.zrange(EXPIRY_KEY, start, start + 999, withscores=True)
+        if not chunk:
+            break
+        sessions = get_sessions([token for token, _ in chunk])
+        scores = {}
+        for (_, expires_at), data in zip(chunk, sessions):
+            ip = data.get("ip") if data else None
+            if ip:
+                scores[ip] = max(scores.get(ip, 0), expires_at)
+        if scores:
+            _redis.zadd(ACTIVE_EXPIRY_KEY, scores, gt=True)
+        start += len(chunk)
+
+    default = int(time.time()) + config.SESSION_TTL
+    count = 0
+    after = "-"
+    while True:
+        ips = _redis.zrangebylex(ACTIVE_INDEX_KEY, after, "+", start=0, num=1000)
+        if not ips:
+            break
+        count += _redis.zadd(ACTIVE_EXPIRY_KEY, dict.fromkeys(ips, default), nx=True)
+        after = f"({ips[-1]}"
+
+    log.info("Active expiry index backfilled (%d IPs without a session)", count)
+    return count
+
+
+def due_sessions(window: int) -> list[tuple[str, dict, float]]:
+    """Return (token, session, expires_at) for unwarned sessions expiring within window.
+
+    Only the due range of the expiry index is read; entries for sessions
+    that already expired or were deleted are dropped from the index.
+    """
+    now = time.time()
+    pipe = _redis.pipeline(transaction=False)
+    pipe.zremrangebyscore(EXPIRY_KEY, "-inf", now)
+    pipe.zrangebyscore(EXPIRY_KEY, now, now + window, withscores=True)
+    _, due = pipe.execute()
+    if not due:
+        return []
+
+    pipe = _redis.pipeline(transaction=False)
+    for token, _ in due:
+        pipe.exists(_key(WARNED_PREFIX, token))
+    warned = pipe.execute()
+
+    pending = [(token, expires_at) for (token, expires_at), w in zip(due, warned) if not w]
+    sessions = get_sessions([token for token, _ in pending])
+
+    result = []
+    gone = []
+    for (token, expires_at), data in zip(pending, sessions):
+        if data is None:
+            gone.append(token)
+        else:
+            result.append((token, data, expires_at))
+    if gone:
+        _redis.zrem(EXPIRY_KEY, *gone)
+    return result
+
+
+def mark_warned(token: str, expires_at: float) -> None:
+    """Remember a warning until the session's current expiry time."""
+    mark_warned_many([(token, expires_at)])
+
+
+def mark_warned_many(sessions: list[tuple[str, float]]) -> None:
+    """mark_warned for (token, expires_at) pairs, in one round trip."""
+    if not sessions:
+        return
+    now = time.time()
+    pipe = _redis.pipeline(transaction=False)
+    for token, expires_at in sessions:
+        pipe.set(_key(WARNED_PREFIX, token), "1", ex=max(int(expires_at - now), 1))
+    pipe.execute()
+
+
+def backfill_expiry_index() -> int:
+    """Index sessions created before the expiry index existed (runs once)."""
+    if not _redis.set(_BACKFILL_MARKER, "1", nx=True):
+        return 0
+
+    now = int(time.time())
+    count = 0
+    batch = []
+
+    def flush_batch():
+        pipe = _redis.pipeline(transaction=False)
+        for key in batch:
+            pipe.ttl(key)
+        ttls = pipe.execute()
+        pipe = _redis.pipeline(transaction=False)
+        for key, ttl in zip(batch, ttls):
+            if ttl > 0:
+                pipe.zadd(EXPIRY_KEY, {redis_conn.ident(SESSION_PREFIX, key): now + ttl}, nx=True)
+        pipe.execute()
+        batch.clear()
+
+    for key in _redis.scan_iter(f"{SESSION_PREFIX}*", count=1000):
+        batch.append(key)
+        count += 1
+        if len(batch) >= 1000:
+            flush_batch()
+    if batch:
+        flush_batch()
+
+    # Carry over warnings recorded in the old shared set
+    legacy = _redis.smembers(LEGACY_WARNED_KEY)
+    if legacy:
+        pipe = _redis.pipeline(transaction=False)
+        for token in legacy:
+            pipe.set(_key(WARNED_PREFIX, token), "1", ex=config.SESSION_WARNING_THRESHOLD)
+        pipe.delete(LEGACY_WARNED_KEY)
+        pipe.execute()
+
+    log.info("Expiry index backfilled with %d sessions", count)
+    return count
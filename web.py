@@ -1,33 +1,40 @@
+import ipaddress
 import json
 import logging
 import random
 import string
+import threading
 import time
 import urllib.request
 import urllib.parse
 
-from flask import Flask, jsonify, make_response, render_template, request
-from werkzeug.middleware.proxy_fix import ProxyFix
+from flask import Flask, Response, g, jsonify, make_response, render_template, request, stream_with_context
 
+import audit
+import challenge
 import config
+import events
 import firewall
+import metrics
+import prefixset
+import profiles
+import proxy
+import ratelimit
+import session_tokens
+import store
 
 log = logging.getLogger(__name__)
 
 app = Flask(__name__)
-app.wsgi_app = ProxyFix(
-    app.wsgi_app,
-    x_for=config.PROXY_FIX_X_FOR,
-    x_proto=1,
-    x_host=1,
-    x_prefix=1,
-)
+app.wsgi_app = proxy.TrustedProxyMiddleware(app.wsgi_app, proxy.load_trusted(), x_for=config.PROXY_FIX_X_FOR)
+config.on_reload(app.wsgi_app.reload)
 
 _redis = None
 
 CHARS = string.ascii_uppercase + string.digits
 
 SESSION_COOKIE = "wl_session"
+POW_COOKIE = "wl_pow"
 
 
 def init(redis_client):
@@ -35,8 +42,39 @@ def init(redis_client):
     _redis = redis_client
 
 
+@app.before_request
+def _resolve_profile():
+    """Server profile of the request: "profile" query string or JSON field, default otherwise."""
+    data = request.get_json(silent=True)
+    name = request.args.get("profile") or (data.get("profile") if isinstance(data, dict) else None)
+    try:
+        g.profile = profiles.resolve(name)
+    except ValueError:
+        return jsonify({"ok": False, "error": "unknown_profile", "message": "Servidor desconhecido."}), 404
+
+
+@app.context_processor
+def _profile_context():
+    profile = g.get("profile", profiles.DEFAULT)
+    return {"profile_query": "" if profile == profiles.DEFAULT else f"?profile={profile}"}
+
+
+def _session_cookie(profile: str | None) -> str:
+    """One session cookie per profile, so a browser can hold sessions on several servers."""
+    if not profile or profile == profiles.DEFAULT:
+        return SESSION_COOKIE
+    return f"{SESSION_COOKIE}_{profile}"
+
+
+def _set_session_cookie(resp, token: str, profile: str | None) -> None:
+    resp.set_cookie(
+        _session_cookie(profile), token,
+        max_age=profiles.session_ttl(profile), httponly=True, samesite="Lax",
+    )
+
+
 def _get_real_ip() -> str:
-    """Return the real client IP. ProxyFix already resolves X-Forwarded-For."""
+    """Return the real client IP. TrustedProxyMiddleware already resolves X-Forwarded-For."""
     return request.remote_addr
 
 
@@ -44,19 +82,6 @@ def _generate_code() -> str:
     return "".join(random.choices(CHARS, k=4))
 
 
-def _check_rate_limit(ip: str) -> bool:
-    """Return True if the IP is within rate limits (max 3 codes per 5 min)."""
-    key = f"whitelist:ratelimit:{ip}"
-    count = _redis.get(key)
-    if count is not None and int(count) >= 3:
-        return False
-    pipe = _redis.pipeline()
-    pipe.incr(key)
-    pipe.expire(key, 300)
-    pipe.execute()
-    return True
-
-
 def _verify_recaptcha(token: str) -> bool:
     """Verify a reCAPTCHA v3 response token with Google.
 
@@ -103,15 +128,19 @@ def _verify_recaptcha(token: str) -> bool:
     return True
 
 
+def _signed_session(token) -> bool:
+    """Whether token is a signed (not legacy) session token, checked without Redis."""
+    return isinstance(token, str) and not session_tokens.is_legacy(token) and session_tokens.verify(token)
+
+
 def _get_session_data() -> dict | None:
-    """Return session data from cookie, or None if invalid/missing."""
-    token = request.cookies.get(SESSION_COOKIE)
-    if not token:
+    """Return session data from the request profile's cookie, or None if invalid/missing."""
+    token = request.cookies.get(_session_cookie(g.profile))
+    if not token or not session_tokens.verify(token):
         return None
-    raw = _redis.get(f"whitelist:session:{token}")
-    if not raw:
+    data = store.get_session(token)
+    if not data or data.get("profile", profiles.DEFAULT) != g.profile:
         return None
-    data = json.loads(raw)
     data["_token"] = token
     return data
 
@@ -120,28 +149,22 @@ def _update_session_ip(session_data: dict, new_ip: str) -> bool:
     """Update the session and firewall with a new IP."""
     token = session_data["_token"]
     old_ip = session_data.get("ip")
+    profile = session_data.get("profile")
 
-    # Remove old IP from firewall and active records
+    # Remove old IP from firewall
     if old_ip and old_ip != new_ip:
-        firewall.remove_ip(old_ip)
-        _redis.delete(f"whitelist:active:{old_ip}")
+        firewall.remove_ip(old_ip, profile)
 
     # Add new IP
-    if not firewall.add_ip(new_ip):
+    if not firewall.add_ip(new_ip, profile):
         return False
 
-    # Update active record
-    active_data = json.dumps({
-        "discord_id": session_data["discord_id"],
-        "discord_name": session_data["discord_name"],
-        "timestamp": time.time(),
-    })
-    _redis.set(f"whitelist:active:{new_ip}", active_data)
-
-    # Update session with new IP
+    # Move active record, session and per-user index in one transaction
+    store.move_session(token, session_data, new_ip)
     session_data["ip"] = new_ip
-    updated = {k: v for k, v in session_data.items() if k != "_token"}
-    _redis.setex(f"whitelist:session:{token}", config.SESSION_TTL, json.dumps(updated))
+    if old_ip != new_ip:
+        audit.record("moved", ip=new_ip, discord_id=session_data.get("discord_id"),
+                     name=session_data.get("discord_name"), detail=f"from {old_ip or '-'}, {profile or profiles.DEFAULT}")
 
     return True
 
@@ -149,39 +172,47 @@ def _update_session_ip(session_data: dict, new_ip: str) -> bool:
 @app.route("/")
 def index():
     ip = _get_real_ip()
+
+    if prefixset.blocked(ip):
+        return render_template("index.html", code=None, already=False, ip=ip, ttl=0,
+                               error="blocked", renew=False, recaptcha_key=""), 403
+
+    # Attack mode: solve the challenge before Redis is touched, unless a
+    # signed session cookie vouches for the visitor. The solved cookie
+    # stays valid until the challenge expires
+    challenge.record_hit()
+    if (challenge.active() and not _signed_session(request.cookies.get(_session_cookie(g.profile)))
+            and not challenge.verify(ip, request.cookies.get(POW_COOKIE, ""), once=False)):
+        return render_template("challenge.html", cookie_name=POW_COOKIE, cookie_ttl=config.POW_TTL,
+                               **challenge.issue(ip))
+
+    profile = g.profile
     session = _get_session_data()
 
     # Check if there's a pending session cookie to set (after Discord validation)
-    if firewall.is_whitelisted(ip):
-        pending_token = _redis.get(f"whitelist:pending_session:{ip}")
+    if firewall.is_whitelisted(ip, profile):
+        pending_token = store.pop_pending(ip, profile)
         if pending_token:
-            _redis.delete(f"whitelist:pending_session:{ip}")
             # Renew session TTL when user visits
-            _redis.expire(f"whitelist:session:{pending_token}", config.SESSION_TTL)
+            store.touch_session(pending_token, ip, profile)
             resp = make_response(
                 render_template("index.html", code=None, already=True, ip=ip, ttl=0,
                                 renew=False, recaptcha_key="")
             )
-            resp.set_cookie(
-                SESSION_COOKIE, pending_token,
-                max_age=config.SESSION_TTL, httponly=True, samesite="Lax",
-            )
+            _set_session_cookie(resp, pending_token, profile)
             return resp
 
         # Session exists and IP matches → renew session TTL on each visit
         if session:
             token = session["_token"]
             # Renew session and cookie TTL
-            _redis.expire(f"whitelist:session:{token}", config.SESSION_TTL)
+            store.touch_session(token, session.get("ip"), profile)
             log.info("Session renewed for %s (IP: %s)", session.get("discord_name"), ip)
             resp = make_response(
                 render_template("index.html", code=None, already=True, ip=ip, ttl=0,
                                 renew=False, recaptcha_key="")
             )
-            resp.set_cookie(
-                SESSION_COOKIE, token,
-                max_age=config.SESSION_TTL, httponly=True, samesite="Lax",
-            )
+            _set_session_cookie(resp, token, profile)
             return resp
 
         return render_template("index.html", code=None, already=True, ip=ip, ttl=0,
@@ -199,10 +230,7 @@ def index():
                                 renew=False, recaptcha_key="", auto_renewed=True,
                                 discord_name=session.get("discord_name", ""))
             )
-            resp.set_cookie(
-                SESSION_COOKIE, session["_token"],
-                max_age=config.SESSION_TTL, httponly=True, samesite="Lax",
-            )
+            _set_session_cookie(resp, session["_token"], profile)
             return resp
         else:
             # If auto-renewal failed, show manual renewal option with reCAPTCHA
@@ -213,16 +241,15 @@ def index():
                                        discord_name=session.get("discord_name", ""))
 
     # Normal flow: generate a new code
-    if not _check_rate_limit(ip):
+    if not ratelimit.allow("index", ip):
         return render_template("index.html", code=None, already=False, ip=ip, ttl=0,
                                error="rate_limit", renew=False, recaptcha_key=""), 429
 
     code = _generate_code()
 
-    data = json.dumps({"ip": ip, "created_at": time.time()})
-    _redis.setex(f"whitelist:code:{code}", config.CODE_TTL, data)
+    store.create_code(code, ip, profile)
 
-    log.info("Code %s generated for IP %s", code, ip)
+    log.info("Code %s generated for IP %s (%s)", code, ip, profile)
 
     return render_template("index.html", code=code, already=False, ip=ip, ttl=config.CODE_TTL,
                            renew=False, recaptcha_key="")
@@ -233,6 +260,9 @@ def renew():
     ip = _get_real_ip()
     session = _get_session_data()
 
+    if prefixset.blocked(ip):
+        return jsonify({"ok": False, "error": "Rede bloqueada. Contate um administrador."}), 403
+
     if not session:
         return jsonify({"ok": False, "error": "Sessao invalida ou expirada. Use o fluxo normal com codigo."}), 401
 
@@ -253,10 +283,7 @@ def renew():
 
     # Refresh the session cookie TTL
     resp = make_response(jsonify({"ok": True}))
-    resp.set_cookie(
-        SESSION_COOKIE, session["_token"],
-        max_age=config.SESSION_TTL, httponly=True, samesite="Lax",
-    )
+    _set_session_cookie(resp, session["_token"], g.profile)
     return resp
 
 
@@ -265,17 +292,81 @@ def health():
     return jsonify({"status": "ok"})
 
 
+@app.route("/metrics")
+def metrics_view():
+    if config.METRICS_TOKEN and request.headers.get("X-Metrics-Token") != config.METRICS_TOKEN:
+        return jsonify({"ok": False, "error": "forbidden"}), 403
+    return jsonify({**metrics.snapshot(), **prefixset.stats()})
+
+
 @app.route("/status")
 def status():
     ip = request.args.get("ip", _get_real_ip())
-    whitelisted = firewall.is_whitelisted(ip)
-    return jsonify({"ip": ip, "whitelisted": whitelisted})
+    whitelisted = firewall.is_whitelisted(ip, g.profile, from_replica=True)
+    return jsonify({"ip": ip, "whitelisted": whitelisted, "profile": g.profile})
+
+
+@app.route("/status/bulk", methods=["POST"])
+def status_bulk():
+    """
+    Whitelist status for many IPs at once (game server connection checks).
+
+    Body: {"ips": ["1.2.3.4", ...], "profile": "..."} with at most STATUS_BULK_MAX entries
+    (default 500). The lookup is a single pipelined round trip, so latency stays flat with
+    batch size; target is under 20 ms server-side for a full batch.
+
+    The owner fields (discord_id, discord_name) are only included when the request carries
+    STATUS_BULK_TOKEN in the X-Status-Token header; anyone else only gets whitelisted/age.
+    """
+    data = request.get_json(silent=True) or {}
+    ips = data.get("ips") if isinstance(data, dict) else None
+    if not isinstance(ips, list):
+        return jsonify({"ok": False, "error": "invalid_body", "message": "Expected {\"ips\": [...]}"}), 400
+    if len(ips) > config.STATUS_BULK_MAX:
+        return jsonify({
+            "ok": False,
+            "error": "batch_too_large",
+            "max": config.STATUS_BULK_MAX,
+        }), 413
+
+    results = []
+    valid = []
+    for raw_ip in ips:
+        try:
+            ip = str(ipaddress.ip_address(str(raw_ip)))
+        except ValueError:
+            results.append({"ip": raw_ip, "error": "invalid_ip"})
+            continue
+        entry = {"ip": ip}
+        results.append(entry)
+        valid.append(entry)
+
+    owners = bool(config.STATUS_BULK_TOKEN) and request.headers.get("X-Status-Token") == config.STATUS_BULK_TOKEN
+    now = time.time()
+    records = store.get_active_many([entry["ip"] for entry in valid], from_replica=True, profile=g.profile)
+    for entry, record in zip(valid, records):
+        entry["whitelisted"] = record is not None
+        if record:
+            if owners:
+                entry["discord_id"] = record.get("discord_id")
+                entry["discord_name"] = record.get("discord_name")
+            entry["age"] = int(now - record["timestamp"]) if record.get("timestamp") else None
+
+    return jsonify({"ok": True, "results": results})
 
 
 # ============================================================
 # API Endpoints para Cliente Desktop
 # ============================================================
 
+def _blocked_response():
+    return jsonify({
+        "ok": False,
+        "error": "blocked_network",
+        "message": "Sua rede esta bloqueada (VPN/hospedagem). Contate um administrador.",
+    }), 403
+
+
 @app.route("/api/request-code", methods=["POST"])
 def api_request_code():
     """
@@ -284,15 +375,35 @@ def api_request_code():
 
     Parâmetros opcionais (JSON body):
     - force: bool - Força geração de novo código mesmo se IP já liberado
+    - pow: str - "<challenge>:<n>", exigido em modo de ataque (erro pow_required)
+    - profile: str - Servidor (perfil) a liberar; padrão: perfil principal
     """
     ip = _get_real_ip()
+    profile = g.profile
     data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({"ok": False, "error": "invalid_body", "message": "Esperado um objeto JSON."}), 400
     force_new_code = data.get("force", False)
 
+    if prefixset.blocked(ip):
+        return _blocked_response()
+
+    # Attack mode: require a solved challenge before touching Redis, unless
+    # the client holds a signed session token
+    challenge.record_hit()
+    if (challenge.active() and not _signed_session(request.headers.get("X-Session-Token") or data.get("session_token"))
+            and not challenge.verify(ip, data.get("pow", ""))):
+        return jsonify({
+            "ok": False,
+            "error": "pow_required",
+            "message": "Portal sob alto volume de acessos. Resolva o desafio e tente novamente.",
+            **challenge.issue(ip),
+        }), 403
+
     # Verificar se já está liberado
-    if firewall.is_whitelisted(ip) and not force_new_code:
+    if firewall.is_whitelisted(ip, profile) and not force_new_code:
         # Verificar se tem sessão pendente
-        pending_token = _redis.get(f"whitelist:pending_session:{ip}")
+        pending_token = store.get_pending(ip, profile)
         if pending_token:
             return jsonify({
                 "ok": True,
@@ -303,19 +414,20 @@ def api_request_code():
 
         # IP liberado mas sem sessão - criar sessão automaticamente
         # Buscar dados do registro ativo
-        active_raw = _redis.get(f"whitelist:active:{ip}")
-        if active_raw:
-            active_data = json.loads(active_raw)
+        active_data = store.get_active(ip, profile)
+        if active_data:
             # Criar nova sessão
-            token = "".join(random.choices(string.ascii_letters + string.digits, k=32))
-            session_data = {
-                "discord_id": active_data.get("discord_id", ""),
-                "discord_name": active_data.get("discord_name", "Usuario"),
-                "ip": ip,
-                "created_at": time.time(),
-            }
-            _redis.setex(f"whitelist:session:{token}", config.SESSION_TTL, json.dumps(session_data))
+            token = session_tokens.issue()
+            session_data = store.create_session(
+                token,
+                active_data.get("discord_id", ""),
+                active_data.get("discord_name", "Usuario"),
+                ip,
+                profile,
+            )
             log.info("[API] Session created for already whitelisted IP %s (discord: %s)", ip, session_data["discord_name"])
+            audit.record("session", ip=ip, discord_id=session_data.get("discord_id"),
+                         name=session_data["discord_name"])
 
             return jsonify({
                 "ok": True,
@@ -336,7 +448,7 @@ def api_request_code():
         })
 
     # Rate limit
-    if not _check_rate_limit(ip):
+    if not ratelimit.allow("api_request_code", ip):
         return jsonify({
             "ok": False,
             "error": "rate_limit",
@@ -345,59 +457,138 @@ def api_request_code():
 
     # Gerar código
     code = _generate_code()
-    data = json.dumps({"ip": ip, "created_at": time.time()})
-    _redis.setex(f"whitelist:code:{code}", config.CODE_TTL, data)
+    store.create_code(code, ip, profile)
 
-    log.info("[API] Code %s generated for IP %s", code, ip)
+    log.info("[API] Code %s generated for IP %s (%s)", code, ip, profile)
 
     return jsonify({
         "ok": True,
         "code": code,
         "ip": ip,
         "ttl": config.CODE_TTL,
-        "message": f"Digite o codigo {code} no canal do Discord",
+        "message": f"Use /codigo {code} no Discord",
     })
 
 
-@app.route("/api/check-code", methods=["POST"])
-def api_check_code():
-    """
-    Verifica se um código foi validado no Discord.
-    Retorna o session_token se validado.
-    """
-    ip = _get_real_ip()
-
+def _check_code_result(ip: str, profile: str) -> dict:
+    """Validation state for an IP, consuming the pending session token."""
     # Verificar se está liberado
-    if not firewall.is_whitelisted(ip):
-        return jsonify({
+    if not firewall.is_whitelisted(ip, profile):
+        return {
             "ok": False,
             "validated": False,
             "message": "IP ainda nao liberado. Digite o codigo no Discord.",
-        })
+        }
 
     # Buscar session token pendente
-    pending_token = _redis.get(f"whitelist:pending_session:{ip}")
+    pending_token = store.pop_pending(ip, profile)
     if pending_token:
-        # Remover da lista de pendentes
-        _redis.delete(f"whitelist:pending_session:{ip}")
 
         log.info("[API] Session token delivered for IP %s", ip)
 
-        return jsonify({
+        return {
             "ok": True,
             "validated": True,
             "session_token": pending_token,
-            "session_ttl": config.SESSION_TTL,
+            "session_ttl": profiles.session_ttl(profile),
             "message": "Codigo validado! Sessao criada.",
-        })
+        }
 
     # IP liberado mas sem token pendente (validação antiga)
-    return jsonify({
+    return {
         "ok": True,
         "validated": True,
         "session_token": None,
         "message": "IP liberado, mas sessao ja foi coletada anteriormente.",
-    })
+    }
+
+
+@app.route("/api/check-code", methods=["POST"])
+def api_check_code():
+    """
+    Verifica se um código foi validado no Discord.
+    Retorna o session_token se validado.
+    """
+    return jsonify(_check_code_result(_get_real_ip(), g.profile))
+
+
+# Slots for requests held open by /api/wait-code and /api/code-events (per process)
+_holds = threading.BoundedSemaphore(config.WEB_MAX_HOLDS)
+
+
+@app.route("/api/wait-code", methods=["POST"])
+def api_wait_code():
+    """
+    Long-poll de /api/check-code: segura a requisição até o bot validar o
+    código (evento via Redis pub/sub) ou até o timeout, e então responde
+    no mesmo formato de /api/check-code.
+
+    Parâmetros opcionais (JSON body):
+    - timeout: int - Segundos de espera (máximo WAIT_CODE_TIMEOUT)
+    """
+    ip = _get_real_ip()
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({"ok": False, "error": "invalid_body", "message": "Esperado um objeto JSON."}), 400
+    try:
+        timeout = min(float(data.get("timeout", config.WAIT_CODE_TIMEOUT)), config.WAIT_CODE_TIMEOUT)
+    except (TypeError, ValueError):
+        timeout = config.WAIT_CODE_TIMEOUT
+
+    profile = g.profile
+    if not _holds.acquire(blocking=False):
+        # Every hold slot taken: answer now, the client polls again
+        metrics.incr("holds.refused")
+        return jsonify(_check_code_result(ip, profile))
+    event = events.subscribe(ip, profile)
+    try:
+        result = _check_code_result(ip, profile)
+        if result["validated"] or not event.wait(timeout):
+            return jsonify(result)
+    finally:
+        events.unsubscribe(ip, event, profile)
+        _holds.release()
+
+    return jsonify(_check_code_result(ip, profile))
+
+
+@app.route("/api/code-events")
+def api_code_events():
+    """
+    Server-Sent Events for the portal page: emits a single "validated" event
+    once the code for the caller's IP is validated, then closes. The page
+    reloads to pick up the session cookie.
+    """
+    ip = _get_real_ip()
+    profile = g.profile
+
+    def stream():
+        # The slot is taken inside the generator so it is only released by
+        # code that is sure to run (a never-started generator runs no finally)
+        if not _holds.acquire(blocking=False):
+            metrics.incr("holds.refused")
+            yield f"retry: {config.HOLD_RETRY * 1000}\n\n"
+            return
+        try:
+            yield "retry: 5000\n\n"
+            deadline = time.monotonic() + config.CODE_TTL
+            while time.monotonic() < deadline:
+                event = events.subscribe(ip, profile)
+                try:
+                    if firewall.is_whitelisted(ip, profile) or event.wait(config.WAIT_CODE_TIMEOUT):
+                        yield "event: validated\ndata: {}\n\n"
+                        return
+                finally:
+                    events.unsubscribe(ip, event, profile)
+                yield ": keepalive\n\n"
+        finally:
+            _holds.release()
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.route("/api/refresh-session", methods=["POST"])
@@ -412,6 +603,8 @@ def api_refresh_session():
     token = request.headers.get("X-Session-Token")
     if not token:
         data = request.get_json(silent=True) or {}
+        if not isinstance(data, dict):
+            return jsonify({"ok": False, "error": "invalid_body", "message": "Esperado um objeto JSON."}), 400
         token = data.get("session_token")
 
     if not token:
@@ -421,21 +614,36 @@ def api_refresh_session():
             "message": "Token de sessao nao fornecido.",
         }), 400
 
-    # Verificar sessão
-    raw = _redis.get(f"whitelist:session:{token}")
-    if not raw:
+    if prefixset.blocked(ip):
+        return _blocked_response()
+
+    # Verificar sessão (dados e TTL numa única ida ao Redis); tokens forjados
+    # ou expirados são recusados sem consultar o Redis
+    session_data, ttl = store.get_session_with_ttl(token) if session_tokens.verify(token) else (None, 0)
+    if not session_data:
         return jsonify({
             "ok": False,
             "error": "invalid_session",
             "message": "Sessao invalida ou expirada. Faca o processo novamente.",
         }), 401
 
-    session_data = json.loads(raw)
     session_data["_token"] = token
     old_ip = session_data.get("ip")
-
-    # Atualizar IP se mudou
-    if old_ip != ip:
+    # O perfil vem da sessão, não do parâmetro da requisição
+    profile = session_data.get("profile")
+    session_ttl = store.renewal_ttl(token, profile)
+
+    if old_ip == ip:
+        # Heartbeat sem mudança: só renova o TTL quando já caiu abaixo da
+        # fração configurada, senão responde sem escrever nada
+        if ttl < session_ttl * config.SESSION_REFRESH_FRACTION:
+            store.touch_session(token, ip, profile)
+            ttl = session_ttl
+            metrics.incr("refresh.ttl_writes")
+        else:
+            metrics.incr("refresh.writes_skipped")
+    else:
+        # Atualizar IP
         success = _update_session_ip(session_data, ip)
         if not success:
             return jsonify({
@@ -445,11 +653,7 @@ def api_refresh_session():
             }), 500
 
         log.info("[API] IP updated: %s -> %s (discord: %s)", old_ip, ip, session_data.get("discord_name"))
-    else:
-        # Apenas renovar TTL
-        _redis.expire(f"whitelist:session:{token}", config.SESSION_TTL)
-
-    ttl = _redis.ttl(f"whitelist:session:{token}")
+        ttl = session_ttl
 
     return jsonify({
         "ok": True,
@@ -458,6 +662,7 @@ def api_refresh_session():
         "ip_changed": old_ip != ip,
         "session_ttl": ttl,
         "discord_name": session_data.get("discord_name"),
+        "profile": profile or profiles.DEFAULT,
         "message": "Sessao renovada com sucesso.",
     })
 
@@ -479,17 +684,16 @@ def api_session_info():
             "error": "missing_token",
         }), 400
 
-    raw = _redis.get(f"whitelist:session:{token}")
-    if not raw:
+    session_data = store.get_session(token) if session_tokens.verify(token) else None
+    if not session_data:
         return jsonify({
             "ok": False,
             "error": "invalid_session",
             "valid": False,
         }), 401
 
-    session_data = json.loads(raw)
-    ttl = _redis.ttl(f"whitelist:session:{token}")
-    whitelisted = firewall.is_whitelisted(ip)
+    ttl = store.session_ttl(token)
+    whitelisted = firewall.is_whitelisted(ip, session_data.get("profile"))
 
     return jsonify({
         "ok": True,
@@ -499,6 +703,7 @@ def api_session_info():
         "ip_match": session_data.get("ip") == ip,
         "whitelisted": whitelisted,
         "discord_name": session_data.get("discord_name"),
+        "profile": session_data.get("profile", profiles.DEFAULT),
         "session_ttl": ttl,
         "session_ttl_days": ttl // 86400 if ttl > 0 else 0,
     })
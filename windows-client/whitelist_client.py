@@ -9,15 +9,19 @@ Faz todo o processo de whitelist automaticamente:
 4. Renova automaticamente
 """
 
+import hashlib
 import json
 import logging
 import os
+import random
+import socket
 import sys
 import threading
 import time
 import webbrowser
 from datetime import datetime
 from pathlib import Path
+from urllib.parse import urlparse
 
 import pystray
 import requests
@@ -32,7 +36,10 @@ LOG_FILE = Path(os.getenv("APPDATA", ".")) / "ElysiusShield" / "client.log"
 # Valores padrão
 DEFAULT_CONFIG = {
     "portal_url": "https://shield.elysiusrp.com.br",
-    "refresh_interval": 60,  # segundos
+    "profile": "",  # servidor do portal (vazio = padrão)
+    "refresh_interval": 60,  # segundos entre verificacoes locais de IP
+    "max_refresh_interval": 900,  # renova no portal pelo menos a cada N segundos
+    "refresh_ttl_threshold": 2 * 86400,  # renova quando a sessao tiver menos que isso
     "session_token": "",
     "discord_name": "",
     "last_ip": "",
@@ -48,6 +55,17 @@ _config = DEFAULT_CONFIG.copy()
 _pending_code = None
 _code_check_active = False
 
+# Conexão HTTP persistente (keep-alive) reutilizada por todas as chamadas
+_http = requests.Session()
+
+# Agendamento das renovações
+BACKOFF_BASE = 5  # segundos
+BACKOFF_MAX = 600
+_local_ip = ""
+_next_server_refresh = 0.0  # time.monotonic()
+_session_expires = 0.0  # time.monotonic()
+_failures = 0
+
 
 def setup_logging():
     """Configura o logging para arquivo e console."""
@@ -96,7 +114,10 @@ def save_config():
         # Salvar apenas campos persistentes
         to_save = {
             "portal_url": _config.get("portal_url", DEFAULT_CONFIG["portal_url"]),
+            "profile": _config.get("profile", ""),
             "refresh_interval": _config.get("refresh_interval", DEFAULT_CONFIG["refresh_interval"]),
+            "max_refresh_interval": _config.get("max_refresh_interval", DEFAULT_CONFIG["max_refresh_interval"]),
+            "refresh_ttl_threshold": _config.get("refresh_ttl_threshold", DEFAULT_CONFIG["refresh_ttl_threshold"]),
             "session_token": _config.get("session_token", ""),
             "discord_name": _config.get("discord_name", ""),
             "last_ip": _config.get("last_ip", ""),
@@ -180,19 +201,21 @@ def show_notification(title: str, message: str):
             log.warning("Erro ao mostrar notificacao: %s", e)
 
 
-def api_request(endpoint: str, method: str = "GET", data: dict = None) -> dict:
+def api_request(endpoint: str, method: str = "GET", data: dict = None, timeout: float = 15) -> dict:
     """Faz uma requisição à API do portal."""
     url = _config["portal_url"].rstrip("/") + endpoint
 
     headers = {}
     if _config.get("session_token"):
         headers["X-Session-Token"] = _config["session_token"]
+    # Servidor (perfil) do portal; sessões só valem no servidor em que foram criadas
+    params = {"profile": _config["profile"]} if _config.get("profile") else None
 
     try:
         if method == "GET":
-            response = requests.get(url, headers=headers, timeout=15)
+            response = _http.get(url, headers=headers, params=params, timeout=timeout)
         else:
-            response = requests.post(url, headers=headers, json=data, timeout=15)
+            response = _http.post(url, headers=headers, params=params, json=data, timeout=timeout)
 
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -203,6 +226,20 @@ def api_request(endpoint: str, method: str = "GET", data: dict = None) -> dict:
         return {"ok": False, "error": "invalid_response", "message": str(e)}
 
 
+def solve_challenge(challenge: str, difficulty: int) -> str:
+    """
+    Resolve o desafio do modo de ataque do portal: encontra n tal que
+    sha256("<challenge>:<n>") comece com `difficulty` bits zero.
+    """
+    target = 1 << (256 - difficulty)
+    n = 0
+    while True:
+        solved = f"{challenge}:{n}"
+        if int.from_bytes(hashlib.sha256(solved.encode()).digest(), "big") < target:
+            return solved
+        n += 1
+
+
 def request_code(force: bool = False) -> tuple[bool, str, str]:
     """
     Solicita um novo código de whitelist.
@@ -217,6 +254,12 @@ def request_code(force: bool = False) -> tuple[bool, str, str]:
 
     result = api_request("/api/request-code", "POST", {"force": force})
 
+    if result.get("error") == "pow_required":
+        # Portal em modo de ataque: resolver o desafio e repetir
+        update_icon_status("Aguardando codigo", "Verificando...", "...")
+        solved = solve_challenge(result["challenge"], result["difficulty"])
+        result = api_request("/api/request-code", "POST", {"force": force, "pow": solved})
+
     if not result.get("ok"):
         error = result.get("error", "unknown")
         msg = result.get("message", "Erro desconhecido")
@@ -252,12 +295,31 @@ def request_code(force: bool = False) -> tuple[bool, str, str]:
     return True, code, ip
 
 
+WAIT_CODE_TIMEOUT = 25  # segundos que o portal segura o long-poll
+_long_poll_supported = True
+
+
 def check_code_validated() -> tuple[bool, str]:
     """
     Verifica se o código foi validado no Discord.
+    Usa o long-poll /api/wait-code, que responde assim que o bot valida o
+    código; portais antigos sem o endpoint caem em /api/check-code.
     Retorna: (validado, mensagem)
     """
-    result = api_request("/api/check-code", "POST")
+    global _long_poll_supported
+
+    result = None
+    if _long_poll_supported:
+        result = api_request(
+            "/api/wait-code", "POST", {"timeout": WAIT_CODE_TIMEOUT},
+            timeout=WAIT_CODE_TIMEOUT + 10,
+        )
+        if result.get("error") == "invalid_response":
+            log.info("Portal sem /api/wait-code, usando polling")
+            _long_poll_supported = False
+            result = None
+    if result is None:
+        result = api_request("/api/check-code", "POST")
 
     if not result.get("ok"):
         return False, result.get("message", "Aguardando validacao...")
@@ -275,12 +337,51 @@ def check_code_validated() -> tuple[bool, str]:
     return False, result.get("message", "Aguardando...")
 
 
+def get_local_ip() -> str:
+    """
+    IP local usado para alcançar o portal. Não envia pacotes: um socket UDP
+    "conectado" só consulta a tabela de rotas. Muda quando o PC troca de
+    rede/adaptador; retorna "" se não for possível determinar.
+    """
+    host = urlparse(_config["portal_url"]).hostname
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect((host, 443))
+            return s.getsockname()[0]
+    except (OSError, TypeError):
+        return ""
+
+
+def refresh_due() -> bool:
+    """
+    Decide se é preciso chamar o portal. Sem mudança de IP local, só renova
+    quando a sessão se aproxima do fim ou após max_refresh_interval (o IP
+    público pode mudar sem mudar o IP local, p.ex. atrás de NAT).
+    """
+    now = time.monotonic()
+    if now >= _next_server_refresh:
+        return True
+    if _session_expires - now < _config.get("refresh_ttl_threshold", DEFAULT_CONFIG["refresh_ttl_threshold"]):
+        return True
+    local_ip = get_local_ip()
+    if local_ip and local_ip != _local_ip:
+        log.info("IP local mudou: %s -> %s", _local_ip or "?", local_ip)
+        return True
+    return False
+
+
+def backoff_delay(failures: int) -> float:
+    """Espera exponencial com jitter entre tentativas que falharam."""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (failures - 1))
+    return random.uniform(delay / 2, delay)
+
+
 def refresh_session() -> tuple[bool, str]:
     """
     Renova a sessão atual.
     Retorna: (sucesso, mensagem)
     """
-    global _last_refresh
+    global _last_refresh, _local_ip, _next_server_refresh, _session_expires
 
     if not _config.get("session_token"):
         return False, "Sem sessao ativa"
@@ -304,7 +405,15 @@ def refresh_session() -> tuple[bool, str]:
     _last_refresh = datetime.now()
     ip = result.get("ip", "")
     discord_name = result.get("discord_name", "")
-    ttl_days = result.get("session_ttl", 0) // 86400
+    session_ttl = result.get("session_ttl", 0)
+    ttl_days = session_ttl // 86400
+
+    # Próxima renovação com jitter, para os clientes não ficarem sincronizados
+    max_interval = _config.get("max_refresh_interval", DEFAULT_CONFIG["max_refresh_interval"])
+    now = time.monotonic()
+    _next_server_refresh = now + random.uniform(0.8, 1.0) * max_interval
+    _session_expires = now + session_ttl
+    _local_ip = get_local_ip()
 
     # Atualizar config
     if discord_name:
@@ -331,17 +440,15 @@ def get_session_info() -> dict:
 
 
 def code_check_loop():
-    """Loop que verifica se o código foi validado."""
+    """Loop que aguarda a validação do código (long-poll no portal)."""
     global _code_check_active, _pending_code
 
     _code_check_active = True
-    attempts = 0
-    max_attempts = 60  # 5 minutos (5s * 60)
-
-    while _running and _code_check_active and _pending_code and attempts < max_attempts:
-        time.sleep(5)
-        attempts += 1
+    timeout = 300  # 5 minutos
+    deadline = time.monotonic() + timeout
 
+    while _running and _code_check_active and _pending_code and time.monotonic() < deadline:
+        started = time.monotonic()
         validated, msg = check_code_validated()
 
         if validated:
@@ -352,8 +459,13 @@ def code_check_loop():
             log.info("Validacao concluida: %s", msg)
             return
 
+        # Resposta imediata sem validação (polling ou erro de conexão):
+        # aguardar antes de tentar de novo
+        if time.monotonic() - started < 1:
+            time.sleep(5)
+
         # Atualizar status com código
-        remaining = (max_attempts - attempts) * 5
+        remaining = max(0, int(deadline - time.monotonic()))
         update_icon_status(
             "Aguardando codigo",
             f"Digite {_pending_code} no Discord ({remaining}s)",
@@ -369,36 +481,45 @@ def code_check_loop():
 
 
 def refresh_loop():
-    """Loop principal que renova a sessão periodicamente."""
-    global _running
+    """
+    Loop principal. A cada refresh_interval faz só a verificação local de IP;
+    o portal é chamado quando refresh_due() indica, e falhas são repetidas
+    com backoff exponencial.
+    """
+    global _running, _failures
 
-    # Aguardar um pouco para o ícone carregar
-    time.sleep(2)
+    # Aguardar o ícone carregar, com jitter para espalhar os clientes que
+    # iniciam juntos (p.ex. após queda do portal ou da internet)
+    time.sleep(2 + random.uniform(0, 30))
 
     while _running:
-        # Se tem sessão, renovar
-        if _config.get("session_token"):
-            success, msg = refresh_session()
+        interval = _config.get("refresh_interval", 60)
 
-            if success:
-                update_icon_status("Conectado", msg)
-            else:
-                if "expirada" in msg.lower():
+        # Se tem sessão, renovar quando necessário
+        if _config.get("session_token"):
+            if refresh_due():
+                success, msg = refresh_session()
+
+                if success:
+                    _failures = 0
+                    update_icon_status("Conectado", msg)
+                elif "expirada" in msg.lower():
+                    _failures = 0
                     update_icon_status("Sessao expirada", "Clique para obter novo codigo")
                     show_notification("Sessao Expirada", "Sua sessao expirou. Obtenha um novo codigo.")
                 else:
+                    _failures += 1
+                    interval = backoff_delay(_failures)
                     update_icon_status("Erro", msg)
-                    log.warning("Falha na renovacao: %s", msg)
+                    log.warning("Falha na renovacao (tentativa %d, nova em %.0fs): %s", _failures, interval, msg)
 
         elif not _code_check_active:
             # Sem sessão e não está aguardando código
             update_icon_status("Desconectado", "Clique para obter codigo")
 
         # Aguardar intervalo
-        interval = _config.get("refresh_interval", 60)
-        for _ in range(interval):
-            if not _running:
-                break
+        deadline = time.monotonic() + interval
+        while _running and time.monotonic() < deadline:
             time.sleep(1)
 
 
@@ -447,7 +568,7 @@ def _do_get_code(force: bool = False):
         update_icon_status("Aguardando codigo", f"Digite {code} no Discord", code[:2])
         show_notification(
             f"Codigo: {code}",
-            f"Digite {code} no canal de shield do Discord.\nSeu IP: {ip}"
+            f"Use /codigo {code} no Discord (ou o botao no canal de shield).\nSeu IP: {ip}"
         )
 
         # Iniciar thread de verificação
@@ -586,7 +707,12 @@ def main():
     load_config()
 
     log.info("Portal URL: %s", _config.get("portal_url"))
-    log.info("Intervalo de renovacao: %ds", _config.get("refresh_interval", 60))
+    log.info(
+        "Verificacao de IP a cada %ds, renovacao a cada %ds (ou com menos de %ds de sessao)",
+        _config.get("refresh_interval", 60),
+        _config.get("max_refresh_interval", DEFAULT_CONFIG["max_refresh_interval"]),
+        _config.get("refresh_ttl_threshold", DEFAULT_CONFIG["refresh_ttl_threshold"]),
+    )
     log.info("Sessao existente: %s", "Sim" if _config.get("session_token") else "Nao")
 
     # Criar ícone
@@ -0,0 +1,12 @@
+"""
+WSGI entry point for the web role.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Each worker imports this module, connects to Redis and runs the web
+startup checks; discord.py is never imported.
+"""
+
+import main
+
+app = main.init_web(main.connect_redis())